@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Pluggable clocks shared by the pycan drivers and tools
+
+Every module that needs the current time or has to wait (cyclic
+transmissions, the simulated driver, trace playback) does so through a
+clock object instead of calling `time.time()` / `time.sleep()` directly.
+
+WallClock is the default and simply wraps the time module.  VirtualClock
+keeps its own notion of time which only moves when it is advanced.  When
+it is advanced it jumps straight from one pending wake up to the next, so
+an hour of simulated traffic is processed as fast as the threads involved
+can run while the order of events stays deterministic.
+
+Threads handing work to each other go through the clock's `queue` (and
+`event`) objects, so a VirtualClock knows a woken consumer is running and
+does not move on before it blocked on the clock again.
+"""
+import time
+import heapq
+import Queue
+import itertools
+import threading
+
+SETTLE_TIMEOUT = 1.0  # seconds (real time)
+SETTLE_POLL = 0.01  # seconds (real time), settle watchdog period
+SPIN_THRESHOLD = 0.002  # seconds
+
+
+class WallClock(object):
+    """Real time clock backed by the time module"""
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def sleep_until(self, deadline):
+        """Precise wait for an absolute time
+
+        Sleeps until shortly before the deadline (again if the sleep ended
+        early) and busy waits the last SPIN_THRESHOLD seconds, trading some
+        CPU for sub-millisecond accuracy.
+        """
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if remaining > SPIN_THRESHOLD:
+                time.sleep(remaining - SPIN_THRESHOLD)
+            else:
+                # Let the other threads run while spinning
+                time.sleep(0)
+
+    def event(self):
+        """Returns an event object that can be passed to `wait`"""
+        return threading.Event()
+
+    def queue(self, maxsize=0):
+        """Returns a queue for handing work to a thread using the clock"""
+        return Queue.Queue(maxsize)
+
+    def wait(self, event, timeout):
+        """Blocks until the event is set or the timeout expires
+
+        Returns:
+            The event flag on exit
+        """
+        if timeout <= 0:
+            return event.is_set()
+        return event.wait(timeout)
+
+    def idle(self):
+        """Informs the clock that the calling thread is about to block on
+        something other than the clock (no-op for real time)
+        """
+        pass
+
+
+class VirtualEvent(object):
+    """threading.Event work-alike whose `set` wakes VirtualClock waiters"""
+    def __init__(self, clock):
+        self._clock = clock
+        self._flag = False
+        self._waiters = set()
+
+    def is_set(self):
+        return self._flag
+
+    isSet = is_set
+
+    def set(self):
+        with self._clock._cond:
+            self._flag = True
+            # Waiters count as running until they are parked again
+            self._clock._busy.update(self._waiters)
+            self._clock._cond.notify_all()
+
+    def clear(self):
+        self._flag = False
+
+
+class VirtualQueue(Queue.Queue):
+    """Queue.Queue whose `put` wakes VirtualClock threads blocked in `get`
+
+    A thread blocking on an empty queue no longer runs as far as the clock
+    is concerned, a put makes it count as running again until it is
+    parked on the clock (or blocks on the queue) again.  Timeouts are in
+    real time, checked by the clock's watchdog every SETTLE_POLL seconds
+    (a timed wait would poll on Python 2 and slow every hand-off down).
+    """
+    def __init__(self, clock, maxsize=0):
+        Queue.Queue.__init__(self, maxsize)
+        self._clock = clock
+        self._getters = set()
+
+    def get(self, block=True, timeout=None):
+        if not block:
+            return Queue.Queue.get(self, False)
+
+        me = threading.current_thread().ident
+        if timeout is not None:
+            stop = time.time() + timeout
+        timed = False
+        with self.not_empty:
+            try:
+                while not self._qsize():
+                    if timeout is not None:
+                        if time.time() >= stop:
+                            raise Queue.Empty
+                        if not timed:
+                            timed = True
+                            self._clock._watch_queue(self, 1)
+                    self._getters.add(me)
+                    self._clock.idle()
+                    self.not_empty.wait()
+                item = self._get()
+                self.not_full.notify()
+                return item
+            finally:
+                self._getters.discard(me)
+                if timed:
+                    self._clock._watch_queue(self, -1)
+
+    def _put(self, item):
+        Queue.Queue._put(self, item)
+        if self._getters:
+            with self._clock._cond:
+                self._clock._busy.update(self._getters)
+                self._clock._cond.notify_all()
+
+
+class VirtualClock(object):
+    """Simulated clock that only moves when advanced
+
+    Threads calling `sleep` / `wait` are parked until the clock has been
+    advanced past their wake up time.  `advance` / `run_until` step through
+    the pending wake ups in time order.  After each step the clock waits
+    until the woken threads (and the ones they handed work to through the
+    clock's events and queues) have either gone back to sleep on the clock,
+    blocked on one of its queues or called `idle`, so the work scheduled at
+    one instant is finished before time moves on.  That wait is woken by
+    the threads themselves; a watchdog thread (running while there are
+    waits) notices threads that ended and bounds the wait to
+    `settle_timeout` (real time) for threads that blocked somewhere else
+    without calling `idle`.
+
+    Attributes:
+        settle_timeout: Max real time (seconds) to wait for woken threads
+    """
+    def __init__(self, start=0.0, settle_timeout=SETTLE_TIMEOUT):
+        """Inits VirtualClock."""
+        self.settle_timeout = settle_timeout
+        self._now = float(start)
+        self._cond = threading.Condition()
+        self._sleepers = []
+        self._busy = set()
+        self._seq = itertools.count()
+        self._settling = False
+        self._watchdog = None
+        self._timed_queues = {}
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+
+        with self._cond:
+            entry = self.__park(seconds)
+            while self._now < entry[0]:
+                self._cond.wait()
+
+    def sleep_until(self, deadline):
+        """Waits for an absolute time"""
+        self.sleep(deadline - self._now)
+
+    def event(self):
+        """Returns an event object that can be passed to `wait`"""
+        return VirtualEvent(self)
+
+    def queue(self, maxsize=0):
+        """Returns a queue for handing work to a thread using the clock"""
+        return VirtualQueue(self, maxsize)
+
+    def wait(self, event, timeout):
+        """Blocks until the event is set or the clock passes the timeout
+
+        Returns:
+            The event flag on exit
+        """
+        if timeout <= 0 or event.is_set():
+            return event.is_set()
+
+        me = threading.current_thread().ident
+        with self._cond:
+            entry = self.__park(timeout)
+            event._waiters.add(me)
+            while self._now < entry[0] and not event.is_set():
+                self._cond.wait()
+
+            event._waiters.discard(me)
+            # Drop the pending wake up if the event ended the wait early
+            entry[2] = None
+            return event.is_set()
+
+    def idle(self):
+        """Informs the clock that the calling thread is about to block on
+        something other than the clock (e.g. a queue)
+        """
+        with self._cond:
+            self._busy.discard(threading.current_thread().ident)
+            self._cond.notify_all()
+
+    def next_event(self):
+        """Returns the time of the earliest pending wake up (or None)"""
+        with self._cond:
+            return self.__peek()
+
+    def step(self):
+        """Jumps to the next pending wake up
+
+        Returns:
+            The new time or None if nothing was waiting on the clock
+        """
+        with self._cond:
+            self.__settle()
+            deadline = self.__peek()
+            if deadline is None:
+                return None
+            self.__wake(deadline)
+            self.__settle()
+            return self._now
+
+    def advance(self, seconds):
+        return self.run_until(self._now + seconds)
+
+    def run_until(self, target):
+        """Processes every wake up scheduled up to and including `target`
+        and leaves the clock at `target`
+        """
+        with self._cond:
+            self.__settle()
+            deadline = self.__peek()
+            while deadline is not None and deadline <= target:
+                self.__wake(deadline)
+                self.__settle()
+                deadline = self.__peek()
+
+            if target > self._now:
+                self._now = float(target)
+
+            return self._now
+
+    def __park(self, seconds):
+        me = threading.current_thread().ident
+        entry = [self._now + seconds, next(self._seq), me]
+        heapq.heappush(self._sleepers, entry)
+        self._busy.discard(me)
+        self._cond.notify_all()
+        return entry
+
+    def __peek(self):
+        # Discard wake ups that were cancelled by an event
+        while self._sleepers and self._sleepers[0][2] is None:
+            heapq.heappop(self._sleepers)
+
+        if self._sleepers:
+            return self._sleepers[0][0]
+        return None
+
+    def __wake(self, deadline):
+        self._now = deadline
+        while self._sleepers and self._sleepers[0][0] <= deadline:
+            ident = heapq.heappop(self._sleepers)[2]
+            if ident is not None:
+                self._busy.add(ident)
+        self._cond.notify_all()
+
+    def __settle(self):
+        stop = time.time() + self.settle_timeout
+        while self._busy:
+            # Threads that ended are done
+            self._busy.intersection_update(
+                t.ident for t in threading.enumerate())
+            if not self._busy:
+                break
+            if time.time() >= stop:
+                # Whatever is still running has blocked somewhere else
+                self._busy.clear()
+                break
+
+            # A timed wait polls on Python 2, the running threads wake us
+            # (and the watchdog when they can not)
+            self.__start_watchdog()
+            self._settling = True
+            try:
+                self._cond.wait()
+            finally:
+                self._settling = False
+
+    def _watch_queue(self, queue, count):
+        """Adds (or with a negative count removes) a getter with a timeout
+        on one of the clock's queues, woken by the watchdog
+        """
+        with self._cond:
+            count += self._timed_queues.get(queue, 0)
+            if count > 0:
+                self._timed_queues[queue] = count
+                self.__start_watchdog()
+            else:
+                self._timed_queues.pop(queue, None)
+
+    def __start_watchdog(self):
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self.__watch)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def __watch(self):
+        last = time.time()
+        while True:
+            time.sleep(SETTLE_POLL)
+            with self._cond:
+                queues = self._timed_queues.keys()
+                if self._settling or queues:
+                    last = time.time()
+                    self._cond.notify_all()
+                elif time.time() - last > self.settle_timeout:
+                    # Started again by the next wait
+                    self._watchdog = None
+                    return
+
+            # Let the getters check their timeouts (outside of the clock's
+            # lock, the queues take it while holding their own)
+            for queue in queues:
+                with queue.mutex:
+                    queue.not_empty.notify_all()
+
+
+SYSTEM_CLOCK = WallClock()
@@ -3,6 +3,10 @@
 # Project site: https://github.com/questrail/pycan
 # Use of this source code is governed by a MIT-style license that
 # can be found in the LICENSE.txt file for the project.
+import threading
+import collections
+
+DEFAULT_POOL_SIZE = 1024
 
 
 class CANMessage(object):
@@ -13,17 +17,128 @@ class CANMessage(object):
         payload: Message payload to be transmitted
         extended: A boolean indicating if the message is a 29 bit message
         ts: An integer representing the time stamp
+        channel: The driver channel the message was received on / should
+                 be sent on (None for the driver's default channel)
     """
-    def __init__(self, id, payload, extended=True, ts=0):
+    def __init__(self, id, payload, extended=True, ts=0, channel=None):
         """Inits CANMesagge."""
         self.id = id
         self.dlc = len(payload)
         self.payload = payload
         self.extended = extended
         self.time_stamp = ts
+        self.channel = channel
 
     def __str__(self):
-        return "%s,%d,%s : %s" % (hex(self.id), self.dlc, str(self.extended), [hex(x) for x in self.payload])
+        return "%s,%d,%s : %s" % (hex(self.id), self.dlc, str(self.extended),
+                                  [hex(x) for x in self.payload])
+
+
+class PooledCANMessage(CANMessage):
+    """CANMessage handed out by a CANMessagePool
+
+    The message starts with one reference owned by whoever acquired it.
+    Consumers that keep the message beyond the call it was passed to must
+    `retain` it, every reference is given back with `release` and the
+    message returns to its pool once the last reference is released.
+    Releasing a message that is already back in its pool is ignored (and
+    counted in the pool's `double_releases`).
+    """
+    def __init__(self, pool, payload_size):
+        CANMessage.__init__(self, 0, [0] * payload_size)
+        self._pool = pool
+        self._refs = 0
+
+    def retain(self):
+        with self._pool._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._pool._lock:
+            if self._refs <= 0:
+                # Recycling it twice would hand it out twice
+                self._pool.double_releases += 1
+                return
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        self._pool._recycle(self)
+
+
+class CANMessagePool(object):
+    """Pool of preallocated messages for driver receive threads
+
+    Reusing messages keeps long lived allocations (message, attribute
+    dictionary and payload list) out of the receive path, so a steady
+    stream of frames does not keep triggering garbage collections.  When
+    the pool runs dry new messages are allocated (and counted in
+    `misses`); they join the pool once released.
+
+    Attributes:
+        size: Number of messages preallocated
+        misses: Number of acquires that had to allocate a message
+        double_releases: Number of releases of messages already released
+    """
+    def __init__(self, size=DEFAULT_POOL_SIZE, payload_size=8):
+        """Inits CANMessagePool."""
+        self.size = size
+        self.payload_size = payload_size
+        self.misses = 0
+        self.double_releases = 0
+        self._lock = threading.Lock()
+        self._free = collections.deque(PooledCANMessage(self, payload_size)
+                                       for x in range(size))
+
+    def available(self):
+        return len(self._free)
+
+    def acquire(self, id, payload, extended=True, ts=0, channel=None):
+        """Returns a pooled message initialized with the given values"""
+        try:
+            msg = self._free.pop()
+        except IndexError:
+            self.misses += 1
+            msg = PooledCANMessage(self, self.payload_size)
+
+        msg.id = id
+        msg.payload[:] = payload
+        msg.dlc = len(msg.payload)
+        msg.extended = extended
+        msg.time_stamp = ts
+        msg.channel = channel
+        msg._refs = 1
+        return msg
+
+    def _recycle(self, msg):
+        self._free.append(msg)
+
+
+def release_message(msg):
+    """Releases the caller's reference if the message came from a pool"""
+    release = getattr(msg, "release", None)
+    if release is not None:
+        release()
+
+
+def frame_bits(msg, stuffing=False):
+    """Returns the number of bits the CAN message occupies on the wire
+
+    Includes the start of frame, arbitration, control, CRC, ACK, end of
+    frame and the 3 bit interframe space.  With `stuffing` the worst case
+    number of stuff bits is added as well.
+    """
+    if msg.extended:
+        bits = 67 + 8 * msg.dlc
+        stuffable = 54 + 8 * msg.dlc
+    else:
+        bits = 47 + 8 * msg.dlc
+        stuffable = 34 + 8 * msg.dlc
+
+    if stuffing:
+        bits += (stuffable - 1) // 4
+
+    return bits
 
 
 class IDMaskFilter(object):
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Typed Driver Configuration
+
+Drivers describe their keyword arguments with a schema (the
+`config_schema` class attribute, a {name: Setting} dictionary) which is
+used to convert and validate the string values of a setup file:
+
+    [defaults]
+    selection = SIM_CAN
+    baud = 250kbps
+    queue_delay = 0.05
+
+    [SIM_CAN]
+    inbound_time = 0.001
+    max_buffer_size = 5000
+
+Setup files are parsed once and cached (until they are modified), see
+`load_config`.
+"""
+import os
+import threading
+import ConfigParser
+
+DEFAULTS_SECTION = "defaults"
+SELECTION = "selection"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def integer(value):
+    """Converts decimal, hex (0x..), octal (0o..) or binary (0b..)"""
+    if isinstance(value, basestring):
+        return int(value.strip(), 0)
+    return int(value)
+
+
+def number(value):
+    return float(value)
+
+
+def boolean(value):
+    if isinstance(value, basestring):
+        lowered = value.strip().lower()
+        if lowered in ("1", "yes", "true", "on"):
+            return True
+        if lowered in ("0", "no", "false", "off"):
+            return False
+        raise ValueError("not a boolean")
+    return bool(value)
+
+
+def string(value):
+    return str(value).strip()
+
+
+def bit_rate(value):
+    """Converts a bit rate in bit/s (e.g. 250000, "250kbps", "500K", "1M")"""
+    if not isinstance(value, basestring):
+        return int(value)
+    lowered = value.strip().lower()
+    for suffix in ("bit/s", "bps"):
+        if lowered.endswith(suffix):
+            lowered = lowered[:-len(suffix)].rstrip()
+            break
+    scale = 1
+    if lowered[-1:] in ("k", "m"):
+        scale = 1000 if lowered[-1] == "k" else 1000000
+        lowered = lowered[:-1]
+    return int(round(float(lowered) * scale))
+
+
+def integer_list(value):
+    """Converts a comma separated list of integers"""
+    if isinstance(value, basestring):
+        return [integer(v) for v in value.split(",") if v.strip()]
+    if isinstance(value, (int, long)):
+        return [value]
+    return [integer(v) for v in value]
+
+
+class Setting(object):
+    """Describes one driver keyword argument
+
+    Attributes:
+        convert: Callable converting the (string) value
+        default: Value used when the setting is missing (None to leave the
+                 driver's own default)
+        minimum: Smallest allowed value (or None)
+        maximum: Largest allowed value (or None)
+        choices: The allowed values (or None)
+        required: A boolean indicating if the setting must be given
+    """
+    def __init__(self, convert=string, default=None, minimum=None,
+                 maximum=None, choices=None, required=False):
+        """Inits Setting."""
+        self.convert = convert
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        self.required = required
+
+    def parse(self, value):
+        """Returns the converted value
+
+        Raises:
+            ValueError: The value can not be converted or is out of range
+        """
+        value = self.convert(value)
+        if self.choices is not None and value not in self.choices:
+            raise ValueError("must be one of {c}".format(
+                             c=", ".join(str(c) for c in self.choices)))
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError("must be at least {m}".format(m=self.minimum))
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError("must be at most {m}".format(m=self.maximum))
+        return value
+
+
+def schema(base=None, **settings):
+    """Returns a schema extending `base` with the given settings"""
+    merged = dict(base or {})
+    merged.update(settings)
+    return merged
+
+
+def parse_settings(config_schema, values, name="driver"):
+    """Converts and validates raw (string) settings
+
+    Settings missing from `values` get their schema default (if any).
+
+    Raises:
+        ValueError: A setting is unknown, invalid or missing
+    """
+    settings = {}
+    for key, value in values.items():
+        if key not in config_schema:
+            raise ValueError("Unknown {n} setting {k}".format(n=name, k=key))
+        try:
+            settings[key] = config_schema[key].parse(value)
+        except (ValueError, TypeError) as e:
+            raise ValueError("Invalid {n} setting {k} = {v!r}: {e}".format(
+                             n=name, k=key, v=value, e=e))
+
+    for key, setting in config_schema.items():
+        if key in settings:
+            continue
+        if setting.required:
+            raise ValueError("Missing {n} setting {k}".format(n=name, k=key))
+        if setting.default is not None:
+            settings[key] = setting.default
+
+    return settings
+
+
+class DriverConfig(object):
+    """A parsed setup file
+
+    Attributes:
+        path: The setup file
+        selection: Name of the selected driver
+        values: The raw {name: string} settings of the selection (the
+                defaults section overridden by the driver's section)
+    """
+    def __init__(self, path, selection, values):
+        """Inits DriverConfig."""
+        self.path = path
+        self.selection = selection
+        self.values = values
+        self._settings = {}
+
+    def settings(self, driver):
+        """Returns the typed keyword arguments for a driver class
+
+        Drivers without a `config_schema` get the raw strings.
+        """
+        if driver not in self._settings:
+            config_schema = getattr(driver, "config_schema", None)
+            if config_schema is None:
+                settings = dict(self.values)
+            else:
+                settings = parse_settings(config_schema, self.values,
+                                          self.selection)
+            self._settings[driver] = settings
+        return dict(self._settings[driver])
+
+
+def read_config(config_file):
+    """Parses a setup file (without caching)
+
+    Raises:
+        IOError: The file can not be read
+        ValueError: The file has no driver selection
+    """
+    path = os.path.abspath(config_file)
+    config = ConfigParser.ConfigParser()
+    if not config.read(path):
+        raise IOError("Can not read config file {f}".format(f=path))
+
+    try:
+        selection = config.get(DEFAULTS_SECTION, SELECTION)
+    except ConfigParser.Error:
+        raise ValueError("No [{d}] {s} in {f}".format(d=DEFAULTS_SECTION,
+                                                      s=SELECTION, f=path))
+
+    values = dict(config.items(DEFAULTS_SECTION))
+    if config.has_section(selection):
+        values.update(config.items(selection))
+    values.pop(SELECTION, None)
+    return DriverConfig(path, selection, values)
+
+
+def load_config(config_file):
+    """Returns the parsed setup file, reparsed only when it changed"""
+    path = os.path.abspath(config_file)
+    try:
+        info = os.stat(path)
+    except OSError:
+        raise IOError("Can not read config file {f}".format(f=path))
+    version = (info.st_mtime, info.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    config = read_config(path)
+    with _cache_lock:
+        _cache[path] = (version, config)
+    return config
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
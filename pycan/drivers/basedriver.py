@@ -8,10 +8,49 @@
 These base classes provide the common/base CAN functionality that is shared
 among all CAN hardware interfaces.
 """
+import Queue
 import threading
+from pycan.common import CANMessage, release_message
+from pycan.clock import SYSTEM_CLOCK
+from pycan.config import (Setting, integer, number, boolean, string,
+                          bit_rate)
+from pycan.drivers.scheduler import OutboundScheduler, DEFAULT_BIT_RATE
+from pycan.drivers.fanout import (FrameRing, Subscription, DROP_OLDEST,
+                                  RING_SIZE)
+from pycan.drivers.periodic import PeriodicScheduler
+
+STOP_TIMEOUT = 1.0  # seconds
 
 
 class BaseDriverAPI(object):
+    # Callables given every received message, see add_receive_tap
+    receive_taps = ()
+
+    # The FrameRing of the subscriptions (None without subscriptions)
+    subscription_ring = None
+    subscription_ring_size = RING_SIZE
+
+    # The PeriodicScheduler of start_periodic (created on first use)
+    periodic_scheduler = None
+
+    # True for drivers whose start_periodic is timed outside of Python
+    # (hardware or kernel), the default is a timer thread
+    native_periodic = False
+
+    # Settings shared by the drivers (see pycan.config), drivers extend it
+    # with their own
+    config_schema = {
+        "verbose": Setting(boolean),
+        "baud": Setting(bit_rate, minimum=1),
+        "queue_delay": Setting(number, minimum=0.001),
+        "max_buffer_size": Setting(integer, minimum=0),
+        "tx_priority": Setting(string, choices=("id",)),
+        "tx_bus_load": Setting(number, minimum=0.001, maximum=1.0),
+        "tx_bit_rate": Setting(integer, minimum=1),
+        "tx_burst": Setting(number, minimum=1),
+        "tx_stuffing": Setting(boolean),
+        }
+
     def send(self, message):
         """Blocking call to put a CAN message onto the outbound buffer
         """
@@ -45,3 +84,174 @@ class BaseDriverAPI(object):
         t.start()
         return t
 
+    def stop_daemons(self, *threads):
+        """Stops the driver's threads (the ones polling `_running`)
+
+        The outbound thread is woken with a None frame instead of waiting
+        out its queue timeout and the given threads are joined, each for
+        at most `queue_delay` seconds.
+        """
+        self.clear_periodic()
+        self._running.clear()
+        outbound = getattr(self, "outbound", None)
+        if outbound is not None:
+            try:
+                outbound.put_nowait(None)
+            except Queue.Full:
+                # The outbound thread is not waiting on the queue
+                pass
+
+        timeout = getattr(self, "queue_delay", STOP_TIMEOUT)
+        for t in threads:
+            if t is not None and t is not threading.current_thread():
+                t.join(timeout)
+
+    def new_message(self, id, payload, extended=True, ts=0, channel=None):
+        """Builds a received message, taken from the driver's message pool
+        (the `pool` attribute) when there is one
+        """
+        pool = getattr(self, "pool", None)
+        if pool is None:
+            return CANMessage(id, payload, extended, ts, channel)
+        return pool.acquire(id, payload, extended, ts, channel)
+
+    def new_outbound_queue(self, maxsize, kwargs):
+        """Builds the outbound buffer from the driver's keyword arguments
+
+        A plain FIFO Queue unless "tx_priority" (None / "id" for CAN
+        arbitration order, a {can_id: priority} dictionary or a callable)
+        or "tx_bus_load" (bus load cap, 0.0 - 1.0, with "tx_bit_rate"
+        (defaults to "baud") and "tx_burst" in bits) is given, see
+        pycan.drivers.scheduler.
+        """
+        priority = kwargs.get("tx_priority", None)
+        bus_load = kwargs.get("tx_bus_load", None)
+        clock = getattr(self, "clock", SYSTEM_CLOCK)
+        if priority is None and bus_load is None:
+            return clock.queue(maxsize)
+
+        if priority == "id":
+            priority = None
+        return OutboundScheduler(maxsize, priority, bus_load,
+                                 kwargs.get("tx_bit_rate",
+                                            kwargs.get("baud",
+                                                       DEFAULT_BIT_RATE)),
+                                 kwargs.get("tx_burst", None),
+                                 kwargs.get("tx_stuffing", True), clock)
+
+    def add_receive_tap(self, tap):
+        """Calls `tap(message)` for every received message
+
+        Taps run on the driver's receive thread as soon as a message
+        arrives (before it is queued for next_message), so they have to be
+        quick and must copy whatever they keep of a (pooled) message.
+        """
+        self.receive_taps = self.receive_taps + (tap,)
+
+    def remove_receive_tap(self, tap):
+        self.receive_taps = tuple(t for t in self.receive_taps
+                                  if t != tap)
+
+    def tap_message(self, message):
+        """Passes a received message to the receive taps"""
+        for tap in self.receive_taps:
+            tap(message)
+
+    def receive_message(self, message, timeout=None):
+        """Passes a received message to the receive taps and subscriptions
+        and queues it for next_message
+
+        The inbound queue is waited on for up to `timeout` seconds (None
+        for not at all), but never while there are subscriptions which an
+        unread inbound queue must not hold up.  Messages that do not fit
+        are released and counted in `inbound_dropped`.
+
+        Returns:
+            A boolean indicating if the message was queued
+        """
+        self.tap_message(message)
+        ring = self.subscription_ring
+        if ring is not None:
+            ring.publish(message)
+            timeout = None
+
+        try:
+            if timeout is None:
+                self.inbound.put_nowait(message)
+            else:
+                self.inbound.put(message, timeout=timeout)
+            return True
+        except Queue.Full:
+            self.inbound_dropped += 1
+            release_message(message)
+            return False
+
+    def subscribe(self, filters=None, maxsize=None, overflow=DROP_OLDEST,
+                  **kwargs):
+        """Returns a Subscription receiving every frame received from now
+        on, independently of next_message and the other subscriptions
+
+        See pycan.drivers.fanout for the filters and overflow policies.
+        """
+        ring = self.subscription_ring
+        if ring is None:
+            ring = FrameRing(self.subscription_ring_size)
+        subscription = Subscription(self, ring, filters, maxsize, overflow,
+                                    **kwargs)
+        ring.add(subscription)
+        self.subscription_ring = ring
+        return subscription
+
+    def unsubscribe(self, subscription):
+        ring = self.subscription_ring
+        if ring is None:
+            return
+        ring.remove(subscription)
+        if not ring.subscriptions:
+            self.subscription_ring = None
+            ring.clear()
+
+    def start_periodic(self, message, period, key=None):
+        """Sends `message` every `period` seconds, the first time one
+        period from now, until stop_periodic is called
+
+        The transmissions are scheduled by the driver, by default on a
+        dedicated timer thread (see pycan.drivers.periodic).  Starting a
+        key again replaces its message and period.
+
+        Returns:
+            The key of the transmission (the message's id by default)
+        """
+        if key is None:
+            key = message.id
+        scheduler = self.periodic_scheduler
+        if scheduler is None:
+            scheduler = PeriodicScheduler(self.send,
+                                          getattr(self, "clock",
+                                                  SYSTEM_CLOCK))
+            self.periodic_scheduler = scheduler
+        scheduler.start(key, message, period)
+        return key
+
+    def update_periodic(self, message, key=None):
+        """Replaces the message of a periodic transmission (keeping its
+        schedule)
+
+        Returns:
+            A boolean indicating if the transmission exists
+        """
+        if key is None:
+            key = message.id
+        scheduler = self.periodic_scheduler
+        return scheduler is not None and scheduler.update(key, message)
+
+    def stop_periodic(self, key):
+        scheduler = self.periodic_scheduler
+        return scheduler is not None and scheduler.stop(key)
+
+    def clear_periodic(self):
+        """Stops every periodic transmission"""
+        scheduler = self.periodic_scheduler
+        if scheduler is not None:
+            self.periodic_scheduler = None
+            scheduler.shutdown()
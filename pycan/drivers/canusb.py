@@ -21,7 +21,7 @@ import sys
 import threading
 import Queue
 import basedriver
-from pycan.common import CANMessage
+from pycan.config import Setting, schema, integer, string
 import serial
 
 QUEUE_DELAY = .1
@@ -50,12 +50,27 @@ TIME_STAMP_CMD = 'Z1\r'
 
 
 class CANUSB(basedriver.BaseDriverAPI):
+    config_schema = schema(
+        basedriver.BaseDriverAPI.config_schema,
+        com_port=Setting(string),
+        com_baud=Setting(integer, minimum=1))
+
     def __init__(self, **kwargs):
-        # Open the COM port
-        port = kwargs['com_port']  # Throws key error
-        baud = int(kwargs.get('com_baud', 115200))
-        self.port = serial.Serial(port=port, baudrate=baud, timeout=0.001, writeTimeout=5)
+        self.queue_delay = kwargs.get("queue_delay", QUEUE_DELAY)
+
+        # Use an already opened serial port object (if any)
+        self.port = kwargs.get('serial_port', None)
+        self._own_port = self.port is None
+        if self._own_port:
+            # Open the COM port
+            port = kwargs['com_port']  # Throws key error
+            baud = int(kwargs.get('com_baud', 115200))
+            self.port = serial.Serial(port=port, baudrate=baud,
+                                      timeout=0.001, writeTimeout=5)
         self.port.flushInput()
+
+        # Optional CANMessagePool for the received messages
+        self.pool = kwargs.get('pool', None)
         self.rx_buffer = ''
         self.response = ''
 
@@ -71,15 +86,17 @@ class CANUSB(basedriver.BaseDriverAPI):
         self.__send_command(TIME_STAMP_CMD)
 
         # Set the default paramters
-        self.update_bus_parameters()
+        self.update_bus_parameters(baud=kwargs.get("baud", 250000))
 
         # Go on bus
         self.bus_on()
 
         # Build the inbound and output buffers
-        self.inbound = Queue.Queue(MAX_BUFFER_SIZE)
+        buffer_size = kwargs.get("max_buffer_size", MAX_BUFFER_SIZE)
+        self.inbound = Queue.Queue(buffer_size)
         self.inbound_count = 0
-        self.outbound = Queue.Queue(MAX_BUFFER_SIZE)
+        self.inbound_dropped = 0
+        self.outbound = self.new_outbound_queue(buffer_size, kwargs)
         self.outbound_count = 0
 
         # Tell python to check for signals less often (default 1000)
@@ -93,8 +110,13 @@ class CANUSB(basedriver.BaseDriverAPI):
         self.ib_t = self.start_daemon(self.__process_inbound_queue)
 
     def shutdown(self):
-        self._running.clear()
-        time.sleep(1)
+        """Stops the driver threads and goes off bus (the serial port is
+        closed unless it was given with `serial_port`)
+        """
+        self.stop_daemons(self.ib_t, self.ob_t)
+        self.bus_off()
+        if self._own_port:
+            self.port.close()
 
     def bus_on(self):
         return self.__send_command(OPEN_CMD)
@@ -105,7 +127,7 @@ class CANUSB(basedriver.BaseDriverAPI):
     def send(self, message):
         while 1:
             try:
-                self.outbound.put(message, timeout=QUEUE_DELAY)
+                self.outbound.put(message, timeout=self.queue_delay)
                 self.outbound_count += 1
                 return True
             except Queue.Full:
@@ -119,7 +141,7 @@ class CANUSB(basedriver.BaseDriverAPI):
                 if time.time() > stop:
                     return None
             try:
-                new_msg = self.inbound.get(timeout=QUEUE_DELAY)
+                new_msg = self.inbound.get(timeout=self.queue_delay)
                 self.inbound_count += 1
                 return new_msg
             except Queue.Empty:
@@ -145,7 +167,10 @@ class CANUSB(basedriver.BaseDriverAPI):
 
     def update_bus_parameters(self, **kwargs):
         # Default values are setup for a 250k connetion
-        br = kwargs.get('bit_rate', '250K')
+        br = kwargs.get('bit_rate', None)
+        if br is None:
+            baud = kwargs.get('baud', 250000)
+            br = '1M' if baud == 1000000 else '%dK' % (baud // 1000)
         br_cmd = BIT_RATE_CMD.get(br, None)
         if br_cmd:
             return self.__send_command(br_cmd)
@@ -156,9 +181,11 @@ class CANUSB(basedriver.BaseDriverAPI):
         while self._running.is_set():
             try:
                 # Read the Queue - allow the timeout to throttle the thread
-                can_msg = self.outbound.get(timeout=QUEUE_DELAY)
+                can_msg = self.outbound.get(timeout=self.queue_delay)
             except Queue.Empty:
                 continue
+            if can_msg is None:
+                continue
 
             outbound_msg = ''
             if can_msg.extended:
@@ -237,13 +264,9 @@ class CANUSB(basedriver.BaseDriverAPI):
                             timestamp = int(msg[e_payload+1:-1], 16)
 
                         # Build the message
-                        new_msg = CANMessage(can_id, payload, ext, timestamp)
-
-                        try:
-                            self.inbound.put(new_msg, timeout=QUEUE_DELAY)
-                        except Queue.Full:
-                            # TODO: flag error
-                            pass
+                        new_msg = self.new_message(can_id, payload, ext,
+                                                   timestamp)
+                        self.receive_message(new_msg, self.queue_delay)
 
                     except IndexError:
                         # TODO (A. Lewis) Log the bad message from the comport
@@ -9,51 +9,114 @@ This module is responsible to returning initialized CAN drivers
 based on the supplied setup file.  This is implemented using
 the factory design pattern.
 
+Drivers are kept in a registry of "module:class" entry points and only
+the selected driver's module is imported, so the factory loads quickly
+and works on hosts missing the dependencies of the other backends.
+Third party drivers can be added with `register_driver` or published by
+a package under the "pycan.drivers" setuptools entry point group.
+
+Setup file values are typed and validated against each driver's
+`config_schema` (see pycan.config), which also exposes the drivers' queue
+sizes, timeouts and other tuning knobs.
+
 For more details on OS / hardware requirements please see the
 individual driver files
 
 """
-import os
-import ConfigParser
-
-import kvaser
-import canusb
-import sim_can
-
-drivers = {"Kvaser" : kvaser.Kvaser,
-           "CANUSB" : canusb.CANUSB,
-           "SIM_CAN" : sim_can.SimCAN,
-          }
-
-def get_driver(config_file):
-    # Load the config file
-    config = ConfigParser.ConfigParser()
-    config.read(os.path.abspath(config_file))
+import importlib
+from pycan.config import load_config
+
+ENTRY_POINT_GROUP = "pycan.drivers"
+
+# Registered drivers: either a "module:class" entry point or the class
+# itself once it has been loaded
+drivers = {"Kvaser": "pycan.drivers.kvaser:Kvaser",
+           "CANUSB": "pycan.drivers.canusb:CANUSB",
+           "SIM_CAN": "pycan.drivers.sim_can:SimCAN",
+           "SHM_CAN": "pycan.drivers.shm_can:ShmCAN",
+           "SocketCAN": "pycan.drivers.socketcan:SocketCAN",
+           }
+
+
+def register_driver(name, driver):
+    """Adds a driver to the factory
+
+    Args:
+        name: The selection name used in the setup file
+        driver: The driver class or a "module:class" string which is only
+                imported when the driver is selected
+    """
+    drivers[name] = driver
+
+
+def _entry_point_drivers():
+    try:
+        import pkg_resources
+    except ImportError:
+        return {}
+
+    found = {}
+    for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        found[ep.name] = ep
+    return found
+
+
+def available_drivers():
+    """Returns the names of the registered and installed drivers"""
+    names = set(drivers)
+    names.update(_entry_point_drivers())
+    return sorted(names)
+
+
+def load_driver(name):
+    """Returns the driver class registered under `name`
+
+    Raises:
+        KeyError: No driver is registered under the name
+        ImportError: The driver's module (or a dependency) is missing
+    """
+    if name not in drivers:
+        # Only scan the installed packages for unknown names
+        entry_points = _entry_point_drivers()
+        if name not in entry_points:
+            raise KeyError(name)
+        drivers[name] = entry_points[name].load()
+
+    driver = drivers[name]
+    if isinstance(driver, basestring):
+        module_name, _, class_name = driver.partition(":")
+        driver = getattr(importlib.import_module(module_name), class_name)
+        drivers[name] = driver
+
+    return driver
+
+
+def get_driver(config_file, **kwargs):
+    """Builds the driver selected in a setup file
+
+    The setup file is parsed once (see pycan.config.load_config) and its
+    settings are converted / validated with the driver's `config_schema`.
+    Keyword arguments are passed to the driver on top of the settings
+    (e.g. a clock or a message pool).
+
+    Raises:
+        IOError: The setup file can not be read
+        ValueError: The setup file has no selection or invalid settings
+        KeyError: The selected driver is not registered
+        ImportError: The driver's module (or a dependency) is missing
+    """
+    config = load_config(config_file)
 
     # Determine what type driver should be used
-    selection = config.get('defaults', 'selection')
-
-    if selection not in drivers:
-        #TODO: Add a logging error here
-        print("Unknown driver selection {sel}!".format(sel=selection))
-        return None
-
+    driver = load_driver(config.selection)
 
     # Build the keyword arguments to pass to the driver
-    kwargs = {}
-    defaults = config.items('defaults')
-    driver_vals = config.items(selection)
-
-    for key, val in defaults:
-        kwargs[key] = val
-
-    for key, val in driver_vals:
-        kwargs[key] = val
+    settings = config.settings(driver)
+    settings.update(kwargs)
 
     # Initilize the driver
-    return drivers[selection](**kwargs)
+    return driver(**settings)
 
 
 if __name__ == "__main__":
     d = get_driver('setup.cfg')
-
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Fan-out of received frames to several consumers
+
+`next_message` hands every frame to one consumer only.  A driver's
+subscriptions (BaseDriverAPI.subscribe) each see every received frame
+instead:
+
+    log = driver.subscribe()
+    ui = driver.subscribe([IDMaskFilter(0x700, 0x100, False)], maxsize=100)
+    msg = ui.next_message(timeout=1)
+
+The driver's receive thread writes each frame once into a FrameRing
+shared by the subscriptions, which are just cursors into the ring, so
+frames are neither copied nor passed through an extra thread.  The
+filters are evaluated by the reading subscription (once per (id,
+extended) pair, the result is cached).
+
+A subscription falling more than `maxsize` frames behind overflows:
+
+    * DROP_OLDEST: its cursor skips to the newest `maxsize` frames (the
+      skipped frames are counted in `dropped`), the writer never waits
+    * BLOCK: the writer waits (up to `block_timeout` seconds, then the
+      oldest frame is dropped) until the subscription read a frame
+"""
+import time
+import threading
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+RING_SIZE = 4096  # frames
+BLOCK_TIMEOUT = 1.0  # seconds
+MAX_FILTER_CACHE = 65536  # (id, extended) entries
+
+
+class FrameRing(object):
+    """Ring of the frames received by a driver
+
+    Attributes:
+        size: Number of frames kept
+        written: Number of frames written (the sequence number of the next)
+        subscriptions: The Subscriptions reading the ring
+    """
+    def __init__(self, size=RING_SIZE):
+        """Inits FrameRing."""
+        self.size = size
+        self.written = 0
+        self.subscriptions = ()
+        self._slots = [None] * size
+        self._blocking = ()
+        self._cond = threading.Condition()
+
+    def publish(self, message):
+        """Writes a frame (called by the driver's receive thread)
+
+        Pooled messages are retained while they are in the ring.
+        """
+        retain = getattr(message, "retain", None)
+        if retain is not None:
+            retain()
+
+        with self._cond:
+            written = self.written
+            for subscription in self._blocking:
+                subscription._make_room(written)
+
+            slot = written % self.size
+            old = self._slots[slot]
+            self._slots[slot] = message
+            self.written = written + 1
+            self._cond.notify_all()
+
+        if old is not None:
+            release = getattr(old, "release", None)
+            if release is not None:
+                release()
+
+    def add(self, subscription):
+        with self._cond:
+            subscription.cursor = self.written
+            self.subscriptions = self.subscriptions + (subscription,)
+            self.__update_blocking()
+
+    def remove(self, subscription):
+        with self._cond:
+            self.subscriptions = tuple(s for s in self.subscriptions
+                                       if s is not subscription)
+            self.__update_blocking()
+            # Wake the writer waiting on the subscription
+            self._cond.notify_all()
+
+    def clear(self):
+        """Releases the frames held by the ring"""
+        with self._cond:
+            slots = self._slots
+            self._slots = [None] * self.size
+        for message in slots:
+            if message is not None:
+                release = getattr(message, "release", None)
+                if release is not None:
+                    release()
+
+    def __update_blocking(self):
+        self._blocking = tuple(s for s in self.subscriptions
+                               if s.overflow == BLOCK)
+
+
+class Subscription(object):
+    """An independent view of a driver's received frames
+
+    Messages taken from a pooled driver are retained for the reader, who
+    gives them back with `release` (like the ones from next_message).
+
+    Attributes:
+        driver: The subscribed driver
+        filters: List of IDMaskFilters, a frame is received if any match
+                 (an empty list receives everything)
+        maxsize: Max frames the subscription falls behind
+        overflow: DROP_OLDEST or BLOCK
+        block_timeout: Seconds a BLOCK subscription holds the writer up
+        cursor: Sequence number of the next frame read
+        received: Number of frames read
+        dropped: Number of frames lost to overflows
+    """
+    def __init__(self, driver, ring, filters=None, maxsize=None,
+                 overflow=DROP_OLDEST, block_timeout=BLOCK_TIMEOUT):
+        """Inits Subscription."""
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError("Unknown overflow policy: {p}".format(
+                             p=overflow))
+        if maxsize is None or maxsize > ring.size:
+            maxsize = ring.size
+        self.driver = driver
+        self.ring = ring
+        self.filters = list(filters or [])
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.cursor = 0
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+        self._matches = {}
+
+    def next_message(self, timeout=None):
+        """Returns the next matching frame, None when none arrived within
+        `timeout` seconds (or the subscription was closed)
+        """
+        ring = self.ring
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with ring._cond:
+            while not self.closed:
+                written = ring.written
+                if written - self.cursor > self.maxsize:
+                    self.dropped += written - self.maxsize - self.cursor
+                    self.cursor = written - self.maxsize
+
+                while self.cursor < written:
+                    message = ring._slots[self.cursor % ring.size]
+                    self.cursor += 1
+                    if self.__match(message):
+                        self.__read(ring)
+                        retain = getattr(message, "retain", None)
+                        if retain is not None:
+                            retain()
+                        return message
+                self.__read(ring)
+
+                if deadline is None:
+                    ring._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    ring._cond.wait(remaining)
+        return None
+
+    def pending(self):
+        """Returns the number of unread frames (matching or not)"""
+        return min(self.ring.written - self.cursor, self.maxsize)
+
+    def set_filters(self, filters):
+        with self.ring._cond:
+            self.filters = list(filters or [])
+            self._matches = {}
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.driver.unsubscribe(self)
+
+    def __iter__(self):
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+            yield message
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _make_room(self, written):
+        # Called by the writer (ring lock held) for BLOCK subscriptions
+        if written - self.cursor < self.maxsize:
+            return
+
+        deadline = time.time() + self.block_timeout
+        cond = self.ring._cond
+        while written - self.cursor >= self.maxsize and not self.closed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.dropped += 1
+                self.cursor = written - self.maxsize + 1
+                return
+            cond.wait(remaining)
+
+    def __read(self, ring):
+        if self.overflow == BLOCK:
+            ring._cond.notify_all()
+
+    def __match(self, message):
+        if not self.filters:
+            self.received += 1
+            return True
+
+        key = (message.id, message.extended)
+        match = self._matches.get(key)
+        if match is None:
+            if len(self._matches) >= MAX_FILTER_CACHE:
+                self._matches = {}
+            match = False
+            for mask_filter in self.filters:
+                if mask_filter.filter_match(message):
+                    match = True
+                    break
+            self._matches[key] = match
+        if match:
+            self.received += 1
+        return match
@@ -21,7 +21,7 @@ import Queue
 import threading
 import basedriver
 import time
-from pycan.common import CANMessage
+from pycan.config import Setting, schema, integer, integer_list
 from ctypes import *
 
 CAN_TX_TIMEOUT = 100  # ms
@@ -29,29 +29,97 @@ CAN_RX_TIMEOUT = 100  # ms
 MAX_BUFFER_SIZE = 1000
 QUEUE_DELAY = 1  # second
 
+# canlib.h
+canOK = 0
+canERR_NOMSG = -2
+canMSG_STD = 0x0002
+canMSG_EXT = 0x0004
+canIOCTL_GET_EVENTHANDLE = 14
+
+# winbase.h
+WAIT_OBJECT_0 = 0x00000000
+WAIT_TIMEOUT = 0x00000102
+
 
 class Kvaser(basedriver.BaseDriverAPI):
+    """Kvaser driver managing one or more CAN channels
+
+    The channels are selected with the `channels` keyword argument (a list
+    or a comma separated string of channel numbers, default 0).  Received
+    messages are tagged with the index of the channel in that list and
+    outbound messages are sent on the channel matching their `channel`
+    attribute (the first channel when it is None).  Messages whose channel
+    is not an index into the list are dropped and counted in
+    `outbound_dropped`.
+
+    `tx_timeout` / `rx_timeout` (ms) bound the wait for a transmission and
+    the wait for received frames.
+
+    All channels share one inbound thread which waits on the channels'
+    receive event handles with WaitForMultipleObjects and one outbound
+    thread, regardless of the number of channels.
+    """
+    config_schema = schema(
+        basedriver.BaseDriverAPI.config_schema,
+        channels=Setting(integer_list),
+        channel=Setting(integer, minimum=0),
+        tx_timeout=Setting(integer, minimum=1),
+        rx_timeout=Setting(integer, minimum=1))
+
     def __init__(self, **kwargs):
+        self.queue_delay = kwargs.get("queue_delay", QUEUE_DELAY)
+        self.tx_timeout = int(kwargs.get("tx_timeout", CAN_TX_TIMEOUT))
+        self.rx_timeout = int(kwargs.get("rx_timeout", CAN_RX_TIMEOUT))
+
         # Init the Leaf Light HS DLL
         windll.canlib32.canInitializeLibrary()
 
-        # Open a CAN communication channel
-        # TODO: Add multi channel support
-        self._can_channel = windll.canlib32.canOpenChannel(c_int(0), c_int8(0))
+        channels = kwargs.get("channels", kwargs.get("channel", 0))
+        if isinstance(channels, basestring):
+            channels = [int(c) for c in channels.split(",")]
+        elif isinstance(channels, (int, long)):
+            channels = [channels]
+        self.channels = list(channels)
+
+        # Optional CANMessagePool for the received messages
+        self.pool = kwargs.get("pool", None)
+
+        # Open the CAN communication channels
+        self._can_channels = []
+        self._rx_events = (c_void_p * len(self.channels))()
+        for idx, chan in enumerate(self.channels):
+            handle = windll.canlib32.canOpenChannel(c_int(chan), c_int8(0))
+            if handle < 0:
+                for opened in self._can_channels:
+                    windll.canlib32.canClose(c_int(opened))
+                raise OSError("Can not open Kvaser channel {c} ({s})".format(
+                              c=chan, s=handle))
+            self._can_channels.append(handle)
+
+            # Bus on and clear the hardware queues
+            windll.canlib32.canBusOn(c_int(handle))
+            windll.canlib32.canFlushReceiveQueue(c_int(handle))
+            windll.canlib32.canFlushTransmitQueue(c_int(handle))
 
-        # Bus on and clear the hardware queues
-        windll.canlib32.canBusOn(c_int(self._can_channel))
-        windll.canlib32.canFlushReceiveQueue(c_int(self._can_channel))
-        windll.canlib32.canFlushTransmitQueue(c_int(self._can_channel))
+            # Get the event signaled when the channel receives a message
+            windll.canlib32.canIoCtl(c_int(handle),
+                                     c_uint(canIOCTL_GET_EVENTHANDLE),
+                                     byref(self._rx_events, idx *
+                                           sizeof(c_void_p)),
+                                     c_uint(sizeof(c_void_p)))
 
         # Set the default paramters
+        self.baud = kwargs.get("baud", 250000)
         self.update_bus_parameters()
 
         # Build the inbound and output buffers
-        self.inbound = Queue.Queue(MAX_BUFFER_SIZE)
+        buffer_size = kwargs.get("max_buffer_size", MAX_BUFFER_SIZE)
+        self.inbound = Queue.Queue(buffer_size)
         self.inbound_count = 0
-        self.outbound = Queue.Queue(MAX_BUFFER_SIZE)
+        self.inbound_dropped = 0
+        self.outbound = self.new_outbound_queue(buffer_size, kwargs)
         self.outbound_count = 0
+        self.outbound_dropped = 0
 
         # Tell python to check for signals less often (default 1000)
         #   - This yeilds better threading performance for timing
@@ -65,23 +133,37 @@ class Kvaser(basedriver.BaseDriverAPI):
 
     def update_bus_parameters(self, **kwargs):
         # Default values are setup for a 250k baud and a 75% sample point
-        # Set up the timing parameters for the CAN controller
-        windll.canlib32.canSetBusParams(c_int(self._can_channel),
-                                        c_int(kwargs.get("baud", 250000)),
-                                        c_uint(kwargs.get("tseg1", 5)),
-                                        c_uint(kwargs.get("tseg2", 2)),
-                                        c_uint(kwargs.get("sjw", 2)),
-                                        c_uint(kwargs.get("sample_count", 1)),
-                                        c_uint(0))
+        # Set up the timing parameters for the CAN controller(s)
+        channel = kwargs.get("channel", None)
+        if channel is None:
+            handles = self._can_channels
+        else:
+            handles = [self._can_channels[channel]]
+
+        for handle in handles:
+            windll.canlib32.canSetBusParams(
+                c_int(handle),
+                c_int(kwargs.get("baud", self.baud)),
+                c_uint(kwargs.get("tseg1", 5)),
+                c_uint(kwargs.get("tseg2", 2)),
+                c_uint(kwargs.get("sjw", 2)),
+                c_uint(kwargs.get("sample_count", 1)),
+                c_uint(0))
+
     def shutdown(self):
-        self._running.clear()
-        time.sleep(1)
-        sys.exit()
+        """Stops the driver threads, takes the channels off bus and closes
+        them
+        """
+        self.stop_daemons(self.ib_t, self.ob_t)
+        for handle in self._can_channels:
+            windll.canlib32.canBusOff(c_int(handle))
+            windll.canlib32.canClose(c_int(handle))
+        self._can_channels = []
 
     def send(self, message):
         while 1:
             try:
-                self.outbound.put(message, timeout=QUEUE_DELAY)
+                self.outbound.put(message, timeout=self.queue_delay)
                 self.outbound_count += 1
                 return True
             except Queue.Full:
@@ -92,7 +174,7 @@ class Kvaser(basedriver.BaseDriverAPI):
             stop = time.time() + timeout
         while 1:
             try:
-                new_msg = self.inbound.get(timeout=QUEUE_DELAY)
+                new_msg = self.inbound.get(timeout=self.queue_delay)
                 self.inbound_count += 1
                 return new_msg
             except Queue.Empty:
@@ -111,61 +193,79 @@ class Kvaser(basedriver.BaseDriverAPI):
     def __process_outbound_queue(self):
         while self._running.is_set():
             try:
-                can_msg = self.outbound.get(timeout=QUEUE_DELAY)
+                can_msg = self.outbound.get(timeout=self.queue_delay)
             except Queue.Empty:
                 continue
+            if can_msg is None:
+                continue
 
             tx_data = (c_uint8 * can_msg.dlc)()
             for x in range(can_msg.dlc):
                 tx_data[x] = can_msg.payload[x]
 
             if can_msg.extended:
-                ext = 4
+                ext = canMSG_EXT
             else:
-                ext = 2
+                ext = canMSG_STD
 
-            status = windll.canlib32.canWriteWait(c_int(self._can_channel),
+            channel = can_msg.channel or 0
+            if not 0 <= channel < len(self._can_channels):
+                # Not one of our channels (e.g. from another driver)
+                self.outbound_dropped += 1
+                continue
+            handle = self._can_channels[channel]
+            status = windll.canlib32.canWriteWait(c_int(handle),
                                                   c_uint32(can_msg.id),
                                                   pointer(tx_data),
                                                   c_int(can_msg.dlc),
                                                   c_int(ext),
-                                                  c_uint32(CAN_TX_TIMEOUT))
+                                                  c_uint32(self.tx_timeout))
         # TODO: Flag error status
 
     def __process_inbound_queue(self):
+        rx_id = c_uint(0)
+        rx_dlc = c_uint(0)
+        rx_flags = c_uint(0)
+        rx_time = c_uint(0)
+        rx_msg = (c_uint8 * 8)()
+        count = len(self._can_channels)
+
         while self._running.is_set():
-            rx_id = c_uint(0)
-            rx_dlc = c_uint(0)
-            rx_flags = c_uint(0)
-            rx_time = c_uint(0)
-            rx_msg = (c_uint8 * 8)()
-
-            status = windll.canlib32.canReadWait(c_int(self._can_channel),
-                                                 pointer(rx_id),
-                                                 pointer(rx_msg),
-                                                 pointer(rx_dlc),
-                                                 pointer(rx_flags),
-                                                 pointer(rx_time),
-                                                 c_uint32(CAN_RX_TIMEOUT))
-            if status < 0:
-                pass
-                #TODO: Flag errors
+            # One wait for all of the channels
+            status = windll.kernel32.WaitForMultipleObjects(
+                c_uint(count), self._rx_events, c_int(0),
+                c_uint(self.rx_timeout))
+            if status == WAIT_TIMEOUT or status >= WAIT_OBJECT_0 + count:
+                # TODO: Flag wait failures
+                continue
 
-            else:
-                # Determine if it is 11bit or 29bit
-                if (rx_flags.value >> 1) & 0x01:
-                    rx_ext = False
-                elif (rx_flags.value >> 2) & 0x01:
-                    rx_ext = True
-                else:
-                    rx_ext = None
-
-                if rx_ext is not None:
-                    # Build the message
-                    new_msg = CANMessage(rx_id.value, rx_msg, rx_ext)
-
-                    try:
-                        self.inbound.put(new_msg, timeout=QUEUE_DELAY)
-                    except Queue.Full:
-                        # TODO: flag error
-                        pass
+            # Drain every channel, more than one may have been signaled
+            for chan, handle in enumerate(self._can_channels):
+                while 1:
+                    status = windll.canlib32.canRead(c_int(handle),
+                                                     pointer(rx_id),
+                                                     pointer(rx_msg),
+                                                     pointer(rx_dlc),
+                                                     pointer(rx_flags),
+                                                     pointer(rx_time))
+                    if status == canERR_NOMSG:
+                        break
+                    elif status != canOK:
+                        # TODO: Flag errors
+                        break
+
+                    # Determine if it is 11bit or 29bit
+                    if rx_flags.value & canMSG_STD:
+                        rx_ext = False
+                    elif rx_flags.value & canMSG_EXT:
+                        rx_ext = True
+                    else:
+                        rx_ext = None
+
+                    if rx_ext is not None:
+                        # Build the message
+                        new_msg = self.new_message(rx_id.value,
+                                                   rx_msg[:rx_dlc.value],
+                                                   rx_ext, rx_time.value,
+                                                   chan)
+                        self.receive_message(new_msg, self.queue_delay)
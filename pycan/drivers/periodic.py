@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Periodic transmissions
+
+PeriodicScheduler sends a set of messages at fixed periods from one
+dedicated timer thread.  It is the default implementation of the drivers'
+periodic transmit API (BaseDriverAPI.start_periodic, update_periodic and
+stop_periodic); backends with a native scheduler (e.g. the SocketCAN
+broadcast manager) override that API instead.
+
+The deadlines are absolute (each one is the previous one plus the
+period), so the send and thread switch latencies do not add up to drift.
+A message that fell more than a period behind skips the transmissions it
+missed instead of sending them in a burst.  Every message due at a tick is
+sent in one batch, and the timer waits on the clock's schedule change
+event until shortly before the next deadline and reaches the deadline
+itself with the clock's precise `sleep_until`.
+"""
+import heapq
+import itertools
+import threading
+from pycan.clock import SYSTEM_CLOCK, SPIN_THRESHOLD
+
+IDLE_DELAY = 1.0  # seconds
+START_TIMEOUT = 1.0  # seconds
+
+
+class PeriodicMessage(object):
+    """A scheduled message
+
+    Attributes:
+        key: The key the message was started with
+        message: The CANMessage sent
+        period: Seconds between two transmissions
+        deadline: Time of the next transmission
+        sent: Number of transmissions
+        skipped: Number of transmissions missed by falling behind
+        max_late: Largest delay (seconds) of a transmission
+    """
+    def __init__(self, key, message, period, deadline):
+        """Inits PeriodicMessage."""
+        self.key = key
+        self.message = message
+        self.period = period
+        self.deadline = deadline
+        self.active = True
+        self.sent = 0
+        self.skipped = 0
+        self.max_late = 0.0
+
+
+class PeriodicScheduler(object):
+    """Timer thread sending periodic messages
+
+    Attributes:
+        send: Callable taking the message to send (e.g. a driver's send)
+        clock: The clock the periods are measured with
+        messages: The {key: PeriodicMessage} schedule
+    """
+    def __init__(self, send, clock=SYSTEM_CLOCK):
+        """Inits PeriodicScheduler."""
+        self.send = send
+        self.clock = clock
+        self.messages = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = clock.event()
+        self._running = threading.Event()
+        self._running.set()
+
+        # Wait for the timer to reach the clock, a virtual clock would
+        # otherwise move on without it
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self.__run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait(START_TIMEOUT)
+
+    def start(self, key, message, period, delay=None):
+        """Sends `message` every `period` seconds, the first time after
+        `delay` seconds (one period by default)
+
+        Starting a key again replaces its message and period.
+
+        Raises:
+            ValueError: The period is not positive
+        """
+        if period <= 0:
+            raise ValueError("Period must be positive: {p}".format(p=period))
+        if delay is None:
+            delay = period
+
+        with self._lock:
+            old = self.messages.get(key)
+            if old is not None:
+                old.active = False
+            entry = PeriodicMessage(key, message, period,
+                                    self.clock.time() + delay)
+            self.messages[key] = entry
+            self.__push(entry)
+        self._changed.set()
+        return entry
+
+    def update(self, key, message):
+        """Replaces the message sent for `key`, keeping its schedule"""
+        with self._lock:
+            entry = self.messages.get(key)
+            if entry is None:
+                return False
+            entry.message = message
+            return True
+
+    def stop(self, key):
+        with self._lock:
+            entry = self.messages.pop(key, None)
+            if entry is None:
+                return False
+            # Its heap entry is skipped when it comes up
+            entry.active = False
+            return True
+
+    def clear(self):
+        with self._lock:
+            for entry in self.messages.values():
+                entry.active = False
+            self.messages = {}
+            self._heap = []
+
+    def shutdown(self):
+        self.clear()
+        self._running.clear()
+        self._changed.set()
+
+    def __push(self, entry):
+        heapq.heappush(self._heap, (entry.deadline, next(self._seq), entry))
+
+    def __due(self, now):
+        # Pops the messages due at `now` and schedules their next run
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, seq, entry = heapq.heappop(heap)
+            if not entry.active:
+                continue
+
+            due.append(entry.message)
+            entry.sent += 1
+            late = now - deadline
+            if late > entry.max_late:
+                entry.max_late = late
+
+            missed = int(late / entry.period)
+            entry.skipped += missed
+            entry.deadline = deadline + entry.period * (missed + 1)
+            self.__push(entry)
+        return due
+
+    def __run(self):
+        clock = self.clock
+        while self._running.is_set():
+            self._changed.clear()
+            with self._lock:
+                due = self.__due(clock.time())
+                next_run = None
+                if self._heap:
+                    next_run = self._heap[0][0]
+
+            for message in due:
+                self.send(message)
+
+            if next_run is None:
+                self._started.set()
+                clock.wait(self._changed, IDLE_DELAY)
+                continue
+
+            remaining = next_run - clock.time()
+            if remaining > SPIN_THRESHOLD:
+                if clock.wait(self._changed, remaining - SPIN_THRESHOLD):
+                    continue
+            clock.sleep_until(next_run)
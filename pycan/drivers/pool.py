@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Driver Pool
+
+Opening a hardware driver (port setup, flushes, bit rate, bus on) is slow,
+so a DriverPool keeps the drivers it opened alive and hands out light
+weight sessions instead:
+
+    pool = DriverPool()
+    session = pool.session("setup.cfg", [IDMaskFilter(0x7FF, 0x123, False)])
+    session.send(msg)
+    reply = session.next_message(timeout=1)
+    session.close()  # the driver stays open for the next session
+
+A DriverSession implements the driver API (send, next_message, receive
+taps, ...) with its own inbound queue and receive filters.  One reader
+thread per pooled driver hands every received frame to the sessions
+whose filters match it; frames arriving while no session is open are
+discarded, so a new (or `reset`) session starts from a clean queue without
+the driver going off and on the bus.
+
+Drivers are keyed by their setup file (or by the name given to `add`) and
+reopened when the setup file (or the keyword arguments a session asks
+for) changed while no session was open; asking for other keyword
+arguments while the driver is in use raises a ValueError.  `shutdown`
+closes them all, the module's DEFAULT_POOL (see `get_session`) is shut
+down at exit.
+"""
+import os
+import Queue
+import atexit
+import threading
+import basedriver
+from pycan.common import release_message
+from pycan.config import load_config
+
+MAX_BUFFER_SIZE = 1000
+READ_TIMEOUT = 0.1  # seconds
+
+
+class DriverSession(basedriver.BaseDriverAPI):
+    """A handle on a pooled driver
+
+    Attributes:
+        pool: The DriverPool the session came from
+        key: Key of the driver in the pool
+        driver: The shared driver
+        filters: List of IDMaskFilters, a frame is received if any match
+                 (an empty list receives everything)
+        inbound_dropped: Number of frames lost to a full inbound queue
+    """
+    def __init__(self, pool, key, driver, filters=None,
+                 max_buffer_size=MAX_BUFFER_SIZE):
+        """Inits DriverSession."""
+        self.pool = pool
+        self.key = key
+        self.driver = driver
+        self.filters = list(filters or [])
+        self.clock = getattr(driver, "clock", None)
+        self.inbound = Queue.Queue(max_buffer_size)
+        self.inbound_count = 0
+        self.outbound_count = 0
+        self.inbound_dropped = 0
+        self.closed = False
+
+    def send(self, message):
+        if not self.driver.send(message):
+            return False
+        self.outbound_count += 1
+        return True
+
+    def next_message(self, timeout=None):
+        try:
+            new_msg = self.inbound.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        self.inbound_count += 1
+        return new_msg
+
+    def life_time_sent(self):
+        return self.outbound_count
+
+    def life_time_received(self):
+        return self.inbound_count
+
+    def set_filters(self, filters):
+        self.filters = list(filters or [])
+
+    def reset(self):
+        """Discards the pending frames and clears the counters and receive
+        taps (the driver stays on bus)
+        """
+        self.receive_taps = ()
+        try:
+            while True:
+                release_message(self.inbound.get_nowait())
+        except Queue.Empty:
+            pass
+        self.inbound_count = 0
+        self.outbound_count = 0
+        self.inbound_dropped = 0
+
+    def close(self):
+        """Gives the driver back to the pool"""
+        if not self.closed:
+            self.closed = True
+            self.clear_periodic()
+            self.pool.release(self)
+            self.reset()
+
+    shutdown = close
+
+    def deliver(self, message):
+        """Queues a received frame if it passes the filters"""
+        if self.filters:
+            for mask_filter in self.filters:
+                if mask_filter.filter_match(message):
+                    break
+            else:
+                return
+
+        retain = getattr(message, "retain", None)
+        if retain is not None:
+            retain()
+        self.receive_message(message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _PooledDriver(object):
+    """A pooled driver and the thread reading its frames"""
+    def __init__(self, driver, config=None, kwargs=None):
+        self.driver = driver
+        self.config = config
+        self.kwargs = kwargs
+        self.sessions = ()
+        self._running = threading.Event()
+        self._running.set()
+        self._thread = driver.start_daemon(self.__read)
+
+    def conflicts(self, kwargs):
+        """Returns the names of the keyword arguments the driver was not
+        opened with (all of them for drivers given to the pool)
+        """
+        if self.kwargs is None:
+            return sorted(kwargs)
+        return sorted(k for k in kwargs
+                      if k not in self.kwargs or self.kwargs[k] != kwargs[k])
+
+    def stop(self):
+        # The reader leaves on its next read, without being waited for
+        self._running.clear()
+        self.sessions = ()
+        self.driver.shutdown()
+
+    def __read(self):
+        driver = self.driver
+        while self._running.is_set():
+            msg = driver.next_message(timeout=READ_TIMEOUT)
+            if msg is None:
+                continue
+            if self._running.is_set():
+                for session in self.sessions:
+                    session.deliver(msg)
+            release_message(msg)
+
+
+class DriverPool(object):
+    """Keeps drivers open between sessions
+
+    Attributes:
+        max_buffer_size: Default inbound queue size of the sessions
+    """
+    def __init__(self, max_buffer_size=MAX_BUFFER_SIZE):
+        """Inits DriverPool."""
+        self.max_buffer_size = max_buffer_size
+        self._drivers = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, driver):
+        """Pools an already opened driver under `key`
+
+        Raises:
+            KeyError: A driver is already pooled under the key
+        """
+        with self._lock:
+            if key in self._drivers:
+                raise KeyError(key)
+            self._drivers[key] = _PooledDriver(driver)
+
+    def session(self, source, filters=None, max_buffer_size=None,
+                **kwargs):
+        """Opens a session on a pooled driver
+
+        Args:
+            source: A key given to `add` or a setup file, the file's
+                    driver is opened (with `kwargs`, see
+                    factory.get_driver) unless it is already pooled
+            filters: List of IDMaskFilters for the received frames
+            max_buffer_size: Size of the session's inbound queue
+
+        Raises:
+            ValueError: The driver is in use with other keyword arguments
+            Whatever factory.get_driver raises for the setup file
+        """
+        if max_buffer_size is None:
+            max_buffer_size = self.max_buffer_size
+
+        with self._lock:
+            key = source
+            if key not in self._drivers:
+                key = os.path.abspath(source)
+            pooled = self._drivers.get(key)
+
+            if pooled is not None and pooled.config is not None:
+                # Reopen drivers whose setup file (or arguments) changed
+                # once unused
+                config = load_config(key)
+                if not pooled.sessions and (config is not pooled.config or
+                                            pooled.conflicts(kwargs)):
+                    del self._drivers[key]
+                    pooled.stop()
+                    pooled = None
+
+            if pooled is not None:
+                conflicts = pooled.conflicts(kwargs)
+                if conflicts:
+                    raise ValueError("Driver {k} is in use with other "
+                                     "{a}".format(k=key,
+                                                  a=", ".join(conflicts)))
+
+            if pooled is None:
+                # Only setup files need the factory
+                from pycan.drivers.factory import get_driver
+                config = load_config(key)
+                pooled = _PooledDriver(get_driver(key, **kwargs), config,
+                                       kwargs)
+                self._drivers[key] = pooled
+
+            session = DriverSession(self, key, pooled.driver, filters,
+                                    max_buffer_size)
+            pooled.sessions = pooled.sessions + (session,)
+        return session
+
+    def release(self, session):
+        """Detaches a session, its driver stays open"""
+        with self._lock:
+            pooled = self._drivers.get(session.key)
+            if pooled is not None:
+                pooled.sessions = tuple(s for s in pooled.sessions
+                                        if s is not session)
+
+    def sessions(self, key):
+        """Returns the open sessions of a pooled driver"""
+        pooled = self._drivers.get(key)
+        if pooled is None:
+            return ()
+        return pooled.sessions
+
+    def keys(self):
+        return self._drivers.keys()
+
+    def close(self, key):
+        """Shuts a pooled driver down (its sessions stop receiving)"""
+        with self._lock:
+            pooled = self._drivers.pop(key, None)
+        if pooled is not None:
+            pooled.stop()
+
+    def shutdown(self):
+        """Shuts every pooled driver down"""
+        with self._lock:
+            pooled_drivers = self._drivers.values()
+            self._drivers = {}
+        for pooled in pooled_drivers:
+            pooled.stop()
+
+
+DEFAULT_POOL = DriverPool()
+atexit.register(DEFAULT_POOL.shutdown)
+
+
+def get_session(source, filters=None, **kwargs):
+    """Opens a session on the DEFAULT_POOL, see DriverPool.session"""
+    return DEFAULT_POOL.session(source, filters, **kwargs)
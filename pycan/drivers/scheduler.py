@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Outbound frame scheduling
+
+OutboundScheduler is a bounded drop-in replacement for the drivers'
+outbound Queue.Queue which hands out the pending frames by priority
+instead of FIFO and optionally caps the bus load with a token bucket
+refilled at `bus_load * bit_rate` bits per second (each frame costs its
+`frame_bits`).
+
+By default the priority follows CAN arbitration: the lower identifier
+wins and a standard frame wins over an extended frame with the same base
+identifier.  Frames of equal priority keep their order.  The frame is
+picked when its bus time is available, so a critical frame queued while
+the bus load cap holds the outbound thread back still goes first.
+
+Drivers create their outbound buffer with BaseDriverAPI.new_outbound_queue
+which returns a scheduler when any of the "tx_priority", "tx_bus_load"
+keyword arguments are given.
+"""
+import time
+import heapq
+import Queue
+import itertools
+from pycan.common import frame_bits
+from pycan.clock import SYSTEM_CLOCK
+
+DEFAULT_BIT_RATE = 250000  # bits / second
+DEFAULT_BURST = 0.01  # seconds of bus time
+MAX_FRAME_BITS = 160  # extended, 8 bytes, worst case stuffing
+
+
+def arbitration_priority(message):
+    """Returns the priority of a frame on the bus (lower wins)"""
+    if message.extended:
+        return (message.id & 0x1FFFFFFF) << 1 | 1
+    return (message.id & 0x7FF) << 19
+
+
+class TokenBucket(object):
+    """Bus time budget
+
+    Attributes:
+        rate: Bits added per second
+        capacity: Max bits saved up (the burst size)
+        tokens: Bits currently available
+        waited: Total time (seconds) spent waiting for tokens
+    """
+    def __init__(self, rate, capacity=None, clock=SYSTEM_CLOCK):
+        """Inits TokenBucket."""
+        if rate <= 0:
+            raise ValueError("Token rate must be positive: {r}".format(
+                             r=rate))
+        if capacity is None:
+            capacity = max(rate * DEFAULT_BURST, MAX_FRAME_BITS)
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.waited = 0.0
+        self._last = clock.time()
+
+    def refill(self):
+        now = self.clock.time()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, bits):
+        """Returns the seconds until `bits` tokens are available"""
+        self.refill()
+        if self.tokens >= bits:
+            return 0.0
+        return (bits - self.tokens) / self.rate
+
+    def consume(self, bits):
+        """Takes `bits` tokens, waiting until they are available"""
+        wait = self.delay(bits)
+        if wait > 0:
+            self.waited += wait
+            self.clock.sleep_until(self._last + wait)
+            self.refill()
+        self.tokens -= bits
+
+
+class OutboundScheduler(Queue.Queue):
+    """Bounded priority queue of outbound frames with a bus load cap
+
+    Attributes:
+        priority: Callable returning the priority of a frame (lower first)
+        bucket: The TokenBucket limiting the bus load (or None)
+        stuffing: A boolean indicating if worst case stuff bits are counted
+    """
+    def __init__(self, maxsize=0, priority=None, bus_load=None,
+                 bit_rate=DEFAULT_BIT_RATE, burst=None, stuffing=True,
+                 clock=SYSTEM_CLOCK):
+        """Inits OutboundScheduler.
+
+        Args:
+            maxsize: Max pending frames (0 for unbounded)
+            priority: None (arbitration order), a {can_id: priority}
+                      dictionary (ids not listed come after, in
+                      arbitration order) or a callable taking the frame
+            bus_load: Cap on the bus load (0.0 - 1.0) or None
+            bit_rate: Bus bit rate (bits / second)
+            burst: Bits that may be sent back to back (default 10 ms
+                   worth)
+        """
+        Queue.Queue.__init__(self, maxsize)
+        self.priority = self.__priority_function(priority)
+        self.stuffing = stuffing
+        self.bucket = None
+        if bus_load is not None:
+            self.bucket = TokenBucket(bus_load * bit_rate, burst, clock)
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the pending frame with the best priority,
+        waiting for bus time when the bus load is capped
+
+        The best frame stays queued while its bus time is waited for, and
+        the queue is checked again afterwards.  `block` and `timeout` (real
+        time, like Queue.Queue's) cover the wait for bus time as well.
+        """
+        bucket = self.bucket
+        if bucket is None:
+            return Queue.Queue.get(self, block, timeout)
+
+        stop = None
+        if block and timeout is not None:
+            if timeout < 0:
+                raise ValueError("'timeout' must be a non-negative number")
+            stop = time.time() + timeout
+
+        # The frame whose bus time was waited for
+        ready = None
+        with self.not_empty:
+            while True:
+                while not self._qsize():
+                    if not block:
+                        raise Queue.Empty
+                    if stop is None:
+                        self.not_empty.wait()
+                    else:
+                        remaining = stop - time.time()
+                        if remaining <= 0:
+                            raise Queue.Empty
+                        self.not_empty.wait(remaining)
+
+                message = self.queue[0][2]
+                wait = 0.0
+                if message is not None:
+                    bits = frame_bits(message, self.stuffing)
+                    wait = bucket.delay(bits)
+                if wait <= 0 or message is ready:
+                    if message is not None:
+                        bucket.tokens -= bits
+                    message = self._get()
+                    self.not_full.notify()
+                    return message
+
+                if not block:
+                    raise Queue.Empty
+                ready = message
+                if stop is not None:
+                    remaining = stop - time.time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    if remaining < wait:
+                        wait = remaining
+                        ready = None
+
+                # Let frames be put while waiting for the bus time
+                bucket.waited += wait
+                self.mutex.release()
+                try:
+                    bucket.clock.sleep_until(bucket.clock.time() + wait)
+                finally:
+                    self.mutex.acquire()
+
+    # Queue.Queue storage hooks (called with the queue's mutex held)
+    def _init(self, maxsize):
+        self.queue = []
+        self._seq = itertools.count()
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _put(self, message):
+        # None wakes the outbound thread (see BaseDriverAPI.stop_daemons)
+        if message is None:
+            priority = -1
+        else:
+            priority = self.priority(message)
+        heapq.heappush(self.queue, (priority, next(self._seq), message))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+    def __priority_function(self, priority):
+        if priority is None:
+            return arbitration_priority
+        if callable(priority):
+            return priority
+
+        table = dict(priority)
+
+        def lookup(message):
+            return (message.id not in table, table.get(message.id),
+                    arbitration_priority(message))
+
+        return lookup
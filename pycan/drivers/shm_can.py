@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Shared memory virtual CAN driver interface
+
+This module extends the basedriver.BaseDriver class from `basedriver.py`
+to provide a simulated CAN bus shared between processes.  The bus is a
+ring buffer of fixed size frame slots in a memory mapped file.  Any
+number of processes may write to the ring (writers are serialized with a
+file lock) and every driver instance reads it with its own cursor, so
+each reader sees every frame put on the bus by the other instances.
+
+Frame slots are guarded with a sequence number which is cleared before
+and written after the frame data, allowing readers to detect slots that
+are being rewritten.  A reader whose inbound queue is full leaves the
+frames in the ring until next_message made room; readers that fall more
+than a full ring behind skip ahead and count the lost frames in
+`overrun_count`.
+
+The header counts the attached instances, the last one to shut down
+removes the file.
+
+Operating System:
+    * POSIX (requires fcntl)
+Hardware Requirements:
+    * None
+Driver Requirements:
+    * None
+"""
+import os
+import mmap
+import time
+import Queue
+import struct
+import tempfile
+import itertools
+import threading
+import basedriver
+from pycan.config import Setting, schema, integer, number, boolean, string
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+QUEUE_DELAY = 1  # seconds
+POLL_DELAY = 0.0005  # seconds
+MAX_BUFFER_SIZE = 1000
+DEFAULT_SLOTS = 4096
+DEFAULT_BUS_NAME = "pycan"
+SHM_DIR = "/dev/shm"
+
+MAGIC = "PYCANSHM"
+VERSION = 2
+# magic, version, slot count, slot size, attached instances, next sequence
+# number
+HEADER = struct.Struct("<8sIIIIQ")
+USERS_OFFSET = 20
+USERS = struct.Struct("<I")
+WRITE_SEQ_OFFSET = 24
+SEQ = struct.Struct("<Q")
+# sequence number, time stamp, can id, source, extended, dlc, payload
+SLOT = struct.Struct("<QdIQBB2x8s")
+SLOT_PAYLOAD = struct.Struct("<8B")
+
+_instance_ids = itertools.count(1)
+
+
+def bus_path(name):
+    """Returns the path of the file backing the named bus"""
+    base = SHM_DIR if os.path.isdir(SHM_DIR) else tempfile.gettempdir()
+    return os.path.join(base, "pycan_shm_%s" % name)
+
+
+class ShmCAN(basedriver.BaseDriverAPI):
+    # Frames are written straight to the ring, no outbound scheduling
+    config_schema = schema(
+        dict((k, v) for k, v in basedriver.BaseDriverAPI.config_schema.items()
+             if not k.startswith("tx_")),
+        bus=Setting(string),
+        path=Setting(string),
+        slots=Setting(integer, minimum=1),
+        poll_delay=Setting(number, minimum=0),
+        loopback=Setting(boolean))
+
+    def __init__(self, **kwargs):
+        if fcntl is None:
+            raise OSError("ShmCAN requires a POSIX operating system")
+
+        # Extract the keyword arguments
+        self.verbose = kwargs.get("verbose", False)
+        self.queue_delay = kwargs.get("queue_delay", QUEUE_DELAY)
+        self.poll_delay = float(kwargs.get("poll_delay", POLL_DELAY))
+        self.loopback = kwargs.get("loopback", False)
+        self.path = kwargs.get("path", None)
+        if self.path is None:
+            self.path = bus_path(kwargs.get("bus", DEFAULT_BUS_NAME))
+        slots = int(kwargs.get("slots", DEFAULT_SLOTS))
+        self.pool = kwargs.get("pool", None)
+
+        # Unique id used to recognize our own frames on the bus (the full
+        # pid and the instance within the process)
+        self.source = os.getpid() << 32 | next(_instance_ids) & 0xFFFFFFFF
+
+        # Map the shared ring (creating it if needed) and attach to it
+        self._fd = self.__open_locked()
+        try:
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                size = HEADER.size + slots * SLOT.size
+                os.ftruncate(self._fd, size)
+                self._map = mmap.mmap(self._fd, size)
+                HEADER.pack_into(self._map, 0, MAGIC, VERSION, slots,
+                                 SLOT.size, 0, 0)
+            else:
+                self._map = mmap.mmap(self._fd, size)
+
+            header = HEADER.unpack_from(self._map)
+            magic, version, slots, slot_size, users, seq = header
+            if (magic != MAGIC or version != VERSION or
+                    slot_size != SLOT.size):
+                self._map.close()
+                raise ValueError("{p} is not a pycan shared memory "
+                                 "bus".format(p=self.path))
+            USERS.pack_into(self._map, USERS_OFFSET, users + 1)
+        except Exception:
+            # Closing the file releases the lock
+            os.close(self._fd)
+            raise
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.slots = slots
+
+        # Only frames written after we joined the bus are received
+        self._cursor = seq
+        self._write_lock = threading.Lock()
+
+        # Build the inbound buffer
+        self.inbound = Queue.Queue(kwargs.get("max_buffer_size",
+                                              MAX_BUFFER_SIZE))
+        self.inbound_count = 0
+        self.inbound_dropped = 0
+        self.outbound_count = 0
+        self.overrun_count = 0
+
+        self._running = threading.Event()
+        self._running.set()
+        self.ib_t = self.start_daemon(self.__process_inbound_ring)
+
+    def shutdown(self):
+        self.stop_daemons(self.ib_t)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            users = USERS.unpack_from(self._map, USERS_OFFSET)[0]
+            USERS.pack_into(self._map, USERS_OFFSET, max(users - 1, 0))
+            if users <= 1:
+                # The last instance removes the bus
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+        finally:
+            self._map.close()
+            os.close(self._fd)
+
+    def send(self, message):
+        payload = bytearray(8)
+        payload[:message.dlc] = bytearray(message.payload[:message.dlc])
+
+        with self._write_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                seq = SEQ.unpack_from(self._map, WRITE_SEQ_OFFSET)[0]
+                offset = HEADER.size + (seq % self.slots) * SLOT.size
+
+                # Invalidate the slot, fill it and then publish it
+                SEQ.pack_into(self._map, offset, 0)
+                SLOT.pack_into(self._map, offset, 0, time.time(),
+                               message.id, self.source,
+                               bool(message.extended), message.dlc,
+                               str(payload))
+                SEQ.pack_into(self._map, offset, seq + 1)
+                SEQ.pack_into(self._map, WRITE_SEQ_OFFSET, seq + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        self.outbound_count += 1
+        if self.verbose:
+            print "\n", message
+
+        return True
+
+    def next_message(self, timeout=None):
+        if timeout is not None:
+            stop = time.time() + timeout
+        while 1:
+            try:
+                new_msg = self.inbound.get(timeout=self.queue_delay)
+                self.inbound_count += 1
+                return new_msg
+            except Queue.Empty:
+                pass
+
+            if timeout is not None:
+                if time.time() > stop:
+                    return None
+
+    def life_time_sent(self):
+        return self.outbound_count
+
+    def life_time_received(self):
+        return self.inbound_count
+
+    def __open_locked(self):
+        # Opens and locks the bus file, again if its last user removed it
+        # while we were waiting for the lock
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                info = os.stat(self.path)
+                opened = os.fstat(fd)
+                if (info.st_dev, info.st_ino) == (opened.st_dev,
+                                                  opened.st_ino):
+                    return fd
+            except OSError:
+                pass
+            os.close(fd)
+
+    def __read_slot(self, seq):
+        offset = HEADER.size + (seq % self.slots) * SLOT.size
+        frame = SLOT.unpack_from(self._map, offset)
+        if frame[0] != seq + 1:
+            return None
+
+        # Make sure the writer didn't touch the slot while we copied it
+        if SEQ.unpack_from(self._map, offset)[0] != seq + 1:
+            return None
+
+        return frame
+
+    def __process_inbound_ring(self):
+        while self._running.is_set():
+            write_seq = SEQ.unpack_from(self._map, WRITE_SEQ_OFFSET)[0]
+            if self._cursor == write_seq:
+                time.sleep(self.poll_delay)
+                continue
+
+            # Skip whatever has already been overwritten
+            if write_seq - self._cursor > self.slots:
+                self.overrun_count += write_seq - self._cursor - self.slots
+                self._cursor = write_seq - self.slots
+
+            while self._cursor < write_seq:
+                frame = self.__read_slot(self._cursor)
+                self._cursor += 1
+                if frame is None:
+                    self.overrun_count += 1
+                    continue
+
+                seq, ts, can_id, source, ext, dlc, data = frame
+                if source == self.source and not self.loopback:
+                    continue
+
+                # Leave the frames in the ring while the inbound queue is
+                # full (unless subscriptions must not be held up)
+                while (self.inbound.full() and self._running.is_set() and
+                       self.subscription_ring is None):
+                    time.sleep(self.poll_delay)
+
+                payload = list(SLOT_PAYLOAD.unpack(data)[:dlc])
+                new_msg = self.new_message(can_id, payload, bool(ext), ts)
+                self.receive_message(new_msg)
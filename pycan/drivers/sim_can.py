@@ -8,6 +8,22 @@
 This module extends the basedriver.BaseDriver class from `basedriver.py`
 to provide an interface to a fake CAN hardware interface.
 
+On its own the driver generates a fixed set of known frames.  When it is
+attached to a `virtual_bus.VirtualBus` (the `bus` keyword, either a bus
+object or the name of a shared bus) sent frames are broadcast to the other
+nodes on that bus and frames from other nodes show up in `next_message`.
+
+With the `trace` keyword (an ASC file, asc.read_columns style columns or
+an analytics.ColumnarTrace) the driver receives the frames of a recorded
+trace instead.  They are built before the replay starts and received on
+the trace's schedule divided by `trace_speed` (1.0 for the original
+timing, 0 for as fast as they are read), `trace_loop` replays the trace
+over and over (with the time stamps moved on by each pass).  The schedule
+follows the driver's clock, so a replay on a VirtualClock is
+deterministic.  No trace frame is dropped: while the inbound queue is full
+the replay waits for next_message (and the schedule is moved on by the
+wait), with or without subscriptions.
+
 Operating System:
     * Independant
 Hardware Requirements:
@@ -16,11 +32,13 @@ Driver Requirements:
     * None
 """
 import sys
-import time
 import Queue
 import threading
 import basedriver
+import virtual_bus
 from pycan.common import CANMessage
+from pycan.clock import SYSTEM_CLOCK
+from pycan.config import Setting, schema, number, boolean, string
 
 QUEUE_DELAY = 1
 MAX_BUFFER_SIZE = 1000
@@ -28,20 +46,100 @@ CAN_TX_SEND_DELAY = 0.0005
 UNIQUE_SIM_MESSAGES = 8
 SIM_PAYLOAD_SIZE = 8
 DEFAULT_SIM_RX_RATE = 0.010
+PAYLOAD_SIZE = 8
+
+
+def load_trace(trace):
+    """Returns the (time offset, CANMessage) pairs of a trace
+
+    Args:
+        trace: An ASC file (possibly compressed), asc.read_columns style
+               columns or an object with the same columns as attributes
+               (e.g. an analytics.ColumnarTrace)
+    """
+    if isinstance(trace, basestring):
+        from pycan.tools.parsers import asc
+        trace = asc.read_columns(trace)
+
+    def values(name):
+        if isinstance(trace, dict):
+            column = trace[name]
+        else:
+            column = getattr(trace, name)
+        if hasattr(column, "tolist"):
+            return column.tolist()
+        return list(column)
+
+    times = values("time")
+    ids = values("id")
+    exts = values("extended")
+    dlcs = values("dlc")
+    chans = values("channel")
+    payloads = values("data")
+    if payloads and not isinstance(payloads[0], list):
+        # Flat, zero padded payloads
+        payloads = [payloads[x * PAYLOAD_SIZE:(x + 1) * PAYLOAD_SIZE]
+                    for x in range(len(times))]
+
+    if not times:
+        return []
+    start = times[0]
+    return [(times[x] - start,
+             CANMessage(int(ids[x]), payloads[x][:dlcs[x]], bool(exts[x]),
+                        times[x], chans[x]))
+            for x in range(len(times))]
 
 
 class SimCAN(basedriver.BaseDriverAPI):
+    config_schema = schema(
+        basedriver.BaseDriverAPI.config_schema,
+        inbound_time=Setting(number, minimum=0),
+        tx_delay=Setting(number, minimum=0),
+        bus=Setting(string),
+        loopback=Setting(boolean),
+        simulate_traffic=Setting(boolean),
+        trace=Setting(string),
+        trace_speed=Setting(number, minimum=0),
+        trace_loop=Setting(boolean))
+
     def __init__(self, **kwargs):
         # Extract the keyword arguments
         self.verbose = kwargs.get("verbose", False)
-        self.sim_delay = kwargs.get("inbound_time", DEFAULT_SIM_RX_RATE)
+        self.sim_delay = float(kwargs.get("inbound_time",
+                                          DEFAULT_SIM_RX_RATE))
+        self.tx_delay = float(kwargs.get("tx_delay", CAN_TX_SEND_DELAY))
+        self.queue_delay = kwargs.get("queue_delay", QUEUE_DELAY)
+        self.clock = kwargs.get("clock", SYSTEM_CLOCK)
 
         # Build the inbound and output buffers
-        self.inbound = Queue.Queue(MAX_BUFFER_SIZE)
+        buffer_size = kwargs.get("max_buffer_size", MAX_BUFFER_SIZE)
+        self.inbound = self.clock.queue(buffer_size)
         self.inbound_count = 0
-        self.outbound = Queue.Queue(MAX_BUFFER_SIZE)
+        self.inbound_dropped = 0
+        self.outbound = self.new_outbound_queue(buffer_size, kwargs)
         self.outbound_count = 0
 
+        # Attach to the virtual bus (if any)
+        bus = kwargs.get("bus", None)
+        if isinstance(bus, basestring):
+            bus = virtual_bus.get_bus(bus)
+        self.bus = bus
+        self.bus_node = None
+        if bus is not None:
+            self.bus_node = bus.attach(self.__deliver,
+                                       kwargs.get("filters", None),
+                                       kwargs.get("loopback", False))
+        # Build the trace replay (if any) up front
+        trace = kwargs.get("trace", None)
+        self.trace_frames = None
+        self.trace_speed = kwargs.get("trace_speed", 1.0)
+        self.trace_loop = kwargs.get("trace_loop", False)
+        self.trace_done = threading.Event()
+        if trace is not None:
+            self.trace_frames = load_trace(trace)
+        simulate = kwargs.get("simulate_traffic",
+                              bus is None and trace is None)
+
         # Setup the simulated traffic
         self.inbound_index = 0
         self.known_msgs = []
@@ -56,12 +154,26 @@ class SimCAN(basedriver.BaseDriverAPI):
         self._running = threading.Event()
         self._running.set()
         self.ob_t = self.start_daemon(self.__process_outbound_queue)
-        self.ib_t = self.start_daemon(self.__process_inbound_queue)
+        self.ib_t = None
+        self.trace_t = None
+        if simulate:
+            self.ib_t = self.start_daemon(self.__process_inbound_queue)
+        if self.trace_frames is not None:
+            # The schedule starts now, not when the thread gets to run
+            self._trace_start = self.clock.time()
+            self.trace_t = self.start_daemon(self.__process_trace)
+
+    def shutdown(self):
+        # The simulated traffic thread is left to finish on its own, it
+        # may be parked on a virtual clock
+        self.stop_daemons(self.ob_t)
+        if self.bus_node is not None:
+            self.bus_node.detach()
 
     def send(self, message):
         while 1:
             try:
-                self.outbound.put(message, QUEUE_DELAY)
+                self.outbound.put(message, self.queue_delay)
                 self.outbound_count += 1
                 return True
             except Queue.Full:
@@ -69,17 +181,17 @@ class SimCAN(basedriver.BaseDriverAPI):
 
     def next_message(self, timeout=None):
         if timeout is not None:
-            stop = time.time() + timeout
+            stop = self.clock.time() + timeout
         while 1:
             try:
-                new_msg = self.inbound.get(timeout=QUEUE_DELAY)
+                new_msg = self.inbound.get(timeout=self.queue_delay)
                 self.inbound_count += 1
                 return new_msg
             except Queue.Empty:
                 pass
 
             if timeout is not None:
-                if time.time() > stop:
+                if self.clock.time() > stop:
                     return None
 
     def life_time_sent(self):
@@ -91,26 +203,93 @@ class SimCAN(basedriver.BaseDriverAPI):
     def __process_outbound_queue(self):
         while self._running.is_set():
             try:
-                can_msg = self.outbound.get(timeout=QUEUE_DELAY)
-                time.sleep(CAN_TX_SEND_DELAY)
+                can_msg = self.outbound.get(timeout=self.queue_delay)
             except Queue.Empty:
                 continue
+            if can_msg is None:
+                continue
+            self.clock.sleep(self.tx_delay)
+
+            if self.bus_node is not None:
+                self.bus_node.send(can_msg)
 
             if self.verbose:
                 print "\n", can_msg
 
+    def __deliver(self, message):
+        # Called from the sending node's thread - never block the bus
+        self.receive_message(message)
+
     def __process_inbound_queue(self):
         while self._running.is_set():
             # Generate some known CAN traffic
-            time.sleep(self.sim_delay)
+            self.clock.sleep(self.sim_delay)
 
-            try:
-                self.inbound.put(self.known_msgs[self.inbound_index])
+            new_msg = self.known_msgs[self.inbound_index]
+            if self.receive_message(new_msg, self.queue_delay):
                 self.inbound_index += 1
                 self.inbound_index = self.inbound_index % 8
+
+    def __receive_trace(self, message):
+        """Receives a trace frame, waiting for room in the inbound queue
+
+        Returns:
+            The time spent waiting for room (None if the driver stopped)
+        """
+        self.tap_message(message)
+        if self.subscription_ring is not None:
+            self.subscription_ring.publish(message)
+
+        waited = 0.0
+        while self._running.is_set():
+            full = self.inbound.full()
+            before = self.clock.time()
+            try:
+                self.inbound.put(message, timeout=self.queue_delay)
             except Queue.Full:
-                # TODO (A. Lewis) Add logging warning
-                pass
+                waited += self.clock.time() - before
+                continue
+            if full:
+                waited += self.clock.time() - before
+            return waited
+        return None
+
+    def __process_trace(self):
+        frames = self.trace_frames
+        start = self._trace_start
+        length = 0.0
+        if frames:
+            length = frames[-1][0]
+        # The next pass starts one mean frame gap after the last frame
+        period = length + length / max(len(frames) - 1, 1)
+        shift = 0.0
+
+        while self._running.is_set():
+            for offset, new_msg in frames:
+                if self.trace_speed:
+                    self.clock.sleep_until(start + offset / self.trace_speed)
+                if not self._running.is_set():
+                    return
+                if shift:
+                    new_msg = CANMessage(new_msg.id, list(new_msg.payload),
+                                         new_msg.extended,
+                                         new_msg.time_stamp + shift,
+                                         new_msg.channel)
+                waited = self.__receive_trace(new_msg)
+                if waited is None:
+                    return
+                # Keep the gaps of the frames still to come
+                start += waited
+
+            if not self.trace_loop or not frames:
+                break
+            shift += period
+            if self.trace_speed:
+                start += period / self.trace_speed
+            else:
+                start = self.clock.time()
+
+        self.trace_done.set()
 
     def __generate_known_messages(self):
         # Create fake CAN traffic
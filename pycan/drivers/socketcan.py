@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Linux SocketCAN driver interface
+
+This module extends the basedriver.BaseDriver class from `basedriver.py`
+to provide an interface to any CAN device supported by the Linux kernel
+(including the `vcan` virtual interface) through raw AF_CAN sockets.
+
+The socket is driven through libc with ctypes so the driver also works on
+Python builds without AF_CAN support in the socket module.  Frames are
+received with recvmmsg and sent with sendmmsg in batches of up to
+`BATCH_SIZE` frames per system call, acceptance filtering is done by the
+kernel (CAN_RAW_FILTER) and receive time stamps come from the kernel
+(SO_TIMESTAMP).
+
+A full transmit queue (ENOBUFS / EAGAIN) is waited out with a growing
+back off for up to `queue_delay` seconds.  Frames that can still not be
+sent are counted in `outbound_dropped`, failed system calls in
+`tx_errors` / `rx_errors` and the last failure is kept in `last_error`.
+
+Periodic transmissions (start_periodic) are handed to the kernel's
+broadcast manager (CAN_BCM), which sends them from a kernel timer without
+any Python thread involved.  Those frames never pass through `send`,
+life_time_sent counts them from their periods (`periodic_count`).
+
+Operating System:
+    * Linux 2.6.33 +
+Hardware Requirements:
+    * Any SocketCAN supported interface
+Driver Requirements:
+    * can / can_raw kernel modules (vcan for the virtual interface)
+        - ip link add dev vcan0 type vcan && ip link set up vcan0
+"""
+import os
+import sys
+import time
+import Queue
+import threading
+import basedriver
+from pycan.config import Setting, schema, integer, boolean, string
+from ctypes import *
+from ctypes.util import find_library
+
+QUEUE_DELAY = 1  # second
+CAN_RX_TIMEOUT = 100  # ms
+MAX_BUFFER_SIZE = 1000
+BATCH_SIZE = 32
+SOCKET_BUFFER_SIZE = 1024 * 1024  # bytes
+DEFAULT_INTERFACE = "can0"
+
+# linux/socket.h, linux/can.h, linux/can/raw.h
+AF_CAN = 29
+SOCK_RAW = 3
+SOCK_DGRAM = 2
+CAN_RAW = 1
+CAN_BCM = 2
+SOL_SOCKET = 1
+SO_SNDBUF = 7
+SO_RCVBUF = 8
+SO_RCVTIMEO = 20
+SO_TIMESTAMP = 29
+SOL_CAN_RAW = 101
+CAN_RAW_FILTER = 1
+CAN_RAW_LOOPBACK = 3
+CAN_RAW_RECV_OWN_MSGS = 4
+MSG_WAITFORONE = 0x10000
+
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+
+# linux/can/bcm.h
+TX_SETUP = 1
+SETTIMER = 0x0001
+STARTTIMER = 0x0002
+
+EAGAIN = 11
+EINTR = 4
+ENOBUFS = 105
+
+TX_RETRY_DELAY = 0.0002  # seconds
+TX_MAX_RETRY_DELAY = 0.01  # seconds
+RX_ERROR_DELAY = 0.01  # seconds
+
+
+class can_frame(Structure):
+    _fields_ = [("can_id", c_uint32),
+                ("can_dlc", c_uint8),
+                ("pad", c_uint8 * 3),
+                ("data", c_uint8 * 8)]
+
+
+class sockaddr_can(Structure):
+    _fields_ = [("can_family", c_ushort),
+                ("can_ifindex", c_int),
+                ("can_addr", c_uint8 * 16)]
+
+
+class can_filter(Structure):
+    _fields_ = [("can_id", c_uint32),
+                ("can_mask", c_uint32)]
+
+
+class iovec(Structure):
+    _fields_ = [("iov_base", c_void_p),
+                ("iov_len", c_size_t)]
+
+
+class msghdr(Structure):
+    _fields_ = [("msg_name", c_void_p),
+                ("msg_namelen", c_uint32),
+                ("msg_iov", POINTER(iovec)),
+                ("msg_iovlen", c_size_t),
+                ("msg_control", c_void_p),
+                ("msg_controllen", c_size_t),
+                ("msg_flags", c_int)]
+
+
+class mmsghdr(Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", c_uint)]
+
+
+class timeval(Structure):
+    _fields_ = [("tv_sec", c_long),
+                ("tv_usec", c_long)]
+
+
+class bcm_msg_head(Structure):
+    _fields_ = [("opcode", c_uint32),
+                ("flags", c_uint32),
+                ("count", c_uint32),
+                ("ival1", timeval),
+                ("ival2", timeval),
+                ("can_id", c_uint32),
+                ("nframes", c_uint32)]
+
+
+class bcm_tx_msg(Structure):
+    # The frames following the header are 8 byte aligned
+    _fields_ = [("head", bcm_msg_head),
+                ("pad", c_uint8 * (-sizeof(bcm_msg_head) % 8)),
+                ("frame", can_frame)]
+
+
+class cmsg_timestamp(Structure):
+    # cmsghdr followed by the SCM_TIMESTAMP payload
+    _fields_ = [("cmsg_len", c_size_t),
+                ("cmsg_level", c_int),
+                ("cmsg_type", c_int),
+                ("ts", timeval)]
+
+
+_libc = None
+
+
+def libc():
+    """Returns the C library (loaded on first use)"""
+    global _libc
+    if _libc is None:
+        _libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def build_filters(filters):
+    """Converts IDMaskFilters to a kernel can_filter array"""
+    kernel_filters = (can_filter * len(filters))()
+    for x, f in enumerate(filters):
+        if f.extended:
+            kernel_filters[x].can_id = (f.code & CAN_EFF_MASK) | CAN_EFF_FLAG
+            kernel_filters[x].can_mask = ((f.mask & CAN_EFF_MASK) |
+                                          CAN_EFF_FLAG | CAN_RTR_FLAG)
+        else:
+            kernel_filters[x].can_id = f.code & CAN_SFF_MASK
+            kernel_filters[x].can_mask = ((f.mask & CAN_SFF_MASK) |
+                                          CAN_EFF_FLAG | CAN_RTR_FLAG)
+    return kernel_filters
+
+
+def encode_frame(frame, can_msg):
+    """Fills a can_frame from a CANMessage"""
+    if can_msg.extended:
+        frame.can_id = (can_msg.id & CAN_EFF_MASK) | CAN_EFF_FLAG
+    else:
+        frame.can_id = can_msg.id & CAN_SFF_MASK
+    frame.can_dlc = can_msg.dlc
+    for y in range(can_msg.dlc):
+        frame.data[y] = can_msg.payload[y]
+    return frame
+
+
+class _FrameBatch(object):
+    """Preallocated frames / headers for one recvmmsg / sendmmsg call"""
+    def __init__(self, size):
+        self.frames = (can_frame * size)()
+        self.iovs = (iovec * size)()
+        self.cmsgs = (cmsg_timestamp * size)()
+        self.msgs = (mmsghdr * size)()
+
+        for x in range(size):
+            self.iovs[x].iov_base = addressof(self.frames[x])
+            self.iovs[x].iov_len = sizeof(can_frame)
+            hdr = self.msgs[x].msg_hdr
+            hdr.msg_iov = pointer(self.iovs[x])
+            hdr.msg_iovlen = 1
+            hdr.msg_control = addressof(self.cmsgs[x])
+            hdr.msg_controllen = sizeof(cmsg_timestamp)
+
+
+class SocketCAN(basedriver.BaseDriverAPI):
+    native_periodic = True
+
+    config_schema = schema(
+        basedriver.BaseDriverAPI.config_schema,
+        channel=Setting(string),
+        batch_size=Setting(integer, minimum=1),
+        socket_buffer=Setting(integer, minimum=1024),
+        rx_timeout=Setting(integer, minimum=1),
+        loopback=Setting(boolean),
+        receive_own=Setting(boolean))
+
+    def __init__(self, **kwargs):
+        # Extract the keyword arguments
+        self.verbose = kwargs.get("verbose", False)
+        self.queue_delay = kwargs.get("queue_delay", QUEUE_DELAY)
+        rx_timeout = int(kwargs.get("rx_timeout", CAN_RX_TIMEOUT))
+        self.interface = kwargs.get("channel", DEFAULT_INTERFACE)
+        self.batch_size = int(kwargs.get("batch_size", BATCH_SIZE))
+        socket_buffer = int(kwargs.get("socket_buffer",
+                                       SOCKET_BUFFER_SIZE))
+        self.pool = kwargs.get("pool", None)
+
+        # Open and bind the raw CAN socket
+        self._fd = self.__check(libc().socket(AF_CAN, SOCK_RAW, CAN_RAW))
+        ifindex = libc().if_nametoindex(self.interface)
+        if ifindex == 0:
+            raise OSError("Unknown CAN interface {i}".format(
+                          i=self.interface))
+        self._ifindex = ifindex
+        self._bcm = {}
+        self._bcm_sent = 0
+
+        self.__set_option(SOL_SOCKET, SO_RCVBUF, c_int(socket_buffer))
+        self.__set_option(SOL_SOCKET, SO_SNDBUF, c_int(socket_buffer))
+        self.__set_option(SOL_SOCKET, SO_TIMESTAMP, c_int(1))
+        self.__set_option(SOL_SOCKET, SO_RCVTIMEO,
+                          timeval(rx_timeout // 1000,
+                                  rx_timeout % 1000 * 1000))
+        self.__set_option(SOL_CAN_RAW, CAN_RAW_LOOPBACK,
+                          c_int(int(kwargs.get("loopback", True))))
+        self.__set_option(SOL_CAN_RAW, CAN_RAW_RECV_OWN_MSGS,
+                          c_int(int(kwargs.get("receive_own", False))))
+
+        addr = sockaddr_can(AF_CAN, ifindex)
+        self.__check(libc().bind(self._fd, byref(addr), sizeof(addr)))
+
+        # Let the kernel drop what we are not interested in
+        filters = kwargs.get("filters", None)
+        if filters:
+            self.set_filters(filters)
+
+        # Build the inbound and output buffers
+        buffer_size = kwargs.get("max_buffer_size", MAX_BUFFER_SIZE)
+        self.inbound = Queue.Queue(buffer_size)
+        self.inbound_count = 0
+        self.inbound_dropped = 0
+        self.outbound = self.new_outbound_queue(buffer_size, kwargs)
+        self.outbound_count = 0
+        self.outbound_dropped = 0
+        self.tx_errors = 0
+        self.rx_errors = 0
+        self.last_error = None
+
+        # Tell python to check for signals less often (default 1000)
+        #   - This yeilds better threading performance for timing
+        #     accuracy
+        sys.setcheckinterval(10000)
+
+        self._running = threading.Event()
+        self._running.set()
+        self.ob_t = self.start_daemon(self.__process_outbound_queue)
+        self.ib_t = self.start_daemon(self.__process_inbound_queue)
+
+    def set_filters(self, filters):
+        """Installs kernel acceptance filters (an empty list receives
+        everything)
+        """
+        if not filters:
+            kernel_filters = (can_filter * 1)(can_filter(0, 0))
+        else:
+            kernel_filters = build_filters(filters)
+        self.__set_option(SOL_CAN_RAW, CAN_RAW_FILTER, kernel_filters)
+
+    def shutdown(self):
+        self.stop_daemons(self.ib_t, self.ob_t)
+        libc().close(self._fd)
+
+    def send(self, message):
+        while 1:
+            try:
+                self.outbound.put(message, timeout=self.queue_delay)
+                self.outbound_count += 1
+                return True
+            except Queue.Full:
+                pass
+
+    def next_message(self, timeout=None):
+        if timeout is not None:
+            stop = time.time() + timeout
+        while 1:
+            try:
+                new_msg = self.inbound.get(timeout=self.queue_delay)
+                self.inbound_count += 1
+                return new_msg
+            except Queue.Empty:
+                pass
+
+            if timeout is not None:
+                if time.time() > stop:
+                    return None
+
+    def life_time_sent(self):
+        return self.outbound_count + self.periodic_count()
+
+    def periodic_count(self):
+        """Returns the number of frames sent by the broadcast manager
+
+        The kernel sends one frame per period, the first one a period
+        after the job was set up.
+        """
+        now = time.time()
+        return self._bcm_sent + sum(self.__bcm_sent(job, now)
+                                    for job in self._bcm.values())
+
+    def life_time_received(self):
+        return self.inbound_count
+
+    def start_periodic(self, message, period, key=None):
+        """Sets up a broadcast manager job sending `message` every
+        `period` seconds (see BaseDriverAPI.start_periodic)
+        """
+        if period <= 0:
+            raise ValueError("Period must be positive: {p}".format(p=period))
+        if key is None:
+            key = message.id
+        self.stop_periodic(key)
+
+        # One BCM socket per transmission, the kernel keys jobs by id
+        fd = self.__check(libc().socket(AF_CAN, SOCK_DGRAM, CAN_BCM))
+        try:
+            addr = sockaddr_can(AF_CAN, self._ifindex)
+            self.__check(libc().connect(fd, byref(addr), sizeof(addr)))
+            self.__bcm_setup(fd, message, SETTIMER | STARTTIMER, period)
+        except OSError:
+            libc().close(fd)
+            raise
+        self._bcm[key] = (fd, message.id, message.extended, period,
+                          time.time())
+        return key
+
+    def update_periodic(self, message, key=None):
+        if key is None:
+            key = message.id
+        job = self._bcm.get(key)
+        if job is None:
+            return False
+
+        fd, can_id, extended, period, started = job
+        if (can_id, extended) != (message.id, message.extended):
+            # A new id is a new kernel job
+            self.start_periodic(message, period, key)
+        else:
+            # Without SETTIMER the data changes and the timer keeps going
+            self.__bcm_setup(fd, message, 0)
+        return True
+
+    def stop_periodic(self, key):
+        job = self._bcm.pop(key, None)
+        if job is None:
+            return False
+
+        # Closing the socket removes its jobs
+        libc().close(job[0])
+        self._bcm_sent += self.__bcm_sent(job, time.time())
+        return True
+
+    def clear_periodic(self):
+        for key in self._bcm.keys():
+            self.stop_periodic(key)
+
+    def __bcm_sent(self, job, now):
+        period, started = job[3:]
+        return max(int((now - started) / period), 0)
+
+    def __bcm_setup(self, fd, message, flags, period=0.0):
+        msg = bcm_tx_msg()
+        msg.head.opcode = TX_SETUP
+        msg.head.flags = flags
+        msg.head.ival2.tv_sec = int(period)
+        msg.head.ival2.tv_usec = int(round((period - int(period)) * 1e6))
+        msg.head.nframes = 1
+        encode_frame(msg.frame, message)
+        msg.head.can_id = msg.frame.can_id
+        self.__check(libc().write(fd, byref(msg), sizeof(msg)))
+
+    def __check(self, result):
+        if result < 0:
+            err = get_errno()
+            raise OSError(err, os.strerror(err))
+        return result
+
+    def __set_option(self, level, option, value):
+        self.__check(libc().setsockopt(self._fd, level, option,
+                                       byref(value), sizeof(value)))
+
+    def __error(self, err):
+        self.last_error = OSError(err, os.strerror(err))
+        if self.verbose:
+            print "\n", self.last_error
+
+    def __send_batch(self, batch, length):
+        # Sends the first `length` frames of the batch, backing off while
+        # the interface's transmit queue is full
+        sent = 0
+        delay = TX_RETRY_DELAY
+        give_up = time.time() + self.queue_delay
+        while sent < length:
+            count = libc().sendmmsg(self._fd, byref(batch.msgs, sent *
+                                    sizeof(mmsghdr)), length - sent, 0)
+            if count >= 0:
+                sent += count
+                delay = TX_RETRY_DELAY
+                continue
+
+            err = get_errno()
+            if err == EINTR:
+                continue
+            if err not in (EAGAIN, ENOBUFS):
+                self.__error(err)
+                self.tx_errors += 1
+                break
+            if time.time() > give_up or not self._running.is_set():
+                self.__error(err)
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, TX_MAX_RETRY_DELAY)
+
+        self.outbound_dropped += length - sent
+        return sent
+
+    def __process_outbound_queue(self):
+        batch = _FrameBatch(self.batch_size)
+        while self._running.is_set():
+            try:
+                # Read the Queue - allow the timeout to throttle the thread
+                pending = [self.outbound.get(timeout=self.queue_delay)]
+            except Queue.Empty:
+                continue
+            if pending[0] is None:
+                continue
+
+            # Send everything that is already waiting in one system call
+            try:
+                while len(pending) < self.batch_size:
+                    can_msg = self.outbound.get_nowait()
+                    if can_msg is None:
+                        break
+                    pending.append(can_msg)
+            except Queue.Empty:
+                pass
+
+            for x, can_msg in enumerate(pending):
+                encode_frame(batch.frames[x], can_msg)
+
+            self.__send_batch(batch, len(pending))
+
+            if self.verbose:
+                for can_msg in pending:
+                    print "\n", can_msg
+
+    def __process_inbound_queue(self):
+        batch = _FrameBatch(self.batch_size)
+        while self._running.is_set():
+            for x in range(self.batch_size):
+                batch.msgs[x].msg_hdr.msg_controllen = sizeof(cmsg_timestamp)
+
+            # Blocks for up to rx_timeout waiting for the first frame
+            count = libc().recvmmsg(self._fd, batch.msgs, self.batch_size,
+                                    MSG_WAITFORONE, None)
+            if count < 0:
+                # Timeouts (EAGAIN) throttle the thread
+                err = get_errno()
+                if err not in (EAGAIN, EINTR):
+                    self.__error(err)
+                    self.rx_errors += 1
+                    time.sleep(RX_ERROR_DELAY)
+                continue
+
+            for x in range(count):
+                frame = batch.frames[x]
+                raw_id = frame.can_id
+                if raw_id & (CAN_ERR_FLAG | CAN_RTR_FLAG):
+                    continue  # Not supported
+
+                if raw_id & CAN_EFF_FLAG:
+                    can_id = raw_id & CAN_EFF_MASK
+                    ext = True
+                else:
+                    can_id = raw_id & CAN_SFF_MASK
+                    ext = False
+
+                timestamp = 0
+                cmsg = batch.cmsgs[x]
+                if (batch.msgs[x].msg_hdr.msg_controllen and
+                        cmsg.cmsg_level == SOL_SOCKET and
+                        cmsg.cmsg_type == SO_TIMESTAMP):
+                    timestamp = cmsg.ts.tv_sec + cmsg.ts.tv_usec / 1e6
+
+                payload = frame.data[:frame.can_dlc]
+                new_msg = self.new_message(can_id, payload, ext, timestamp)
+                self.receive_message(new_msg)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""In-process virtual CAN bus
+
+A VirtualBus connects any number of endpoints (normally `SimCAN` drivers)
+living in the same process.  Every frame put on the bus is broadcast to
+the attached nodes whose receive filters accept it.  The same CANMessage
+object is handed to every node, so receivers must treat it as read only.
+A pooled message (see pycan.common.CANMessagePool) is retained once per
+node it is delivered to, every node releases its own reference and the
+sender keeps its own.
+
+The nodes interested in a given (id, extended) pair are resolved once and
+cached, which keeps the per frame cost of a broadcast to a dictionary
+lookup plus one call per receiving node.
+
+Buses can be shared by name (see `get_bus`) which allows drivers built by
+the driver factory to find each other.
+"""
+import threading
+
+_named_buses = {}
+_named_lock = threading.Lock()
+
+
+def get_bus(name):
+    """Returns the process wide VirtualBus with the given name"""
+    with _named_lock:
+        if name not in _named_buses:
+            _named_buses[name] = VirtualBus(name)
+        return _named_buses[name]
+
+
+class BusNode(object):
+    """An endpoint attached to a VirtualBus
+
+    Attributes:
+        deliver: Callable invoked with each CANMessage the node receives
+        filters: List of IDMaskFilters, a frame is accepted if any match
+                 (an empty list accepts everything)
+        loopback: A boolean indicating if the node receives its own frames
+        received: Number of frames delivered to the node
+    """
+    def __init__(self, bus, deliver, filters=None, loopback=False):
+        self.bus = bus
+        self.deliver = deliver
+        self.filters = list(filters or [])
+        self.loopback = loopback
+        self.received = 0
+
+    def accepts(self, message):
+        if not self.filters:
+            return True
+
+        for mask_filter in self.filters:
+            if mask_filter.filter_match(message):
+                return True
+
+        return False
+
+    def send(self, message):
+        """Puts the message on the bus on behalf of this node"""
+        return self.bus.broadcast(message, self)
+
+    def detach(self):
+        self.bus.detach(self)
+
+
+class VirtualBus(object):
+    """Broadcast medium shared by simulated CAN nodes
+
+    Attributes:
+        name: Optional name of the bus
+        frame_count: Number of frames broadcast on the bus
+    """
+    def __init__(self, name=None):
+        """Inits VirtualBus."""
+        self.name = name
+        self.frame_count = 0
+        self._lock = threading.Lock()
+
+        # The node tuple and route cache are replaced (never mutated) so
+        # broadcasts can run without taking the lock
+        self._nodes = ()
+        self._routes = {}
+
+    def attach(self, deliver, filters=None, loopback=False):
+        """Attaches a new endpoint to the bus
+
+        Returns:
+            The BusNode used to send on / detach from the bus
+        """
+        node = BusNode(self, deliver, filters, loopback)
+        with self._lock:
+            self._nodes = self._nodes + (node,)
+            self._routes = {}
+
+        return node
+
+    def detach(self, node):
+        with self._lock:
+            self._nodes = tuple(n for n in self._nodes if n is not node)
+            self._routes = {}
+
+    def nodes(self):
+        return self._nodes
+
+    def broadcast(self, message, sender=None):
+        """Delivers the message to every node accepting it
+
+        Args:
+            message: The CANMessage to broadcast
+            sender: The BusNode sending the message (if any)
+
+        Returns:
+            The number of nodes the message was delivered to
+        """
+        routes = self._routes
+        key = (message.id, message.extended)
+        targets = routes.get(key)
+        if targets is None:
+            targets = tuple(n for n in self._nodes if n.accepts(message))
+            routes[key] = targets
+
+        self.frame_count += 1
+        delivered = 0
+        retain = getattr(message, "retain", None)
+        for node in targets:
+            if node is sender and not node.loopback:
+                continue
+            node.received += 1
+            if retain is not None:
+                retain()
+            node.deliver(message)
+            delivered += 1
+
+        return delivered
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Bulk CAN Trace Analytics
+
+Statistics over whole traces held in columns (one NumPy array per field)
+instead of lists of CANMessages:
+    * per id message counts / rates
+    * period (inter-arrival) statistics and jitter, histograms
+    * bus load over time
+    * payload byte statistics
+
+The frames are grouped by (id, extended) once with a stable sort and
+every statistic is computed with array operations over the grouped
+columns, so traces of millions of frames are handled in seconds.
+
+    trace = ColumnarTrace.from_asc("drive.asc")
+    for key, stats in trace.period_stats().items():
+        print hex(key[0]), stats["mean"], stats["std"]
+
+Requires NumPy.
+"""
+import numpy
+from pycan.common import CANMessage
+from pycan.tools.parsers import asc
+
+PAYLOAD_SIZE = 8
+DEFAULT_BIT_RATE = 250000  # bits / second
+
+
+class ColumnarTrace(object):
+    """A CAN trace stored as columns
+
+    The frames are expected in time order.
+
+    Attributes:
+        time: Time stamps (float64, seconds)
+        id: CAN ids (uint32)
+        extended: 29 bit flags (bool)
+        dlc: Data lengths (uint8)
+        data: Payloads, zero padded to 8 bytes (N x 8 uint8)
+        channel: Driver channel indexes (uint16)
+    """
+    def __init__(self, time, id, extended, dlc, data, channel=None):
+        """Inits ColumnarTrace."""
+        self.time = numpy.asarray(time, numpy.float64)
+        self.id = numpy.asarray(id, numpy.uint32)
+        self.extended = numpy.asarray(extended, numpy.bool_)
+        self.dlc = numpy.asarray(dlc, numpy.uint8)
+        self.data = numpy.asarray(data, numpy.uint8).reshape(-1,
+                                                             PAYLOAD_SIZE)
+        if channel is None:
+            channel = numpy.zeros(len(self.time), numpy.uint16)
+        self.channel = numpy.asarray(channel, numpy.uint16)
+        self._groups = None
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Builds a trace from asc.read_columns style columns"""
+        data = numpy.frombuffer(bytes(columns["data"]), numpy.uint8)
+        return cls(numpy.frombuffer(columns["time"], numpy.float64),
+                   numpy.asarray(columns["id"]),
+                   numpy.asarray(columns["extended"]),
+                   numpy.asarray(columns["dlc"]),
+                   data, numpy.asarray(columns["channel"]))
+
+    @classmethod
+    def from_asc(cls, file_path, exclude_filters=[]):
+        """Loads an ASC file"""
+        return cls.from_columns(asc.read_columns(file_path, exclude_filters))
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Builds a trace from CANMessages"""
+        messages = list(messages)
+        data = numpy.zeros((len(messages), PAYLOAD_SIZE), numpy.uint8)
+        for x, msg in enumerate(messages):
+            data[x, :min(msg.dlc, PAYLOAD_SIZE)] = msg.payload[:PAYLOAD_SIZE]
+        return cls([m.time_stamp for m in messages],
+                   [m.id for m in messages],
+                   [m.extended for m in messages],
+                   [m.dlc for m in messages], data,
+                   [m.channel or 0 for m in messages])
+
+    def __len__(self):
+        return len(self.time)
+
+    def message(self, index):
+        """Returns frame `index` as a CANMessage"""
+        dlc = int(self.dlc[index])
+        return CANMessage(int(self.id[index]),
+                          self.data[index, :dlc].tolist(),
+                          bool(self.extended[index]),
+                          float(self.time[index]),
+                          int(self.channel[index]))
+
+    def messages(self):
+        """Yields the frames as CANMessages"""
+        for x in xrange(len(self)):
+            yield self.message(x)
+
+    def duration(self):
+        if len(self) < 2:
+            return 0.0
+        return float(self.time[-1] - self.time[0])
+
+    def select(self, can_id, extended=True):
+        """Returns the frames of one id as a new trace"""
+        rows = (self.id == can_id) & (self.extended == extended)
+        return ColumnarTrace(self.time[rows], self.id[rows],
+                             self.extended[rows], self.dlc[rows],
+                             self.data[rows], self.channel[rows])
+
+    def frame_bits(self, stuffing=False):
+        """Returns the bits on the wire of every frame (see
+        pycan.common.frame_bits)
+        """
+        dlc = self.dlc.astype(numpy.int64)
+        bits = numpy.where(self.extended, 67, 47) + 8 * dlc
+        if stuffing:
+            stuffable = numpy.where(self.extended, 54, 34) + 8 * dlc
+            bits += (stuffable - 1) // 4
+        return bits
+
+    def keys(self):
+        """Returns the (id, extended) pairs in the trace, sorted"""
+        return self.__group()["keys"]
+
+    def counts(self):
+        """Returns {(id, extended): number of frames}"""
+        groups = self.__group()
+        return dict(zip(groups["keys"], groups["counts"].tolist()))
+
+    def rates(self):
+        """Returns {(id, extended): frames / second} over the whole trace"""
+        duration = self.duration()
+        if duration <= 0:
+            return dict((key, 0.0) for key in self.keys())
+        return dict((key, count / duration)
+                    for key, count in self.counts().items())
+
+    def intervals(self, can_id=None, extended=True):
+        """Returns the inter-arrival times (seconds) of one id, or of every
+        id (grouped by id) when `can_id` is None
+        """
+        groups = self.__group()
+        if can_id is None:
+            return groups["intervals"]
+
+        key = (can_id, extended)
+        if key not in groups["index"]:
+            return numpy.zeros(0)
+        label = groups["index"][key]
+        start, stop = numpy.searchsorted(groups["labels"], [label,
+                                                            label + 1])
+        return groups["intervals"][start:stop]
+
+    def period_stats(self):
+        """Returns {(id, extended): period statistics}
+
+        The statistics are "count" (number of intervals), "mean", "std"
+        (the jitter), "min" and "max", in seconds.  Ids received only once
+        are left out.
+        """
+        groups = self.__group()
+        intervals = groups["intervals"]
+        labels = groups["labels"]
+        if len(intervals) == 0:
+            return {}
+
+        n_keys = len(groups["keys"])
+        count = numpy.bincount(labels, minlength=n_keys)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mean = numpy.bincount(labels, intervals, n_keys) / count
+        deviation = intervals - mean[labels]
+        variance = numpy.bincount(labels, deviation * deviation, n_keys)
+
+        present = numpy.nonzero(count)[0]
+        starts = numpy.searchsorted(labels, present)
+        minimum = numpy.minimum.reduceat(intervals, starts)
+        maximum = numpy.maximum.reduceat(intervals, starts)
+
+        stats = {}
+        for x, label in enumerate(present):
+            n = int(count[label])
+            stats[groups["keys"][label]] = {"count": n,
+                                            "mean": float(mean[label]),
+                                            "std": float((variance[label] /
+                                                          n) ** 0.5),
+                                            "min": float(minimum[x]),
+                                            "max": float(maximum[x])}
+        return stats
+
+    def interarrival_histogram(self, can_id=None, extended=True, bins=50,
+                               range=None):
+        """Returns (counts, bin edges) of the inter-arrival times, see
+        intervals and numpy.histogram
+        """
+        return numpy.histogram(self.intervals(can_id, extended), bins,
+                               range)
+
+    def bus_load(self, bit_rate=DEFAULT_BIT_RATE, window=1.0,
+                 stuffing=False):
+        """Returns (window start times, bus load) of consecutive windows
+
+        The bus load is the fraction (0.0 - 1.0) of the bit rate used by the
+        frames starting in each window of `window` seconds.
+        """
+        if len(self) == 0:
+            return numpy.zeros(0), numpy.zeros(0)
+
+        start = self.time[0]
+        slots = ((self.time - start) // window).astype(numpy.int64)
+        bits = numpy.bincount(slots, self.frame_bits(stuffing))
+        starts = start + numpy.arange(len(bits)) * window
+        return starts, bits / (window * bit_rate)
+
+    def byte_stats(self):
+        """Returns {(id, extended): payload byte statistics}
+
+        The statistics are arrays with one entry per byte position: "min",
+        "max", "mean", "count" (frames holding that byte) and "changes"
+        (number of times the byte differs from the previous frame of the
+        id).  Positions beyond the DLC are not counted (min / max / mean
+        are NaN for positions never present).
+        """
+        groups = self.__group()
+        if len(self) == 0:
+            return {}
+
+        order = groups["order"]
+        data = self.data[order]
+        present = (numpy.arange(PAYLOAD_SIZE)[numpy.newaxis, :] <
+                   self.dlc[order][:, numpy.newaxis])
+        starts = groups["starts"]
+
+        count = numpy.add.reduceat(present, starts).astype(numpy.int64)
+        total = numpy.add.reduceat(numpy.where(present, data, 0), starts,
+                                   dtype=numpy.float64)
+        minimum = numpy.minimum.reduceat(numpy.where(present, data, 255)
+                                         .astype(numpy.float64), starts)
+        maximum = numpy.maximum.reduceat(numpy.where(present, data, 0)
+                                         .astype(numpy.float64), starts)
+
+        # Changes between consecutive frames of the same id
+        changed = numpy.zeros(data.shape, numpy.int64)
+        changed[1:] = ((data[1:] != data[:-1]) & present[1:] &
+                       present[:-1])
+        changed[starts] = 0
+        changes = numpy.add.reduceat(changed, starts)
+
+        never = count == 0
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+        minimum[never] = numpy.nan
+        maximum[never] = numpy.nan
+        mean[never] = numpy.nan
+
+        stats = {}
+        for label, key in enumerate(groups["keys"]):
+            stats[key] = {"min": minimum[label], "max": maximum[label],
+                          "mean": mean[label], "count": count[label],
+                          "changes": changes[label]}
+        return stats
+
+    def __group(self):
+        # Group the frames by (id, extended) once, keeping time order
+        # within every id
+        if self._groups is not None:
+            return self._groups
+
+        combined = (self.id.astype(numpy.int64) |
+                    (self.extended.astype(numpy.int64) << 32))
+        unique, inverse, counts = numpy.unique(combined, return_inverse=True,
+                                               return_counts=True)
+
+        # Stable grouping: sort on (label, position), quicksort on the
+        # combined value is much faster than a stable sort
+        size = len(combined)
+        order = numpy.argsort(inverse.astype(numpy.int64) * size +
+                              numpy.arange(size))
+        labels = inverse[order]
+
+        same = labels[1:] == labels[:-1]
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        keys = [(int(k) & 0xFFFFFFFF, bool(int(k) >> 32)) for k in unique]
+
+        self._groups = {
+            "keys": keys,
+            "index": dict((key, x) for x, key in enumerate(keys)),
+            "counts": counts,
+            "order": order,
+            "starts": starts,
+            "intervals": numpy.diff(self.time[order])[same],
+            "labels": labels[1:][same]}
+        return self._groups
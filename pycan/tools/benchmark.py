@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""pycan Benchmark Suite
+
+Offline benchmarks for the drivers, parsers and dispatch layers.  No CAN
+hardware is needed: the drivers are exercised through SimCAN / VirtualBus
+and through fake serial (CANUSB) and fake canlib (Kvaser) backends.
+
+Results are written as JSON so runs from different releases can be
+compared, e.g.:
+
+    python -m pycan.tools.benchmark -o 0.2.json
+    python -m pycan.tools.benchmark -o dev.json --compare 0.2.json
+"""
+import sys
+import json
+import time
+import Queue
+import platform
+import argparse
+import threading
+import pycan.drivers.sim_can as sim_can
+import pycan.drivers.virtual_bus as virtual_bus
+from pycan.common import CANMessage
+from pycan.drivers.basedriver import BaseDriverAPI
+from pycan.tools.cyclic_comm import CyclicComm
+from pycan.tools.parsers.asc import ASCParser
+
+PERCENTILES = (50, 90, 99, 99.9)
+SERIAL_CHUNK = 4096  # bytes returned per serial read
+REGRESSION_THRESHOLD = 0.10
+FRAME_TIMEOUT = 10  # seconds a benchmark waits for a frame
+
+
+def percentiles(samples, points=PERCENTILES):
+    """Returns {"p50": .., ...} for the given samples (in microseconds)"""
+    ordered = sorted(samples)
+    results = {}
+    for p in points:
+        if ordered:
+            idx = min(len(ordered) - 1, int(len(ordered) * p / 100.0))
+            value = ordered[idx] * 1e6
+        else:
+            value = None
+        results["p%s" % ("%g" % p).replace(".", "_")] = value
+    return results
+
+
+def _rate(count, elapsed):
+    if elapsed <= 0:
+        return None
+    return count / elapsed
+
+
+class RecordingDriver(BaseDriverAPI):
+    """Minimal driver recording sends and serving a preloaded inbound
+    queue
+    """
+    def __init__(self, messages=()):
+        self.inbound = Queue.Queue()
+        for msg in messages:
+            self.inbound.put(msg)
+        self.sent_times = []
+
+    def send(self, message):
+        self.sent_times.append(time.time())
+        return True
+
+    def next_message(self, timeout=None):
+        try:
+            return self.inbound.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+
+class FakeSerial(object):
+    """serial.Serial stand-in replaying CANUSB ASCII traffic"""
+    def __init__(self, rx_data=""):
+        self.rx_data = rx_data
+        self.rx_pos = 0
+        self.tx_bytes = 0
+        self.tx_frames = 0
+
+    def flushInput(self):
+        pass
+
+    def write(self, data):
+        self.tx_bytes += len(data)
+        if data[:1] in ("t", "T"):
+            self.tx_frames += 1
+        return len(data)
+
+    def inWaiting(self):
+        return min(SERIAL_CHUNK, len(self.rx_data) - self.rx_pos)
+
+    def read(self, size=1):
+        if self.rx_pos >= len(self.rx_data):
+            # Emulate the 1 ms read timeout of an idle port
+            time.sleep(0.001)
+            return ""
+        data = self.rx_data[self.rx_pos:self.rx_pos + size]
+        self.rx_pos += len(data)
+        return data
+
+
+class _FakeCanlib(object):
+    """canlib32 stand-in serving preloaded frames to the Kvaser driver"""
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.written = 0
+
+    def __getattr__(self, name):
+        # Every other canlib call succeeds
+        return lambda *args: 0
+
+    def canOpenChannel(self, channel, flags):
+        return channel.value
+
+    def canWriteWait(self, handle, can_id, data, dlc, flags, timeout):
+        self.written += 1
+        return 0
+
+    def canRead(self, handle, p_id, p_msg, p_dlc, p_flags, p_time):
+        if not self.frames:
+            return -2  # canERR_NOMSG
+        msg = self.frames.pop()
+        p_id.contents.value = msg.id
+        for x in range(msg.dlc):
+            p_msg.contents[x] = msg.payload[x]
+        p_dlc.contents.value = msg.dlc
+        p_flags.contents.value = 0x0004 if msg.extended else 0x0002
+        p_time.contents.value = 0
+        return 0
+
+
+class _FakeKernel32(object):
+    def __init__(self, canlib):
+        self.canlib = canlib
+
+    def WaitForMultipleObjects(self, count, handles, wait_all, timeout):
+        if self.canlib.frames:
+            return 0
+        time.sleep(timeout.value / 1000.0)
+        return 0x102  # WAIT_TIMEOUT
+
+
+class FakeWinDLL(object):
+    """windll stand-in for the Kvaser driver"""
+    def __init__(self, frames=()):
+        self.canlib32 = _FakeCanlib(frames)
+        self.kernel32 = _FakeKernel32(self.canlib32)
+
+
+def _next_message(driver):
+    # A lost frame fails the benchmark instead of hanging it
+    msg = driver.next_message(timeout=FRAME_TIMEOUT)
+    if msg is None:
+        raise RuntimeError("No frame within {t} seconds".format(
+                           t=FRAME_TIMEOUT))
+    return msg
+
+
+def _receive_all(driver, count):
+    tic = time.time()
+    for x in range(count):
+        _next_message(driver)
+    return time.time() - tic
+
+
+def bench_sim_throughput(count):
+    """Frames / second through two SimCAN nodes on a VirtualBus"""
+    bus = virtual_bus.VirtualBus()
+    tx = sim_can.SimCAN(bus=bus)
+    rx = sim_can.SimCAN(bus=bus)
+    msg = CANMessage(0x18FF0001, range(8))
+
+    def sender():
+        for x in range(count):
+            tx.send(msg)
+
+    tic = time.time()
+    tx.start_daemon(sender)
+    try:
+        for x in range(count):
+            _next_message(rx)
+        elapsed = time.time() - tic
+    finally:
+        tx.shutdown()
+        rx.shutdown()
+    return {"frames": count, "elapsed": elapsed,
+            "frames_per_sec": _rate(count, elapsed)}
+
+
+def bench_sim_latency(count):
+    """Send to receive latency through SimCAN (one frame in flight)"""
+    bus = virtual_bus.VirtualBus()
+    tx = sim_can.SimCAN(bus=bus)
+    rx = sim_can.SimCAN(bus=bus)
+    msg = CANMessage(0x18FF0001, range(8))
+
+    samples = []
+    try:
+        for x in range(count):
+            tic = time.time()
+            tx.send(msg)
+            _next_message(rx)
+            samples.append(time.time() - tic)
+    finally:
+        tx.shutdown()
+        rx.shutdown()
+    results = {"frames": count, "latency_us": percentiles(samples)}
+    results["frames_per_sec"] = _rate(count, sum(samples))
+    return results
+
+
+def bench_canusb_receive(count):
+    """CANUSB ASCII decoding rate using a fake serial port"""
+    import pycan.drivers.canusb as canusb
+
+    rx_data = "".join("T%08X8%s1234\r" % (x & 0x1FFFFFFF, "0102030405060708")
+                      for x in range(count))
+    driver = canusb.CANUSB(serial_port=FakeSerial(rx_data))
+    elapsed = _receive_all(driver, count)
+    driver.shutdown()
+    return {"frames": count, "elapsed": elapsed,
+            "frames_per_sec": _rate(count, elapsed)}
+
+
+def bench_canusb_send(count):
+    """CANUSB ASCII encoding rate using a fake serial port"""
+    import pycan.drivers.canusb as canusb
+
+    port = FakeSerial()
+    driver = canusb.CANUSB(serial_port=port)
+    msg = CANMessage(0x18FF0001, range(8))
+
+    tic = time.time()
+    for x in range(count):
+        driver.send(msg)
+    while port.tx_frames < count:
+        time.sleep(0.0001)
+    elapsed = time.time() - tic
+
+    driver.shutdown()
+    return {"frames": count, "elapsed": elapsed,
+            "frames_per_sec": _rate(count, elapsed)}
+
+
+def bench_kvaser_receive(count):
+    """Kvaser receive path rate using a fake canlib"""
+    import pycan.drivers.kvaser as kvaser
+
+    frames = [CANMessage(x & 0x1FFFFFFF, range(8)) for x in range(count)]
+    saved = kvaser.__dict__.get("windll")
+    kvaser.windll = FakeWinDLL(frames)
+    try:
+        driver = kvaser.Kvaser()
+        elapsed = _receive_all(driver, count)
+        driver.shutdown()
+    finally:
+        if saved is None:
+            del kvaser.windll
+        else:
+            kvaser.windll = saved
+
+    return {"frames": count, "elapsed": elapsed,
+            "frames_per_sec": _rate(count, elapsed)}
+
+
+def bench_asc_parse(count):
+    """ASCParser lines / second (no replay delays)"""
+    lines = ["date Mon Jan 1 00:00:00 2013\n",
+             "base hex timestamps absolute\n"]
+    for x in range(count):
+        lines.append("   %0.6f 1  %Xx       Rx   d 8 01 02 03 04 05 06 "
+                     "07 08\n" % (x * 0.001, 0x18FF0000 + (x & 0xFF)))
+
+    parser = ASCParser(use_wall=False)
+    tic = time.time()
+    for line in lines:
+        parser.parse_line(line)
+    elapsed = time.time() - tic
+
+    return {"lines": len(lines), "elapsed": elapsed,
+            "lines_per_sec": _rate(len(lines), elapsed)}
+
+
+def bench_cyclic_jitter(count, rate=0.01):
+    """Period error of a CyclicComm message (wall clock)"""
+    driver = RecordingDriver()
+    comm = CyclicComm(driver)
+    comm.add_cyclic_message(CANMessage(1, [1]), rate)
+    while len(driver.sent_times) < count + 1:
+        time.sleep(rate)
+    comm.shutdown()
+
+    times = driver.sent_times[:count + 1]
+    errors = [abs((b - a) - rate) for a, b in zip(times, times[1:])]
+    return {"period": rate, "samples": len(errors),
+            "jitter_us": percentiles(errors),
+            "max_jitter_us": max(errors) * 1e6}
+
+
+def bench_dispatch(count, handlers=(1, 10, 100)):
+    """CyclicComm receive dispatch rate for a number of handlers"""
+    results = {}
+    for n in handlers:
+        done = threading.Event()
+        handled = [0]
+
+        def last_handler(msg):
+            handled[0] += 1
+            if handled[0] == count:
+                done.set()
+
+        driver = RecordingDriver()
+        comm = CyclicComm(driver)
+        for x in range(n - 1):
+            comm.add_receive_handler(lambda msg: None, x + 1)
+        comm.add_receive_handler(last_handler)
+
+        tic = time.time()
+        msg = CANMessage(0, range(8))
+        for x in range(count):
+            driver.inbound.put(msg)
+        # Fail (run reports the error) rather than hang on a lost frame
+        timeout = FRAME_TIMEOUT + count * 1e-3
+        finished = done.wait(timeout)
+        elapsed = time.time() - tic
+        comm.shutdown()
+        if not finished:
+            raise RuntimeError("{h} of {c} frames dispatched within {t:g} "
+                               "seconds".format(h=handled[0], c=count,
+                                                t=timeout))
+
+        results["handlers_%d" % n] = {"frames": count, "elapsed": elapsed,
+                                      "frames_per_sec": _rate(count,
+                                                              elapsed)}
+    return results
+
+
+def bench_memory(count):
+    """Approximate bytes per received frame (CANMessage + payload)"""
+    frames = [CANMessage(x, [x & 0xFF] * 8) for x in range(count)]
+    total = 0
+    for msg in frames:
+        total += sys.getsizeof(msg) + sys.getsizeof(msg.__dict__)
+        total += sys.getsizeof(msg.payload)
+    return {"frames": count, "bytes_per_frame": total / float(count)}
+
+
+BENCHMARKS = [("sim_throughput", bench_sim_throughput, 10000),
+              ("sim_latency", bench_sim_latency, 500),
+              ("canusb_receive", bench_canusb_receive, 20000),
+              ("canusb_send", bench_canusb_send, 20000),
+              ("kvaser_receive", bench_kvaser_receive, 20000),
+              ("asc_parse", bench_asc_parse, 50000),
+              ("cyclic_jitter", bench_cyclic_jitter, 200),
+              ("dispatch", bench_dispatch, 20000),
+              ("memory", bench_memory, 10000)]
+
+
+def run(names=None, scale=1.0):
+    """Runs the selected benchmarks (all by default)
+
+    Returns:
+        A JSON serializable dictionary of the results
+    """
+    results = {"meta": {"python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "time": time.time(),
+                        "scale": scale},
+               "results": {}}
+
+    for name, bench, count in BENCHMARKS:
+        if names and name not in names:
+            continue
+        try:
+            results["results"][name] = bench(max(1, int(count * scale)))
+        except Exception as e:
+            results["results"][name] = {"error": repr(e)}
+
+    return results
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, long, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Lists the rate / latency metrics that regressed by more than the
+    threshold (a fraction) between two result sets
+    """
+    old = _flatten(baseline["results"])
+    new = _flatten(current["results"])
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if not old[key] or new[key] is None:
+            continue
+        change = (new[key] - old[key]) / float(old[key])
+        if key.endswith("_per_sec"):
+            change = -change  # Higher is better
+        elif not ("_us." in key or key.endswith("bytes_per_frame")):
+            continue
+        if change > threshold:
+            regressions.append((key, old[key], new[key], change))
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    arg_parser.add_argument("benchmarks", nargs="*",
+                            help="benchmarks to run (default: all)")
+    arg_parser.add_argument("-o", "--output", help="JSON output file")
+    arg_parser.add_argument("-s", "--scale", type=float, default=1.0,
+                            help="scale the iteration counts")
+    arg_parser.add_argument("-c", "--compare",
+                            help="baseline JSON file to compare against")
+    args = arg_parser.parse_args(argv)
+
+    results = run(args.benchmarks, args.scale)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fid:
+            fid.write(output)
+    else:
+        print output
+
+    if args.compare:
+        with open(args.compare) as fid:
+            baseline = json.load(fid)
+        regressions = compare(baseline, results)
+        for key, old, new, change in regressions:
+            sys.stderr.write("REGRESSION %s: %g -> %g (%+.1f%%)\n" %
+                             (key, old, new, change * 100))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
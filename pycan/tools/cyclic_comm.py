@@ -10,40 +10,129 @@ layer of functionality on top of the generic CAN drivers.
 These additional features include cyclic transmissions as well
 as generic receive handlers.  In general this should be the
 base communication module for CAN device simulators
+
+Cyclic transmissions are handed to the driver's periodic transmit API
+(start_periodic, see pycan.drivers.periodic) when the driver times them
+natively (`native_periodic`, e.g. the SocketCAN broadcast manager) and
+runs on the same clock; otherwise they are sent by the CyclicComm's own
+scheduler thread.
 """
-import time
 import Queue
 import threading
 import collections
+from pycan.clock import SYSTEM_CLOCK
+from pycan.common import release_message
+
+CYCLIC_IDLE_DELAY = 1.0  # seconds
 
 # TODO(A. Lewis) Add Alarm flags.
 # TODO(A. Lewis) Add logger.
 
 
+class ChangeFilter(object):
+    """Decides which received messages are passed on to a handler
+
+    Keeps the last delivered value of every (id, extended) pair.  With
+    `on_change` a message is delivered when its payload (the bytes selected
+    by `mask`) or DLC differs from the last delivered one.  With
+    `min_interval` a message is (also) delivered once `min_interval`
+    seconds have passed since the last delivery of its id, which without
+    `on_change` limits the delivery rate.
+
+    Attributes:
+        on_change: A boolean indicating if changed payloads are delivered
+        mask: A list of byte masks applied to the payload before comparing
+              (bytes beyond the mask are compared whole)
+        min_interval: Seconds after which a message is delivered anyway
+        last_values: The {(id, extended): (masked payload, time)} cache
+    """
+    def __init__(self, on_change=True, mask=None, min_interval=None,
+                 clock=SYSTEM_CLOCK):
+        """Inits ChangeFilter."""
+        self.on_change = on_change
+        self.mask = mask
+        self.min_interval = min_interval
+        self.clock = clock
+        self.last_values = {}
+
+    def masked(self, payload):
+        if self.mask is None:
+            return tuple(payload)
+        mask = self.mask
+        return tuple(b & mask[x] if x < len(mask) else b
+                     for x, b in enumerate(payload))
+
+    def accept(self, msg):
+        """Returns True if the message should be delivered"""
+        key = (msg.id, msg.extended)
+        value = self.masked(msg.payload)
+        now = self.clock.time()
+
+        last = self.last_values.get(key)
+        if last is None:
+            deliver = True
+        elif self.on_change and value != last[0]:
+            deliver = True
+        elif self.min_interval is not None:
+            deliver = now - last[1] >= self.min_interval
+        else:
+            deliver = False
+
+        if deliver:
+            self.last_values[key] = (value, now)
+        return deliver
+
+
 class CyclicMessage(object):
     """Wraps the CAN message model to hold timing information
 
     Attributes:
         msg: The CANMessage to be sent
         rate: A float representing the expected transmission rate (seconds)
+        clock: The clock used to schedule the transmissions
     """
-    def __init__(self, msg, rate):
+    def __init__(self, msg, rate, clock=SYSTEM_CLOCK):
         self.msg = msg
         self.rate = rate
-        self.next_run = time.time() + rate  # Now
+        self.clock = clock
+        self.next_run = clock.time() + rate  # Now
         self.active = True
 
     def determine_next_run(self):
         if self.active:
-            self.next_run = time.time() + self.rate
+            self.next_run = self.clock.time() + self.rate
         else:
             self.next_run = None
 
 
 class CyclicComm(object):
-    def __init__(self, driver):
-        """Inits CyclicComm."""
+    def __init__(self, driver, clock=None, dispatcher=None,
+                 driver_periodic=None):
+        """Inits CyclicComm.
+
+        The clock defaults to the driver's clock (if any) so simulated
+        drivers and the cyclic scheduler share the same notion of time.
+
+        Receive handlers run on the inbound thread unless a dispatcher
+        (e.g. a dispatcher.HandlerPool) is given to run them on.
+
+        The cyclic messages are scheduled by the driver when it times them
+        natively (`driver_periodic` None), whenever it has a start_periodic
+        (True) or never (False).
+        """
         self.driver = driver
+        self.dispatcher = dispatcher
+        if clock is None:
+            clock = getattr(driver, 'clock', SYSTEM_CLOCK)
+        self.clock = clock
+
+        if driver_periodic is None:
+            driver_periodic = getattr(driver, 'native_periodic', False)
+        self.driver_periodic = (
+            driver_periodic and
+            getattr(driver, 'start_periodic', None) is not None and
+            clock is getattr(driver, 'clock', SYSTEM_CLOCK))
+        self._driver_cyclic = set()
 
         self._msg_lock = threading.Lock()
         self._handle_lock = threading.Lock()
@@ -52,7 +141,7 @@ class CyclicComm(object):
         self._running.set()
 
         self._cyclic_messages = {}
-        self._cyclic_fastest_rate = 1.0
+        self._schedule_changed = self.clock.event()
 
         self._cyclic_thread = self.start_daemon(self.__cyclic_monitor)
         self._inbound_thread = self.start_daemon(self.__inbound_monitor)
@@ -63,9 +152,22 @@ class CyclicComm(object):
         t.start()
         return t
 
-    def add_receive_handler(self, handler, can_id=None, ext=True):
+    def add_receive_handler(self, handler, can_id=None, ext=True,
+                            on_change=False, mask=None, min_interval=None):
+        """Registers a receive handler
+
+        By default the handler is called for every matching message.  With
+        `on_change` it is only called when the payload (or the bytes
+        selected by `mask`) changes and `min_interval` (seconds) sets how
+        often an unchanged message is delivered anyway (see ChangeFilter).
+        """
+        delivery = None
+        if on_change or min_interval is not None:
+            delivery = ChangeFilter(on_change, mask, min_interval,
+                                    self.clock)
+
         with self._handle_lock:
-            self._receive_handlers.append((can_id, ext, handler))
+            self._receive_handlers.append((can_id, ext, handler, delivery))
 
         return True
 
@@ -74,13 +176,22 @@ class CyclicComm(object):
             if desc is None:
                 desc = message.id
 
+            if self.driver_periodic:
+                self._cyclic_messages.pop(desc, None)
+                try:
+                    self.driver.start_periodic(message, rate, desc)
+                except (ValueError, IOError, OSError):
+                    return False
+                self._driver_cyclic.add(desc)
+                return True
+
             try:
                 # Update / Add new messages
-                self._cyclic_messages[desc] = CyclicMessage(message, rate)
+                self._cyclic_messages[desc] = CyclicMessage(message, rate,
+                                                            self.clock)
 
-                # Determine the CPU delay based off of fasest rate
-                if rate < self._cyclic_fastest_rate:
-                    self._cyclic_fastest_rate = rate
+                # Wake the scheduler so it can account for the new timing
+                self._schedule_changed.set()
 
                 return True
             except:
@@ -91,6 +202,9 @@ class CyclicComm(object):
             if desc is None:
                 desc = message.id
 
+            if desc in self._driver_cyclic:
+                return self.driver.update_periodic(message, desc)
+
             # Ensure the message exsits
             if desc in self._cyclic_messages:
                 # Update message
@@ -102,6 +216,10 @@ class CyclicComm(object):
 
     def stop_cyclic_message(self, desc):
         with self._msg_lock:
+            if desc in self._driver_cyclic:
+                self._driver_cyclic.discard(desc)
+                return self.driver.stop_periodic(desc)
+
             if desc in self._cyclic_messages:
                 self._cyclic_messages[desc].active = False
                 return True
@@ -114,26 +232,57 @@ class CyclicComm(object):
 
     def shutdown(self):
         self._running.clear()
+        with self._msg_lock:
+            for desc in self._driver_cyclic:
+                self.driver.stop_periodic(desc)
+            self._driver_cyclic.clear()
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown()
 
     # TODO: Add a multi-step timer (sleep > 20ms, then busy loop)
     def __cyclic_monitor(self):
         while self._running.is_set():
-            time.sleep(self._cyclic_fastest_rate/5.0)
+            self._schedule_changed.clear()
+            next_run = None
             for cyclic in self._cyclic_messages.values():
                 if cyclic.active:
-                    if time.time() > cyclic.next_run:
+                    if self.clock.time() >= cyclic.next_run:
                         self.send(cyclic.msg)
                         cyclic.determine_next_run()
 
+                    if next_run is None or cyclic.next_run < next_run:
+                        next_run = cyclic.next_run
+
+            # Sleep until the next message is due (or the schedule changes)
+            if next_run is None:
+                delay = CYCLIC_IDLE_DELAY
+            else:
+                delay = next_run - self.clock.time()
+            self.clock.wait(self._schedule_changed, delay)
+
     def __inbound_monitor(self):
         while self._running.is_set():
             # Check the Queue for a new message, throttled by driver
             new_msg = self.driver.next_message(timeout=1)
+            if new_msg is None:
+                continue
 
             # Inform the ID specific handlers
-            for can_id, ext, handler in self._receive_handlers:
+            handlers = []
+            for can_id, ext, handler, delivery in self._receive_handlers:
 
                 if new_msg.id == can_id or can_id is None:
                     if new_msg.extended == ext:
-                        handler(new_msg)
+                        if delivery is None or delivery.accept(new_msg):
+                            handlers.append(handler)
+
+            if self.dispatcher is not None:
+                if handlers:
+                    self.dispatcher.dispatch(new_msg, handlers)
+            else:
+                for handler in handlers:
+                    handler(new_msg)
 
+            # Messages from a driver's pool go back once handled, handlers
+            # keeping a message must retain() it
+            release_message(new_msg)
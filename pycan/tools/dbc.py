@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""DBC Signal Decoding / Encoding
+
+Loads the message and signal definitions of a DBC file and turns CAN
+payloads into physical signal values (and back).
+
+For every message a decoder function is generated and compiled when the
+database is loaded: all bit positions, masks, sign handling and scaling
+are folded into straight line code, so decoding a frame costs two struct
+unpacks plus a few integer operations per signal.  Intel (little endian)
+and Motorola (big endian) byte orders, signed / IEEE float signals,
+scale / offset and simple multiplexing (one multiplexer switch per
+message) are supported, for payloads of up to 8 bytes.
+
+Batches of frames can be decoded into per-signal columns, vectorized with
+NumPy when it is installed:
+
+    db = load_dbc("vehicle.dbc")
+    columns = db.decode_asc("drive.asc")
+    speed = columns["VehicleSpeed"]["Speed"]
+
+Receive handlers for CyclicComm are built with `receive_handler` and
+messages for cyclic transmission with `encode_message`.
+"""
+import re
+import struct
+from pycan.common import CANMessage
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CAN_EFF_FLAG = 0x80000000
+CAN_EFF_MASK = 0x1FFFFFFF
+MAX_PAYLOAD = 8
+
+_LE = struct.Struct("<Q")
+_BE = struct.Struct(">Q")
+_PAD = "\0" * MAX_PAYLOAD
+
+RE_MESSAGE = re.compile(r"^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)")
+RE_SIGNAL = re.compile(r"^SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])"
+                       r"([+-])\s*\(([^,]+),([^)]+)\)\s*\[([^|]*)\|([^\]]*)\]"
+                       r"\s*\"([^\"]*)\"\s*(.*)$")
+RE_VALTYPE = re.compile(r"^SIG_VALTYPE_\s+(\d+)\s+(\w+)\s*:\s*([0-3])")
+
+
+def _number(text):
+    value = float(text)
+    if value.is_integer() and "." not in text and "e" not in text.lower():
+        return int(value)
+    return value
+
+
+class Signal(object):
+    """One signal of a DBC message
+
+    Attributes:
+        name: The signal name
+        start: The DBC start bit (LSB for Intel, MSB for Motorola)
+        length: Number of bits
+        little_endian: A boolean indicating Intel byte order
+        signed: A boolean indicating a two's complement value
+        scale: Physical value = raw * scale + offset
+        offset: See scale
+        minimum: The physical minimum from the DBC
+        maximum: The physical maximum from the DBC
+        unit: The unit string
+        receivers: The list of receiving nodes
+        float_size: 32 or 64 for IEEE float signals, None for integers
+        is_multiplexer: A boolean indicating the multiplexer switch
+        multiplex: The multiplexer value selecting this signal (or None)
+        shift: Bit position of the LSB in the little / big endian 64 bit
+               integer the payload is unpacked into
+        mask: The raw value mask
+    """
+    def __init__(self, name, start, length, little_endian=True,
+                 signed=False, scale=1, offset=0, minimum=None,
+                 maximum=None, unit="", receivers=None, float_size=None,
+                 is_multiplexer=False, multiplex=None):
+        """Inits Signal."""
+        self.name = name
+        self.start = start
+        self.length = length
+        self.little_endian = little_endian
+        self.signed = signed
+        self.scale = scale
+        self.offset = offset
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+        self.receivers = receivers or []
+        self.float_size = float_size
+        self.is_multiplexer = is_multiplexer
+        self.multiplex = multiplex
+        self.update_layout()
+
+    def update_layout(self):
+        """Computes the shift / mask, call after changing the layout"""
+        if self.little_endian:
+            self.shift = self.start
+            msb = self.start + self.length - 1
+        else:
+            # Motorola start bits count from the MSB of the first byte
+            msb = (MAX_PAYLOAD - 1 - self.start // 8) * 8 + self.start % 8
+            self.shift = msb - self.length + 1
+
+        if self.length < 1 or self.shift < 0 or msb >= MAX_PAYLOAD * 8:
+            raise ValueError("Signal {n} does not fit in {b} bytes".format(
+                             n=self.name, b=MAX_PAYLOAD))
+        self.mask = (1 << self.length) - 1
+
+    def raw_expression(self):
+        """Returns the Python expression decoding the signal's raw value
+        from the `le` / `be` integers
+        """
+        if self.little_endian:
+            word = "le"
+        else:
+            word = "be"
+
+        if self.shift:
+            expr = "(%s >> %d) & %d" % (word, self.shift, self.mask)
+        else:
+            expr = "%s & %d" % (word, self.mask)
+        return expr
+
+    def value_expression(self, raw):
+        """Returns the Python expression converting `raw` to the physical
+        value
+        """
+        if self.float_size == 32:
+            expr = "_F32(_U32(%s))[0]" % raw
+        elif self.float_size == 64:
+            expr = "_F64(_U64(%s))[0]" % raw
+        elif self.signed:
+            sign = 1 << (self.length - 1)
+            expr = "((%s) ^ %d) - %d" % (raw, sign, sign)
+        else:
+            expr = raw
+
+        if self.scale != 1:
+            expr = "(%s) * %r" % (expr, self.scale)
+        if self.offset != 0:
+            expr = "(%s) + %r" % (expr, self.offset)
+        return expr
+
+    def to_raw(self, value):
+        """Converts a physical value to the raw bit pattern"""
+        value = (value - self.offset) / float(self.scale)
+        if self.float_size == 32:
+            return struct.unpack("<I", struct.pack("<f", value))[0]
+        if self.float_size == 64:
+            return struct.unpack("<Q", struct.pack("<d", value))[0]
+        return int(round(value)) & self.mask
+
+    def __str__(self):
+        return "%s %d|%d@%d%s (%r,%r) \"%s\"" % (
+            self.name, self.start, self.length, int(self.little_endian),
+            "-" if self.signed else "+", self.scale, self.offset, self.unit)
+
+
+class Message(object):
+    """One DBC message and its compiled decoder
+
+    Attributes:
+        id: The CAN id
+        extended: A boolean indicating if the id is 29 bit
+        name: The message name
+        dlc: The data length
+        sender: The transmitting node
+        signals: The list of Signals
+        multiplexer: The multiplexer switch Signal (or None)
+        decoder_source: The generated decoder source code
+    """
+    def __init__(self, id, name, dlc=8, extended=False, sender=None,
+                 signals=None):
+        """Inits Message."""
+        self.id = id
+        self.name = name
+        self.dlc = dlc
+        self.extended = extended
+        self.sender = sender
+        self.signals = signals or []
+        self.multiplexer = None
+        self.decoder_source = None
+        self._decode = None
+
+    def compile(self):
+        """Generates and compiles the decoder for the current signals"""
+        muxers = [s for s in self.signals if s.is_multiplexer]
+        if len(muxers) > 1:
+            raise ValueError("Message {n} has several multiplexers".format(
+                             n=self.name))
+        self.multiplexer = muxers[0] if muxers else None
+
+        words = set("le" if s.little_endian else "be" for s in self.signals)
+        lines = ["def decode(payload):",
+                 "    data = str(bytearray(payload[:%d])) + _PAD" %
+                 MAX_PAYLOAD]
+        for word in sorted(words):
+            unpack = "_LE" if word == "le" else "_BE"
+            lines.append("    %s = %s(data[:%d])[0]" % (word, unpack,
+                                                        MAX_PAYLOAD))
+        lines.append("    signals = {}")
+
+        groups = {}
+        for signal in self.signals:
+            if signal.multiplex is not None and self.multiplexer is not None:
+                groups.setdefault(signal.multiplex, []).append(signal)
+                continue
+            if signal.is_multiplexer:
+                lines.append("    mux = %s" % signal.raw_expression())
+                lines.append("    signals[%r] = %s" % (
+                             signal.name, signal.value_expression("mux")))
+            else:
+                lines.append("    signals[%r] = %s" % (
+                             signal.name, signal.value_expression(
+                                 signal.raw_expression())))
+
+        keyword = "if"
+        for value in sorted(groups):
+            lines.append("    %s mux == %d:" % (keyword, value))
+            for signal in groups[value]:
+                lines.append("        signals[%r] = %s" % (
+                             signal.name, signal.value_expression(
+                                 signal.raw_expression())))
+            keyword = "elif"
+        lines.append("    return signals")
+
+        self.decoder_source = "\n".join(lines) + "\n"
+        namespace = {"_LE": _LE.unpack, "_BE": _BE.unpack, "_PAD": _PAD,
+                     "_F32": struct.Struct("<f").unpack,
+                     "_U32": struct.Struct("<I").pack,
+                     "_F64": struct.Struct("<d").unpack,
+                     "_U64": struct.Struct("<Q").pack}
+        code = compile(self.decoder_source,
+                       "<dbc decoder {n}>".format(n=self.name), "exec")
+        exec code in namespace
+        self._decode = namespace["decode"]
+
+    def decode(self, payload):
+        """Returns the {signal name: value} of one payload"""
+        if self._decode is None:
+            self.compile()
+        return self._decode(payload)
+
+    def encode(self, values, strict=False):
+        """Returns the payload list holding the signal values
+
+        Signals missing from `values` are encoded as raw 0.  Multiplexed
+        signals are only encoded when they belong to the multiplexer value
+        given.  With `strict` unknown names raise a KeyError.
+        """
+        if self._decode is None:
+            self.compile()
+
+        if strict:
+            names = set(s.name for s in self.signals)
+            for name in values:
+                if name not in names:
+                    raise KeyError(name)
+
+        mux = None
+        if self.multiplexer is not None:
+            mux = self.multiplexer.to_raw(values.get(self.multiplexer.name,
+                                                     self.multiplexer.offset))
+
+        le = 0
+        be = 0
+        for signal in self.signals:
+            if signal.multiplex is not None and signal.multiplex != mux:
+                continue
+            if signal.name not in values:
+                continue
+            raw = signal.to_raw(values[signal.name]) << signal.shift
+            if signal.little_endian:
+                le |= raw
+            else:
+                be |= raw
+
+        data = bytearray(_LE.pack(le))
+        for x, b in enumerate(bytearray(_BE.pack(be))):
+            data[x] |= b
+        return list(data[:self.dlc])
+
+    def encode_message(self, values, strict=False):
+        """Returns a CANMessage holding the signal values"""
+        return CANMessage(self.id, self.encode(values, strict),
+                          self.extended)
+
+    def decode_columns(self, payloads):
+        """Decodes many payloads at once into {signal name: column}
+
+        Uses NumPy arrays when NumPy is installed (multiplexed signals are
+        NaN in the rows of other multiplexer values), lists otherwise (None
+        for the rows of other multiplexer values).
+        """
+        if numpy is None:
+            columns = dict((s.name, []) for s in self.signals)
+            for payload in payloads:
+                signals = self.decode(payload)
+                for name, column in columns.items():
+                    column.append(signals.get(name))
+            return columns
+
+        return self.__decode_numpy(payloads)
+
+    def __decode_numpy(self, payloads):
+        if isinstance(payloads, numpy.ndarray):
+            data = numpy.zeros((len(payloads), MAX_PAYLOAD), numpy.uint8)
+            width = min(payloads.shape[1], MAX_PAYLOAD)
+            data[:, :width] = payloads[:, :width]
+        else:
+            data = numpy.zeros((len(payloads), MAX_PAYLOAD), numpy.uint8)
+            for x, payload in enumerate(payloads):
+                data[x, :len(payload)] = payload[:MAX_PAYLOAD]
+
+        words = {"le": data.view("<u8").ravel(),
+                 "be": data.view(">u8").ravel().astype(numpy.uint64)}
+
+        def raw(signal):
+            word = words["le" if signal.little_endian else "be"]
+            return ((word >> numpy.uint64(signal.shift)) &
+                    numpy.uint64(signal.mask))
+
+        def value(signal, raw_values):
+            if signal.float_size == 32:
+                values = raw_values.astype("<u4").view("<f4")
+            elif signal.float_size == 64:
+                values = raw_values.view("<f8")
+            elif signal.signed and signal.length == 64:
+                values = raw_values.view(numpy.int64)
+            elif signal.signed:
+                sign = numpy.int64(1 << (signal.length - 1))
+                values = (raw_values.view(numpy.int64) ^ sign) - sign
+            else:
+                values = raw_values
+            if signal.scale != 1 or signal.offset != 0:
+                values = values * signal.scale + signal.offset
+            return values
+
+        mux = None
+        if self.multiplexer is not None:
+            mux = raw(self.multiplexer)
+
+        columns = {}
+        for signal in self.signals:
+            values = value(signal, raw(signal))
+            if signal.multiplex is not None and mux is not None:
+                values = numpy.where(mux == signal.multiplex, values,
+                                     numpy.nan)
+            columns[signal.name] = values
+        return columns
+
+    def __str__(self):
+        return "%s %s (%d bytes, %d signals)" % (hex(self.id), self.name,
+                                                 self.dlc, len(self.signals))
+
+
+class Database(object):
+    """The messages of a DBC file
+
+    Attributes:
+        messages: The list of Messages
+    """
+    def __init__(self, messages=None):
+        """Inits Database."""
+        self.messages = []
+        self._by_key = {}
+        self._by_name = {}
+        for message in messages or []:
+            self.add_message(message)
+
+    def add_message(self, message):
+        message.compile()
+        self.messages.append(message)
+        self._by_key[(message.id, message.extended)] = message
+        self._by_name[message.name] = message
+
+    def get_message(self, key, extended=None):
+        """Returns the Message with the given name or CAN id
+
+        Raises:
+            KeyError: The message is not in the database
+        """
+        if isinstance(key, basestring):
+            return self._by_name[key]
+        if extended is None:
+            if (key, False) in self._by_key:
+                return self._by_key[(key, False)]
+            extended = True
+        return self._by_key[(key, extended)]
+
+    def decode(self, msg):
+        """Returns the {signal name: value} of a CANMessage (None if the
+        message is not in the database)
+        """
+        message = self._by_key.get((msg.id, msg.extended))
+        if message is None:
+            return None
+        return message._decode(msg.payload)
+
+    def encode_message(self, key, values, strict=False):
+        """Returns a CANMessage for the named (or id) message holding the
+        signal values, ready for CyclicComm.add_cyclic_message
+        """
+        return self.get_message(key).encode_message(values, strict)
+
+    def receive_handler(self, callback):
+        """Returns a receive handler (for CyclicComm.add_receive_handler)
+        calling `callback(message, signals)` for the messages in the
+        database
+        """
+        by_key = self._by_key
+
+        def handler(msg):
+            message = by_key.get((msg.id, msg.extended))
+            if message is not None:
+                callback(msg, message._decode(msg.payload))
+
+        return handler
+
+    def decode_batch(self, messages):
+        """Decodes an iterable of CANMessages into columns
+
+        Returns {message name: {"time": time stamps, signal: values}},
+        frames not in the database are skipped.
+        """
+        payloads = {}
+        times = {}
+        for msg in messages:
+            message = self._by_key.get((msg.id, msg.extended))
+            if message is None:
+                continue
+            if message.name not in payloads:
+                payloads[message.name] = []
+                times[message.name] = []
+            payloads[message.name].append(msg.payload)
+            times[message.name].append(msg.time_stamp)
+
+        columns = {}
+        for name, rows in payloads.items():
+            columns[name] = self._by_name[name].decode_columns(rows)
+            if numpy is None:
+                columns[name]["time"] = times[name]
+            else:
+                columns[name]["time"] = numpy.array(times[name])
+        return columns
+
+    def decode_asc(self, file_path, exclude_filters=[]):
+        """Decodes a (possibly compressed) ASC trace file into columns (see
+        decode_batch)
+        """
+        from pycan.tools.parsers.asc import ASCParser
+        from pycan.tools.trace_io import open_trace
+
+        parser = ASCParser(exclude_filters, use_wall=False)
+
+        def read():
+            with open_trace(file_path, prefetch=True) as trace:
+                for line in trace:
+                    msg = parser.parse_line(line)
+                    if msg is not None:
+                        yield msg
+
+        return self.decode_batch(read())
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+
+def parse_dbc(text):
+    """Returns the Database described by DBC file contents"""
+    messages = []
+    value_types = {}
+    message = None
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        match = RE_MESSAGE.match(line)
+        if match:
+            frame_id = int(match.group(1))
+            message = Message(frame_id & CAN_EFF_MASK, match.group(2),
+                              int(match.group(3)),
+                              bool(frame_id & CAN_EFF_FLAG),
+                              match.group(4))
+            messages.append(message)
+            continue
+
+        match = RE_SIGNAL.match(line)
+        if match and message is not None:
+            (name, mux, start, length, order, sign, scale, offset,
+             minimum, maximum, unit, receivers) = match.groups()
+            multiplex = None
+            if mux is not None and mux != "M":
+                multiplex = int(mux[1:])
+            message.signals.append(Signal(
+                name, int(start), int(length), order == "1", sign == "-",
+                _number(scale), _number(offset),
+                _number(minimum) if minimum.strip() else None,
+                _number(maximum) if maximum.strip() else None,
+                unit, [r for r in re.split(r"[,\s]+", receivers) if r],
+                is_multiplexer=(mux == "M"), multiplex=multiplex))
+            continue
+
+        if not line.startswith("SG_"):
+            message = None
+
+        match = RE_VALTYPE.match(line)
+        if match:
+            size = {"1": 32, "2": 64}.get(match.group(3))
+            value_types[(int(match.group(1)), match.group(2))] = size
+
+    # Float signals are declared after the messages
+    for (frame_id, name), size in value_types.items():
+        for message in messages:
+            if message.id == frame_id & CAN_EFF_MASK:
+                for signal in message.signals:
+                    if signal.name == name:
+                        signal.float_size = size
+
+    return Database(messages)
+
+
+def load_dbc(file_path):
+    """Returns the Database defined in a DBC file"""
+    with open(file_path) as dbc:
+        return parse_dbc(dbc.read())
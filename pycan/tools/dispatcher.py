@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Receive handler dispatch on a pool of worker threads
+
+By default CyclicComm runs the receive handlers on its inbound thread, so a
+slow handler holds up reading the driver.  A HandlerPool moves the handler
+calls to worker threads.  Messages are sharded over the workers by CAN id
+so the handlers always see the messages of one id in the order they were
+received.
+
+Each worker has a bounded queue, what happens when it is full is set by
+the overflow policy:
+    * "block": the inbound thread waits (back pressure onto the driver's
+      inbound queue)
+    * "drop_newest": the new message is discarded
+    * "drop_oldest": the oldest queued message is discarded
+
+Execution time metrics are kept for every handler, see `stats`.  Handler
+exceptions are logged (to the "pycan.tools.dispatcher" logger) and counted
+in the handler's `errors`.
+"""
+import time
+import Queue
+import logging
+import threading
+from pycan.common import release_message
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+QUEUE_DELAY = 1  # second
+
+POLICIES = ("block", "drop_newest", "drop_oldest")
+
+
+class HandlerStats(object):
+    """Execution time metrics of one receive handler
+
+    Attributes:
+        handler: The receive handler
+        calls: Number of calls
+        errors: Number of calls which raised an exception
+        total_time: Total execution time (seconds)
+        max_time: Longest execution time (seconds)
+    """
+    def __init__(self, handler):
+        """Inits HandlerStats."""
+        self.handler = handler
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def mean_time(self):
+        if self.calls == 0:
+            return 0.0
+        return self.total_time / self.calls
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+
+
+def _handler_key(handler):
+    # Equal bound methods (obj.method) share their stats
+    try:
+        hash(handler)
+        return handler
+    except TypeError:
+        return id(handler)
+
+
+class _Worker(object):
+    def __init__(self, queue_size):
+        self.queue = Queue.Queue(queue_size)
+        self.dropped = 0
+        self.stats = {}
+        self.thread = None
+
+
+class HandlerPool(object):
+    """Runs receive handlers on worker threads sharded by CAN id
+
+    Attributes:
+        workers: Number of worker threads
+        queue_size: Capacity of each worker's queue
+        policy: Overflow policy ("block", "drop_newest" or "drop_oldest")
+    """
+    def __init__(self, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, policy="block"):
+        """Inits HandlerPool."""
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy {p}".format(p=policy))
+
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+
+        self._running = threading.Event()
+        self._running.set()
+        self._workers = [_Worker(queue_size) for x in range(workers)]
+        for worker in self._workers:
+            worker.thread = threading.Thread(target=self.__run,
+                                             args=(worker,))
+            worker.thread.daemon = True
+            worker.thread.start()
+
+    def dispatch(self, message, handlers):
+        """Queues the handler calls for a message
+
+        Returns False when the message was dropped by the overflow policy
+        """
+        worker = self._workers[message.id % self.workers]
+
+        # The message is used after the caller let go of it
+        retain = getattr(message, "retain", None)
+        if retain is not None:
+            retain()
+
+        item = (message, handlers)
+        if self.policy == "block":
+            while self._running.is_set():
+                try:
+                    worker.queue.put(item, timeout=QUEUE_DELAY)
+                    return True
+                except Queue.Full:
+                    pass
+            release_message(message)
+            return False
+
+        try:
+            worker.queue.put_nowait(item)
+            return True
+        except Queue.Full:
+            pass
+
+        worker.dropped += 1
+        if self.policy == "drop_newest":
+            release_message(message)
+            return False
+
+        # drop_oldest: make room by discarding the head of the queue
+        try:
+            old_msg, old_handlers = worker.queue.get_nowait()
+            worker.queue.task_done()
+            release_message(old_msg)
+        except Queue.Empty:
+            pass
+        try:
+            worker.queue.put_nowait(item)
+        except Queue.Full:
+            release_message(message)
+            return False
+        return True
+
+    def flush(self):
+        """Waits until every queued handler call has completed"""
+        for worker in self._workers:
+            worker.queue.join()
+
+    def dropped(self):
+        """Returns the number of messages dropped by the overflow policy"""
+        return sum(worker.dropped for worker in self._workers)
+
+    def pending(self):
+        """Returns the number of messages waiting for a worker"""
+        return sum(worker.queue.qsize() for worker in self._workers)
+
+    def stats(self):
+        """Returns the HandlerStats of every handler called so far, the
+        most time consuming first
+        """
+        merged = {}
+        for worker in self._workers:
+            for key, stats in worker.stats.items():
+                if key not in merged:
+                    merged[key] = HandlerStats(stats.handler)
+                merged[key].merge(stats)
+        return sorted(merged.values(), key=lambda s: s.total_time,
+                      reverse=True)
+
+    def handler_stats(self, handler):
+        """Returns the HandlerStats of one handler"""
+        merged = HandlerStats(handler)
+        for worker in self._workers:
+            stats = worker.stats.get(_handler_key(handler))
+            if stats is not None:
+                merged.merge(stats)
+        return merged
+
+    def shutdown(self):
+        """Stops the workers, the queued messages are discarded"""
+        self._running.clear()
+        for worker in self._workers:
+            worker.thread.join(QUEUE_DELAY)
+
+        for worker in self._workers:
+            try:
+                while True:
+                    message, handlers = worker.queue.get_nowait()
+                    release_message(message)
+                    worker.queue.task_done()
+            except Queue.Empty:
+                pass
+
+    def __run(self, worker):
+        stats = worker.stats
+        while self._running.is_set():
+            try:
+                message, handlers = worker.queue.get(timeout=QUEUE_DELAY)
+            except Queue.Empty:
+                continue
+
+            for handler in handlers:
+                key = _handler_key(handler)
+                handler_stats = stats.get(key)
+                if handler_stats is None:
+                    handler_stats = HandlerStats(handler)
+                    stats[key] = handler_stats
+
+                tic = time.time()
+                try:
+                    handler(message)
+                except Exception:
+                    handler_stats.errors += 1
+                    log.exception("Receive handler %r failed on %s",
+                                  handler, message)
+                elapsed = time.time() - tic
+
+                handler_stats.calls += 1
+                handler_stats.total_time += elapsed
+                if elapsed > handler_stats.max_time:
+                    handler_stats.max_time = elapsed
+
+            release_message(message)
+            worker.queue.task_done()
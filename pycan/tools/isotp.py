@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""ISO 15765-2 (ISO-TP) Transport Layer
+
+Segmented request / response transfers of up to 4 GB (4095 bytes without
+the escape sequence) over any pycan driver, e.g. for UDS diagnostics:
+
+    transport = IsoTpTransport(driver)
+    ecu = transport.open(0x7E0, 0x7E8, stmin=0, block_size=0)
+    response = ecu.request([0x22, 0xF1, 0x90])
+
+Single, first, consecutive and flow control frames are handled with
+normal (11 or 29 bit id) addressing.  The transport receives through a
+driver receive tap, so flow control frames are answered on the driver's
+receive thread without waiting for a consumer, and consecutive frames are
+copied straight into a buffer allocated once per channel (and only grown
+for larger transfers).  When sending, the receiver's STmin is honored with
+the clock's precise `sleep_until`.
+
+Every channel is an independent session indexed by its receive id, so
+several ECUs can be talked to at the same time.
+"""
+import Queue
+import threading
+from pycan.common import CANMessage
+from pycan.clock import SYSTEM_CLOCK
+
+# Protocol control information (high nibble of the first byte)
+SINGLE_FRAME = 0x0
+FIRST_FRAME = 0x1
+CONSECUTIVE_FRAME = 0x2
+FLOW_CONTROL = 0x3
+
+# Flow status
+CONTINUE_TO_SEND = 0x0
+WAIT = 0x1
+OVERFLOW = 0x2
+
+FRAME_SIZE = 8
+DEFAULT_PADDING = 0xCC
+DEFAULT_TIMEOUT = 1.0  # seconds (N_Bs / N_Cr)
+DEFAULT_BUFFER_SIZE = 4095  # bytes
+MAX_WAIT_FRAMES = 10
+MAX_12BIT_LENGTH = 0xFFF
+MAX_LENGTH = 0xFFFFFFFF
+
+
+def encode_stmin(seconds):
+    """Returns the STmin byte for a minimum separation time"""
+    if seconds <= 0:
+        return 0
+    if seconds < 0.001:
+        return 0xF0 + max(1, int(round(seconds * 10000)))
+    return min(0x7F, int(round(seconds * 1000)))
+
+
+def decode_stmin(value):
+    """Returns the minimum separation time (seconds) of an STmin byte"""
+    if value <= 0x7F:
+        return value / 1000.0
+    if 0xF1 <= value <= 0xF9:
+        return (value - 0xF0) / 10000.0
+    # Reserved values mean the maximum
+    return 0.127
+
+
+class IsoTpChannel(object):
+    """One ISO-TP session (a pair of CAN ids)
+
+    Attributes:
+        tx_id: CAN id of the frames sent
+        rx_id: CAN id of the frames received
+        extended: A boolean indicating if the ids are 29 bit
+        stmin: Separation time (seconds) requested from the sender
+        block_size: Consecutive frames between flow controls (0 for all)
+        max_length: Longest transfer accepted (longer ones get OVERFLOW)
+        timeout: Seconds to wait for a flow control / consecutive frame
+        errors: Number of aborted receptions
+    """
+    def __init__(self, transport, tx_id, rx_id, extended=False, stmin=0,
+                 block_size=0, max_length=MAX_LENGTH,
+                 buffer_size=DEFAULT_BUFFER_SIZE, timeout=DEFAULT_TIMEOUT,
+                 handler=None):
+        """Inits IsoTpChannel."""
+        self.transport = transport
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.extended = extended
+        self.stmin = stmin
+        self.block_size = block_size
+        self.max_length = max_length
+        self.timeout = timeout
+        self.handler = handler
+        self.errors = 0
+
+        self.clock = transport.clock
+        self._received = Queue.Queue()
+        self._send_lock = threading.Lock()
+        self._flow = None
+        self._flow_event = self.clock.event()
+
+        # Reassembly state
+        self._buffer = bytearray(buffer_size)
+        self._length = None
+        self._position = 0
+        self._sequence = 0
+        self._block_count = 0
+        self._last_frame = 0.0
+
+    def send(self, data):
+        """Sends one message, blocking until its last frame is queued
+
+        Raises:
+            ValueError: The data is longer than 4 GB
+            IOError: The receiver did not answer in time or reported an
+                     overflow
+        """
+        data = bytearray(data)
+        length = len(data)
+        if length > MAX_LENGTH:
+            raise ValueError("ISO-TP message too long: {n}".format(n=length))
+
+        with self._send_lock:
+            if length <= FRAME_SIZE - 1:
+                self.__send_frame([SINGLE_FRAME << 4 | length] + list(data))
+                return
+
+            if length <= MAX_12BIT_LENGTH:
+                header = [FIRST_FRAME << 4 | length >> 8, length & 0xFF]
+            else:
+                header = [FIRST_FRAME << 4, 0, length >> 24 & 0xFF,
+                          length >> 16 & 0xFF, length >> 8 & 0xFF,
+                          length & 0xFF]
+            position = FRAME_SIZE - len(header)
+
+            self._flow_event.clear()
+            self._flow = None
+            clock = self.clock
+            self.__send_frame(header + list(data[:position]))
+            last_sent = clock.time()
+
+            sequence = 1
+            while position < length:
+                block_size, separation = self.__wait_flow()
+
+                # STmin is the minimum gap between two frames (measured
+                # from the moment the previous one was handed over, the
+                # first consecutive frame of a block included), late frames
+                # are not caught up on
+                count = 0
+                while position < length and (block_size == 0 or
+                                             count < block_size):
+                    if separation:
+                        clock.sleep_until(last_sent + separation)
+                    chunk = data[position:position + FRAME_SIZE - 1]
+                    self.__send_frame([CONSECUTIVE_FRAME << 4 | sequence] +
+                                      list(chunk))
+                    last_sent = clock.time()
+                    position += len(chunk)
+                    sequence = (sequence + 1) & 0xF
+                    count += 1
+
+    def recv(self, timeout=None):
+        """Returns the next received message (a bytearray) or None when
+        none arrived within `timeout` seconds
+        """
+        try:
+            return self._received.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def request(self, data, timeout=None):
+        """Sends a request and returns the response (or None)"""
+        if timeout is None:
+            timeout = self.timeout
+        self.send(data)
+        return self.recv(timeout)
+
+    def close(self):
+        self.transport.close(self)
+
+    def handle_frame(self, msg):
+        """Processes a frame received on rx_id"""
+        payload = msg.payload
+        if not payload:
+            return
+        pci = payload[0] >> 4
+
+        if pci == CONSECUTIVE_FRAME:
+            self.__consecutive_frame(payload)
+        elif pci == SINGLE_FRAME:
+            length = payload[0] & 0xF
+            if 0 < length < len(payload):
+                self.__complete(bytearray(payload[1:1 + length]))
+        elif pci == FIRST_FRAME:
+            self.__first_frame(payload)
+        elif pci == FLOW_CONTROL and len(payload) >= 3:
+            self._flow = (payload[0] & 0xF, payload[1],
+                          decode_stmin(payload[2]))
+            self._flow_event.set()
+
+    def __first_frame(self, payload):
+        length = (payload[0] & 0xF) << 8 | payload[1]
+        start = 2
+        if length == 0 and len(payload) >= 6:
+            length = (payload[2] << 24 | payload[3] << 16 |
+                      payload[4] << 8 | payload[5])
+            start = 6
+
+        if self._length is not None:
+            # A new first frame aborts the reception in progress
+            self.errors += 1
+
+        if length > self.max_length:
+            self._length = None
+            self.__send_flow(OVERFLOW)
+            return
+
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+        chunk = payload[start:FRAME_SIZE]
+        self._buffer[:len(chunk)] = bytearray(chunk)
+        self._length = length
+        self._position = len(chunk)
+        self._sequence = 1
+        self._block_count = 0
+        self._last_frame = self.clock.time()
+        self.__send_flow(CONTINUE_TO_SEND)
+
+    def __consecutive_frame(self, payload):
+        if self._length is None:
+            return
+
+        now = self.clock.time()
+        if (payload[0] & 0xF != self._sequence or
+                now - self._last_frame > self.timeout):
+            self._length = None
+            self.errors += 1
+            return
+        self._last_frame = now
+
+        count = min(len(payload) - 1, self._length - self._position)
+        position = self._position
+        self._buffer[position:position + count] = bytearray(
+            payload[1:1 + count])
+        self._position = position + count
+        self._sequence = (self._sequence + 1) & 0xF
+
+        if self._position >= self._length:
+            length = self._length
+            self._length = None
+            self.__complete(self._buffer[:length])
+            return
+
+        self._block_count += 1
+        if self.block_size and self._block_count >= self.block_size:
+            self._block_count = 0
+            self.__send_flow(CONTINUE_TO_SEND)
+
+    def __complete(self, data):
+        if self.handler is not None:
+            self.handler(data)
+        else:
+            self._received.put(data)
+
+    def __wait_flow(self):
+        waits = 0
+        while True:
+            if not self.clock.wait(self._flow_event, self.timeout):
+                raise IOError("No flow control from {i:X}".format(
+                              i=self.rx_id))
+            self._flow_event.clear()
+            status, block_size, separation = self._flow
+
+            if status == CONTINUE_TO_SEND:
+                return block_size, separation
+            if status == OVERFLOW:
+                raise IOError("Message too long for {i:X}".format(
+                              i=self.rx_id))
+
+            waits += 1
+            if waits > MAX_WAIT_FRAMES:
+                raise IOError("Too many wait frames from {i:X}".format(
+                              i=self.rx_id))
+
+    def __send_flow(self, status):
+        self.__send_frame([FLOW_CONTROL << 4 | status, self.block_size,
+                           encode_stmin(self.stmin)])
+
+    def __send_frame(self, payload):
+        padding = self.transport.padding
+        if padding is not None and len(payload) < FRAME_SIZE:
+            payload = payload + [padding] * (FRAME_SIZE - len(payload))
+        self.transport.driver.send(CANMessage(self.tx_id, payload,
+                                              self.extended))
+
+
+class IsoTpTransport(object):
+    """Routes received frames to the ISO-TP channels of a driver
+
+    Attributes:
+        driver: The pycan driver used
+        padding: Byte frames are padded to 8 bytes with (None for no
+                 padding)
+        clock: The clock used for STmin and timeouts
+        channels: The open channels keyed by (rx_id, extended)
+    """
+    def __init__(self, driver, padding=DEFAULT_PADDING, clock=None,
+                 use_tap=True):
+        """Inits IsoTpTransport.
+
+        Without `use_tap` the frames have to be passed to handle_message,
+        e.g. by registering it as a CyclicComm receive handler.
+        """
+        self.driver = driver
+        self.padding = padding
+        if clock is None:
+            clock = getattr(driver, 'clock', SYSTEM_CLOCK)
+        self.clock = clock
+        self.channels = {}
+        self.use_tap = use_tap
+        if use_tap:
+            driver.add_receive_tap(self.handle_message)
+
+    def open(self, tx_id, rx_id, extended=False, **kwargs):
+        """Opens a channel (see IsoTpChannel for the options)"""
+        channel = IsoTpChannel(self, tx_id, rx_id, extended, **kwargs)
+        self.channels[(rx_id, extended)] = channel
+        return channel
+
+    def close(self, channel):
+        if self.channels.get((channel.rx_id, channel.extended)) is channel:
+            del self.channels[(channel.rx_id, channel.extended)]
+
+    def handle_message(self, msg):
+        """Passes a received frame to its channel (if any)"""
+        channel = self.channels.get((msg.id, msg.extended))
+        if channel is not None:
+            channel.handle_frame(msg)
+
+    def shutdown(self):
+        if self.use_tap:
+            self.driver.remove_receive_tap(self.handle_message)
+        self.channels = {}
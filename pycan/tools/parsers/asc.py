@@ -6,11 +6,16 @@
 """CANalyzer ASC File / Line Parser
 
 Module used to parse ASC files and conforms to the trace player's
-API requirements.
+API requirements.  Whole traces can also be loaded into columns (see
+`read_columns`) for bulk analysis.
+
+ASC channels are numbered from 1, the parsed frames carry the 0-based
+driver channel index (see CANMessage.channel) instead.
 """
-import time
-import threading
+from array import array
 from pycan.common import CANMessage
+from pycan.clock import SYSTEM_CLOCK
+from pycan.tools.trace_io import open_trace
 
 DIRTY_WORDS = ['Statistic:', 'date', 'base', 'events', 'version']
 ABS = 'absolute'
@@ -18,10 +23,16 @@ DELTA = 'deltas'
 MIN_DELAY = 0
 
 
+def driver_channel(chan):
+    """Converts an ASC channel number to a driver channel index"""
+    return max(int(chan) - 1, 0)
+
+
 class ASCParser(object):
-    def __init__(self, exclude_filters=[], use_wall=True):
+    def __init__(self, exclude_filters=[], use_wall=True, clock=SYSTEM_CLOCK):
         self.exclude_filters = exclude_filters
         self.use_wall = use_wall
+        self.clock = clock
         self.last_ts = None
         self.next_message = None
 
@@ -30,6 +41,20 @@ class ASCParser(object):
         self.settings['base'] = 10
 
     def parse_line(self, line):
+        msg, delay = self.parse_timed(line)
+
+        # Add any required delay
+        self.__apply_delay(delay)
+
+        return msg
+
+    def parse_timed(self, line):
+        """Parses a line without waiting
+
+        Returns:
+            A tuple of the message (or None) and the delay (seconds or None)
+            parse_line would have waited before returning it
+        """
         self.next_message = None
 
         # Compress all of the white space
@@ -44,12 +69,12 @@ class ASCParser(object):
         # Check to see if the line is a valid line
         for word in DIRTY_WORDS:
             if word in split_line:
-                return self.next_message
+                return self.next_message, None
 
 
         # Check that the line has all the common line items
         if len(split_line) < 5:
-            return self.next_message
+            return self.next_message, None
 
         # Determine and remove the common line items
         ts = float(split_line.pop(0))
@@ -77,7 +102,11 @@ class ASCParser(object):
             can_id = int(can_id, self.settings['base'])
 
             # Determine if the message should be excluded from the trace
-            msg = CANMessage(can_id, payload, ext)
+            try:
+                chan = driver_channel(chan)
+            except ValueError:
+                chan = None
+            msg = CANMessage(can_id, payload, ext, ts, chan)
 
             for ef in self.exclude_filters:
                 if ef.filter_match(msg):
@@ -90,10 +119,71 @@ class ASCParser(object):
         # Determine how long to delay (applies to data and remote frames)
         delay = self.__determine_delay(ts)
 
-        # Add any required delay
-        self.__apply_delay(delay)
-
-        return self.next_message
+        return self.next_message, delay
+
+    def parse_columns(self, lines):
+        """Parses the data frames of many lines into columns
+
+        No delays are applied and no CANMessages are built (unless there are
+        exclude filters).  Delta time stamps are converted to absolute.
+
+        Returns:
+            A dictionary of "time" (array of doubles), "id", "extended",
+            "dlc", "channel" (arrays of integers, 0-based driver channel
+            indexes) and "data" (a bytearray
+            holding 8 zero padded bytes per frame)
+        """
+        times = array('d')
+        ids = array('L')
+        exts = array('B')
+        dlcs = array('B')
+        chans = array('H')
+        data = bytearray()
+        pad = bytearray(8)
+        now = 0.0
+
+        for line in lines:
+            split_line = line.split()
+            if len(split_line) < 6 or split_line[4] != 'd':
+                self.__lookup_asc_settings(split_line)
+                continue
+
+            try:
+                ts = float(split_line[0])
+                chan = driver_channel(split_line[1])
+                can_id = split_line[2]
+                dlc = int(split_line[5])
+                base = self.settings['base']
+                payload = [int(b, base) for b in split_line[6:6 + dlc]]
+                if can_id[-1] == 'x':
+                    ext = True
+                    can_id = int(can_id[:-1], base)
+                else:
+                    ext = False
+                    can_id = int(can_id, base)
+            except (ValueError, IndexError):
+                # Chuck malformed lines
+                continue
+
+            if self.settings['timestamps'] == DELTA:
+                now += ts
+                ts = now
+
+            if self.exclude_filters:
+                msg = CANMessage(can_id, payload, ext, ts)
+                if any(ef.filter_match(msg) for ef in self.exclude_filters):
+                    continue
+
+            times.append(ts)
+            ids.append(can_id)
+            exts.append(ext)
+            dlcs.append(len(payload))
+            chans.append(chan)
+            data.extend(payload[:8])
+            data.extend(pad[:8 - min(len(payload), 8)])
+
+        return {"time": times, "id": ids, "extended": exts, "dlc": dlcs,
+                "channel": chans, "data": data}
 
     def __determine_delay(self, ts):
         if self.use_wall:
@@ -115,8 +205,7 @@ class ASCParser(object):
 
     def __apply_delay(self, delay):
         if delay:
-            evt = threading.Event()
-            evt.wait(delay)
+            self.clock.sleep(delay)
 
     def __lookup_asc_settings(self, split_line):
         keyword = 'base'
@@ -134,3 +223,12 @@ class ASCParser(object):
                 self.settings[keyword] = ABS
             else:
                 self.settings[keyword] = DELTA
+
+
+def read_columns(file_path, exclude_filters=[]):
+    """Loads the data frames of an ASC file (possibly compressed, see
+    pycan.tools.trace_io) into columns (see ASCParser.parse_columns)
+    """
+    parser = ASCParser(exclude_filters, use_wall=False)
+    with open_trace(file_path, prefetch=True) as trace:
+        return parser.parse_columns(trace)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Multi-Bus Gateway / Router
+
+Forwards frames between several drivers according to routing rules:
+
+    router = Router({"body": body_driver, "chassis": chassis_driver})
+    router.add_route("body", "chassis", [IDMaskFilter(0x700, 0x100, False)])
+    router.add_route("chassis", "body", rewrite={0x200: 0x210},
+                     transform=lambda payload: payload[:4])
+    router.add_route("chassis", None, [IDMaskFilter(0x7FF, 0x7DF, False)],
+                     drop=True)
+    router.start()
+
+The rules of a source bus are evaluated in order: every matching route
+forwards the frame and a matching drop rule ends the evaluation.  The
+result for an (id, extended) pair, including its rewritten id, is
+compiled into a lookup table the first time the pair is seen, so routing
+a frame costs one dictionary lookup plus one send per destination.
+
+Channels are driver specific, forwarded frames go out on the destination
+driver's default channel unless the route maps them (`channel`).
+
+Frames are forwarded from the source drivers' receive taps, i.e. on their
+receive threads without an extra thread hop.  Drivers without receive
+taps can be served by a thread each (`use_tap=False`).
+"""
+import threading
+from pycan.common import CANMessage, PooledCANMessage, release_message
+from pycan.clock import SYSTEM_CLOCK
+
+MAX_TABLE_SIZE = 65536  # compiled (id, extended) entries per source
+READ_TIMEOUT = 1  # seconds
+STOP_TIMEOUT = 2.0  # seconds
+KEEP_CHANNEL = "keep"  # Route channel keeping the source frame's channel
+
+
+class Route(object):
+    """A routing rule
+
+    Attributes:
+        source: Name of the bus the frames come from
+        destination: Name of the bus the frames go to (None to drop)
+        filters: List of IDMaskFilters, a frame matches if any match (an
+                 empty list matches everything)
+        rewrite: None, a new id, a {old id: new id} dictionary or a
+                 callable taking the id
+        transform: None or a callable taking and returning the payload
+        drop: A boolean indicating if matching frames stop here
+        channel: Channel the frames are sent on: None for the destination
+                 driver's default, a channel, a {source channel:
+                 channel} dictionary or KEEP_CHANNEL
+        name: Name of the route in the statistics
+        frames: Number of frames forwarded (or dropped)
+        errors: Number of frames the destination driver refused
+        total_latency: Sum of the forwarding latencies (seconds)
+        max_latency: Largest forwarding latency (seconds)
+    """
+    def __init__(self, source, destination, filters=None, rewrite=None,
+                 transform=None, drop=False, channel=None, name=None):
+        """Inits Route."""
+        self.source = source
+        self.destination = destination
+        self.filters = list(filters or [])
+        self.rewrite = rewrite
+        self.transform = transform
+        self.drop = drop or destination is None
+        self.channel = channel
+        if name is None:
+            name = "{s}->{d}".format(s=source, d=destination)
+        self.name = name
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def matches(self, can_id, extended):
+        if not self.filters:
+            return True
+        msg = CANMessage(can_id, [], extended)
+        for mask_filter in self.filters:
+            if mask_filter.filter_match(msg):
+                return True
+        return False
+
+    def target_id(self, can_id):
+        """Returns the id frames with `can_id` are forwarded with"""
+        rewrite = self.rewrite
+        if rewrite is None:
+            return can_id
+        if callable(rewrite):
+            return rewrite(can_id)
+        if isinstance(rewrite, dict):
+            return rewrite.get(can_id, can_id)
+        return rewrite
+
+    def target_channel(self, channel):
+        """Returns the channel frames from `channel` are forwarded on"""
+        mapping = self.channel
+        if mapping == KEEP_CHANNEL:
+            return channel
+        if isinstance(mapping, dict):
+            return mapping.get(channel, None)
+        return mapping
+
+    def record(self, latency):
+        self.frames += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def stats(self):
+        mean = 0.0
+        if self.frames:
+            mean = self.total_latency / self.frames
+        return {"frames": self.frames, "errors": self.errors,
+                "mean_latency": mean, "max_latency": self.max_latency}
+
+
+class Router(object):
+    """Routes frames between drivers
+
+    Attributes:
+        drivers: The {name: driver} buses
+        routes: The routing rules in evaluation order
+        received: {name: frames received} per source bus
+        unrouted: Number of frames no route matched
+    """
+    def __init__(self, drivers, routes=(), clock=SYSTEM_CLOCK,
+                 use_tap=True):
+        """Inits Router."""
+        self.drivers = dict(drivers)
+        self.routes = []
+        self.clock = clock
+        self.use_tap = use_tap
+        self.received = dict((name, 0) for name in self.drivers)
+        self.unrouted = 0
+
+        self._tables = dict((name, {}) for name in self.drivers)
+        self._taps = {}
+        self._threads = []
+        self._running = threading.Event()
+
+        for route in routes:
+            self.add(route)
+
+    def add_route(self, source, destination, filters=None, **kwargs):
+        """Adds a rule (see Route for the options) and returns it"""
+        return self.add(Route(source, destination, filters, **kwargs))
+
+    def add(self, route):
+        if route.source not in self.drivers:
+            raise KeyError(route.source)
+        if not route.drop and route.destination not in self.drivers:
+            raise KeyError(route.destination)
+        self.routes.append(route)
+        self.__invalidate()
+        return route
+
+    def remove(self, route):
+        self.routes.remove(route)
+        self.__invalidate()
+
+    def compile(self, source, can_id, extended):
+        """Returns the forwarding actions of a frame (a tuple of (route,
+        send, id, copy) entries, a drop rule appears with send None)
+        """
+        actions = []
+        for route in self.routes:
+            if route.source != source or not route.matches(can_id,
+                                                           extended):
+                continue
+            if route.drop:
+                actions.append((route, None, can_id, False))
+                break
+
+            new_id = route.target_id(can_id)
+            copy = new_id != can_id or route.transform is not None
+            actions.append((route, self.drivers[route.destination].send,
+                            new_id, copy))
+        return tuple(actions)
+
+    def route(self, source, msg):
+        """Forwards one frame received on bus `source`"""
+        start = self.clock.time()
+        self.received[source] += 1
+
+        table = self._tables[source]
+        key = (msg.id, msg.extended)
+        actions = table.get(key)
+        if actions is None:
+            if len(table) >= MAX_TABLE_SIZE:
+                table.clear()
+            actions = self.compile(source, msg.id, msg.extended)
+            table[key] = actions
+
+        if not actions:
+            self.unrouted += 1
+            return
+
+        # Pooled messages go back to their pool, forward copies
+        pooled = isinstance(msg, PooledCANMessage)
+        for route, send, new_id, copy in actions:
+            if send is not None:
+                channel = route.target_channel(msg.channel)
+                if copy or pooled or channel != msg.channel:
+                    payload = msg.payload
+                    if route.transform is not None:
+                        payload = route.transform(list(payload))
+                    else:
+                        payload = list(payload)
+                    out = CANMessage(new_id, payload, msg.extended,
+                                     msg.time_stamp, channel)
+                else:
+                    out = msg
+                if not send(out):
+                    route.errors += 1
+            route.record(self.clock.time() - start)
+
+    def forward(self, source, messages):
+        """Forwards a batch of frames received on bus `source`"""
+        for msg in messages:
+            self.route(source, msg)
+
+    def start(self):
+        """Starts forwarding the frames of every source bus"""
+        self._running.set()
+        sources = set(route.source for route in self.routes)
+        for name in sources:
+            driver = self.drivers[name]
+            if self.use_tap:
+                tap = self.__tap(name)
+                self._taps[name] = tap
+                driver.add_receive_tap(tap)
+            else:
+                t = threading.Thread(target=self.__read, args=(name,))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        self._running.clear()
+        for name, tap in self._taps.items():
+            self.drivers[name].remove_receive_tap(tap)
+        self._taps = {}
+        for t in self._threads:
+            t.join(STOP_TIMEOUT)
+        self._threads = []
+
+    def stats(self):
+        """Returns {route name: route statistics}"""
+        return dict((route.name, route.stats()) for route in self.routes)
+
+    def __tap(self, name):
+        def tap(msg):
+            self.route(name, msg)
+        return tap
+
+    def __read(self, name):
+        driver = self.drivers[name]
+        while self._running.is_set():
+            msg = driver.next_message(timeout=READ_TIMEOUT)
+            if msg is not None:
+                self.route(name, msg)
+                release_message(msg)
+
+    def __invalidate(self):
+        # Tables are replaced so routing threads never see a partial one
+        self._tables = dict((name, {}) for name in self.drivers)
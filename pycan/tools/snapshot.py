@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Latest value store for received CAN frames
+
+A SnapshotStore keeps the most recent frame of every (id, extended) pair
+along with its age and an estimate of its receive rate.  It is fed from
+the driver's receive thread through a receive tap, so any number of
+readers (UI, loggers, alarms) can query the current bus state without
+adding handlers to the receive path.
+
+    store = SnapshotStore(driver)
+    record = store.get(0x18FF0001)
+    if record is not None and store.age(0x18FF0001) < 1.0:
+        print record.payload
+"""
+import threading
+from pycan.clock import SYSTEM_CLOCK
+
+DEFAULT_RATE_WEIGHT = 0.1
+
+
+class FrameRecord(object):
+    """The latest frame of one (id, extended) pair
+
+    Attributes:
+        id: The CAN id
+        extended: A boolean indicating if the id is 29 bit
+        payload: The latest payload
+        dlc: The latest data length
+        channel: The channel the latest frame was received on
+        time_stamp: The driver time stamp of the latest frame
+        received: The clock time the latest frame was received
+        count: Number of frames received
+        interval: Smoothed time between frames (seconds)
+    """
+    def __init__(self, id, extended):
+        """Inits FrameRecord."""
+        self.id = id
+        self.extended = extended
+        self.payload = []
+        self.dlc = 0
+        self.channel = None
+        self.time_stamp = 0
+        self.received = None
+        self.count = 0
+        self.interval = None
+
+    def rate(self):
+        """Returns the estimated receive rate (frames / second)"""
+        if not self.interval:
+            return 0.0
+        return 1.0 / self.interval
+
+    def copy(self):
+        record = FrameRecord(self.id, self.extended)
+        record.__dict__.update(self.__dict__)
+        record.payload = list(self.payload)
+        return record
+
+    def __str__(self):
+        return "%s,%d,%s : %s (%d frames)" % (hex(self.id), self.dlc,
+                                              str(self.extended),
+                                              [hex(x) for x in self.payload],
+                                              self.count)
+
+
+class SnapshotStore(object):
+    """Thread safe store of the latest frame per (id, extended)
+
+    Reads return copies, so they are consistent even while the receive
+    thread keeps updating the store.
+
+    Attributes:
+        clock: The clock used to time the received frames
+        rate_weight: Weight of the newest interval in the smoothed
+                     receive interval (0.0 - 1.0)
+    """
+    def __init__(self, driver=None, clock=None,
+                 rate_weight=DEFAULT_RATE_WEIGHT):
+        """Inits SnapshotStore.
+
+        The store attaches itself to the driver's receive taps (if a driver
+        is given), the clock defaults to the driver's clock.
+        """
+        if clock is None:
+            clock = getattr(driver, 'clock', SYSTEM_CLOCK)
+        self.clock = clock
+        self.rate_weight = rate_weight
+        self.driver = driver
+
+        self._lock = threading.Lock()
+        self._records = {}
+
+        if driver is not None:
+            driver.add_receive_tap(self.update)
+
+    def detach(self):
+        """Stops receiving frames from the driver"""
+        if self.driver is not None:
+            self.driver.remove_receive_tap(self.update)
+            self.driver = None
+
+    def update(self, msg):
+        """Records a received message (called by the driver)"""
+        now = self.clock.time()
+        key = (msg.id, msg.extended)
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                record = self._records[key] = FrameRecord(msg.id,
+                                                          msg.extended)
+            elif record.interval is None:
+                record.interval = now - record.received
+            else:
+                record.interval += self.rate_weight * (now - record.received -
+                                                       record.interval)
+
+            record.payload[:] = msg.payload
+            record.dlc = msg.dlc
+            record.channel = msg.channel
+            record.time_stamp = msg.time_stamp
+            record.received = now
+            record.count += 1
+
+    def get(self, can_id, extended=True):
+        """Returns a copy of the latest frame (None if never received)"""
+        with self._lock:
+            record = self._records.get((can_id, extended))
+            if record is None:
+                return None
+            return record.copy()
+
+    def snapshot(self):
+        """Returns a {(id, extended): FrameRecord} copy of the whole store
+        taken at one instant
+        """
+        with self._lock:
+            return dict((key, record.copy())
+                        for key, record in self._records.items())
+
+    def age(self, can_id, extended=True):
+        """Returns the seconds since the frame was last received (None if
+        never received)
+        """
+        with self._lock:
+            record = self._records.get((can_id, extended))
+            if record is None:
+                return None
+            received = record.received
+        return self.clock.time() - received
+
+    def rate(self, can_id, extended=True):
+        """Returns the estimated receive rate (frames / second)"""
+        with self._lock:
+            record = self._records.get((can_id, extended))
+            if record is None:
+                return 0.0
+            return record.rate()
+
+    def stale(self, max_age):
+        """Returns the (id, extended) keys not received for more than
+        `max_age` seconds
+        """
+        now = self.clock.time()
+        with self._lock:
+            return sorted(key for key, record in self._records.items()
+                          if now - record.received > max_age)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key in self._records
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Live Trace Following
+
+Consumes trace files while another tool is still writing them, like
+`tail -f`.  FileTail returns the complete lines appended since the last
+read: it keeps the byte offset of the last complete line (nothing is ever
+parsed twice), holds back a partial trailing line until its end arrives
+and starts over when the file is truncated or replaced.  On Linux it
+sleeps on inotify events, elsewhere it polls the file size.
+
+TraceFollower runs a FileTail through a line parser (an ASCParser by
+default) and passes the new frames to a driver and / or handler:
+
+    follower = TraceFollower("live.asc", driver=driver)
+    follower.start()
+"""
+import os
+import errno
+import select
+import threading
+from pycan.tools.parsers.asc import ASCParser
+
+POLL_INTERVAL = 0.05  # seconds
+READ_SIZE = 65536  # bytes
+
+# sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+WATCH_EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVE_SELF |
+                IN_DELETE_SELF)
+
+_libc = None
+
+
+def _inotify():
+    """Returns the C library if it provides inotify (else None)"""
+    global _libc
+    if _libc is None:
+        _libc = False
+        try:
+            from ctypes import CDLL
+            from ctypes.util import find_library
+            libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1
+            _libc = libc
+        except (OSError, AttributeError):
+            pass
+    return _libc or None
+
+
+class FileTail(object):
+    """Incrementally reads the lines appended to a file
+
+    Attributes:
+        path: The followed file
+        offset: Byte offset just past the last complete line returned
+        use_inotify: A boolean indicating if inotify events are used
+    """
+    def __init__(self, path, offset=0, poll_interval=POLL_INTERVAL,
+                 use_inotify=True):
+        """Inits FileTail."""
+        self.path = path
+        self.offset = offset
+        self.poll_interval = poll_interval
+        self._file = None
+        self._partial = ""
+        self._inotify_fd = None
+
+        libc = _inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._libc = libc
+                self._inotify_fd = fd
+                self._watch = -1
+        self.use_inotify = self._inotify_fd is not None
+
+    def read_lines(self):
+        """Returns the complete lines appended since the last call"""
+        if self._file is None and not self.__open():
+            return []
+
+        self.__check_replaced()
+
+        data = self._file.read(READ_SIZE)
+        if not data:
+            return []
+        while len(data) % READ_SIZE == 0:
+            more = self._file.read(READ_SIZE)
+            if not more:
+                break
+            data += more
+
+        data = self._partial + data
+        end = data.rfind("\n") + 1
+        self._partial = data[end:]
+        if end == 0:
+            return []
+
+        self.offset += end
+        return data[:end].splitlines(True)
+
+    def wait(self, timeout=None):
+        """Blocks until the file may have changed (or the timeout)"""
+        if timeout is None:
+            timeout = self.poll_interval
+
+        if not self.use_inotify or self._watch < 0:
+            select.select([], [], [], timeout)
+            return
+
+        try:
+            readable = select.select([self._inotify_fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+
+        if readable:
+            # Drain the events, every change is picked up by read_lines
+            try:
+                while os.read(self._inotify_fd, 4096):
+                    pass
+            except OSError:
+                pass
+
+    def lines(self, running=None):
+        """Yields lines as they are appended, until `running` (an Event) is
+        cleared
+        """
+        while running is None or running.is_set():
+            lines = self.read_lines()
+            if not lines:
+                self.wait()
+                continue
+            for line in lines:
+                yield line
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+            self.use_inotify = False
+
+    def __open(self):
+        try:
+            self._file = open(self.path, "rb")
+        except IOError:
+            return False
+
+        size = os.fstat(self._file.fileno()).st_size
+        if self.offset > size:
+            self.offset = 0
+        self._file.seek(self.offset)
+        self._partial = ""
+
+        if self.use_inotify:
+            self._watch = self._libc.inotify_add_watch(self._inotify_fd,
+                                                       self.path,
+                                                       WATCH_EVENTS)
+        return True
+
+    def __check_replaced(self):
+        # Start over when the file was truncated or replaced (rotated)
+        try:
+            current = os.stat(self.path)
+        except OSError:
+            return
+        opened = os.fstat(self._file.fileno())
+
+        if current.st_ino != opened.st_ino:
+            self._file.close()
+            if self.use_inotify and self._watch >= 0:
+                self._libc.inotify_rm_watch(self._inotify_fd, self._watch)
+            self.offset = 0
+            self.__open()
+        elif opened.st_size < self.offset + len(self._partial):
+            self.offset = 0
+            self._partial = ""
+            self._file.seek(0)
+
+
+class TraceFollower(object):
+    """Passes the frames appended to a trace file to a driver / handler
+
+    Attributes:
+        tail: The FileTail reading the file
+        parser: The line parser (ASCParser without delays by default)
+        driver: The driver the frames are sent on (or None)
+        handler: Called with every frame (or None)
+        message_count: Number of frames read
+    """
+    def __init__(self, path, parser=None, driver=None, handler=None,
+                 offset=0, poll_interval=POLL_INTERVAL, use_inotify=True):
+        """Inits TraceFollower."""
+        if parser is None:
+            parser = ASCParser(use_wall=False)
+        self.parser = parser
+        self.driver = driver
+        self.handler = handler
+        self.tail = FileTail(path, offset, poll_interval, use_inotify)
+        self.message_count = 0
+
+        self._running = threading.Event()
+        self._thread = None
+
+    def messages(self):
+        """Yields the frames as they are appended (until stopped)"""
+        self._running.set()
+        for line in self.tail.lines(self._running):
+            msg = self.parser.parse_line(line)
+            if msg is not None:
+                self.message_count += 1
+                yield msg
+
+    def poll(self):
+        """Processes the frames appended since the last call (without
+        blocking) and returns them
+        """
+        messages = []
+        for line in self.tail.read_lines():
+            msg = self.parser.parse_line(line)
+            if msg is not None:
+                self.message_count += 1
+                self.__deliver(msg)
+                messages.append(msg)
+        return messages
+
+    def run(self):
+        for msg in self.messages():
+            self.__deliver(msg)
+
+    def start(self):
+        """Follows the file in a background thread"""
+        self._running.set()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(self.tail.poll_interval * 2 + 1)
+            self._thread = None
+        self.tail.close()
+
+    def __deliver(self, msg):
+        if self.driver is not None:
+            self.driver.send(msg)
+        if self.handler is not None:
+            self.handler(msg)
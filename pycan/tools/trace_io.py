@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+"""Compressed Trace Files
+
+`open_trace` opens plain, gzip, bz2, xz (needs the lzma / backports.lzma
+module) and zstd (needs the zstandard module) trace files by looking at
+their first bytes, and returns an object iterating over the lines while
+decompressing on the fly.
+
+Block compressed traces ("PYCANBLK") are cut into independently zlib
+compressed blocks of whole lines followed by an index, so a reader can
+jump to any line without decompressing what comes before it.  They are
+written with BlockWriter or `compress_trace` and read with BlockReader.
+
+With `prefetch` the lines are read (and decompressed) on a separate thread
+which keeps a bounded number of chunks ahead of the consumer, so playback
+does not wait on decompression.  Whatever the thread fails with is raised
+again by the consumer once the lines read before the failure are consumed.
+"""
+import io
+import sys
+import bz2
+import zlib
+import gzip
+import Queue
+import struct
+import bisect
+import threading
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOCK_MAGIC = "PYCANBLK"
+BLOCK_VERSION = 1
+BLOCK_SIZE = 1024 * 1024  # uncompressed bytes
+BLOCK_HEADER = struct.Struct("<8sI")
+BLOCK_FRAME = struct.Struct("<II")
+BLOCK_INDEX = struct.Struct("<QQQ")
+BLOCK_TRAILER = struct.Struct("<QI8s")
+
+GZIP_MAGIC = "\x1f\x8b"
+BZ2_MAGIC = "BZh"
+XZ_MAGIC = "\xfd7zXZ\x00"
+ZSTD_MAGIC = "\x28\xb5\x2f\xfd"
+
+READ_SIZE = 65536  # bytes
+PREFETCH_LINES = 4096  # lines per chunk
+PREFETCH_CHUNKS = 16
+
+
+def trace_format(file_path):
+    """Returns the compression of a trace file ("plain", "gzip", "bz2",
+    "xz", "zstd" or "block")
+    """
+    with open(file_path, "rb") as fid:
+        magic = fid.read(8)
+
+    if magic.startswith(BLOCK_MAGIC):
+        return "block"
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(BZ2_MAGIC):
+        return "bz2"
+    if magic.startswith(XZ_MAGIC):
+        return "xz"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "plain"
+
+
+def open_trace(file_path, prefetch=False):
+    """Opens a (possibly compressed) trace file for reading lines
+
+    Raises:
+        IOError: The file can not be opened or its compression is not
+                 supported by the installed modules
+    """
+    compression = trace_format(file_path)
+
+    if compression == "plain":
+        trace = open(file_path, "r")
+    elif compression == "gzip":
+        trace = gzip.GzipFile(file_path, "rb")
+    elif compression == "bz2":
+        trace = bz2.BZ2File(file_path, "r")
+    elif compression == "block":
+        trace = BlockReader(file_path)
+    elif compression == "xz" and lzma is not None:
+        trace = lzma.LZMAFile(file_path, "rb")
+    elif compression == "zstd" and zstandard is not None:
+        raw = open(file_path, "rb")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        trace = _LineReader(stream, raw)
+    else:
+        raise IOError("No module to read {c} trace {f}".format(
+                      c=compression, f=file_path))
+
+    if prefetch:
+        return PrefetchReader(trace)
+    return trace
+
+
+class _LineReader(object):
+    """Splits a raw decompression stream into lines"""
+    def __init__(self, stream, raw=None):
+        self.stream = stream
+        self.raw = raw
+
+    def __iter__(self):
+        pending = ""
+        while True:
+            data = self.stream.read(READ_SIZE)
+            if not data:
+                break
+            lines = (pending + data).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + "\n"
+        if pending:
+            yield pending
+
+    def close(self):
+        self.stream.close()
+        if self.raw is not None:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PrefetchReader(object):
+    """Reads the lines of a trace on a separate thread
+
+    Attributes:
+        trace: The wrapped line iterable
+        chunk_lines: Number of lines handed over at once
+        stalls: Number of times the consumer had to wait for lines
+    """
+    def __init__(self, trace, chunk_lines=PREFETCH_LINES,
+                 chunks=PREFETCH_CHUNKS):
+        """Inits PrefetchReader."""
+        self.trace = trace
+        self.chunk_lines = chunk_lines
+        self.stalls = 0
+        self._error = None
+        self._chunks = Queue.Queue(chunks)
+        self._running = threading.Event()
+        self._running.set()
+        self._thread = threading.Thread(target=self.__read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        while True:
+            try:
+                chunk = self._chunks.get_nowait()
+            except Queue.Empty:
+                self.stalls += 1
+                chunk = self._chunks.get()
+
+            if chunk is None:
+                break
+            for line in chunk:
+                yield line
+
+        if self._error is not None:
+            # Raised with the reader thread's traceback
+            error_type, error, traceback = self._error
+            raise error_type, error, traceback
+
+    def close(self):
+        self._running.clear()
+        # Unblock the reader thread
+        try:
+            while True:
+                self._chunks.get_nowait()
+        except Queue.Empty:
+            pass
+        self._thread.join(1)
+        self.trace.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __read(self):
+        chunk = []
+        try:
+            for line in self.trace:
+                chunk.append(line)
+                if len(chunk) >= self.chunk_lines:
+                    if not self.__put(chunk):
+                        return
+                    chunk = []
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            # The lines read so far and the end of the lines always reach
+            # the consumer
+            if chunk:
+                self.__put(chunk)
+            self.__put(None)
+
+    def __put(self, item):
+        while self._running.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+
+class BlockWriter(object):
+    """Writes a block compressed trace
+
+    Attributes:
+        block_size: Uncompressed bytes collected per block
+        level: zlib compression level
+    """
+    def __init__(self, file_path, block_size=BLOCK_SIZE, level=6):
+        """Inits BlockWriter."""
+        self.block_size = block_size
+        self.level = level
+        self._file = open(file_path, "wb")
+        self._file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION))
+        self._index = []
+        self._lines = []
+        self._pending = 0
+        self._offset = 0
+        self._line_number = 0
+
+    def write(self, line):
+        """Adds one line (including its newline)"""
+        self._lines.append(line)
+        self._pending += len(line)
+        if self._pending >= self.block_size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Compresses the collected lines into a block"""
+        if not self._lines:
+            return
+        data = "".join(self._lines)
+        packed = zlib.compress(data, self.level)
+
+        self._index.append((self._file.tell(), self._offset,
+                            self._line_number))
+        self._file.write(BLOCK_FRAME.pack(len(packed), len(data)))
+        self._file.write(packed)
+
+        self._offset += len(data)
+        self._line_number += len(self._lines)
+        self._lines = []
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(BLOCK_INDEX.pack(*entry))
+        self._file.write(BLOCK_TRAILER.pack(index_offset, len(self._index),
+                                            BLOCK_MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BlockReader(object):
+    """Reads a block compressed trace
+
+    Iterating yields the lines from the current position (the start of
+    the file unless `seek_line` was called).
+
+    Attributes:
+        line_count: Number of lines in the trace
+        block_count: Number of blocks
+    """
+    def __init__(self, file_path):
+        """Inits BlockReader."""
+        self._file = open(file_path, "rb")
+        magic, version = BLOCK_HEADER.unpack(
+            self._file.read(BLOCK_HEADER.size))
+        if magic != BLOCK_MAGIC or version != BLOCK_VERSION:
+            raise IOError("Not a block compressed trace: {f}".format(
+                          f=file_path))
+
+        self._file.seek(-BLOCK_TRAILER.size, io.SEEK_END)
+        index_offset, count, magic = BLOCK_TRAILER.unpack(
+            self._file.read(BLOCK_TRAILER.size))
+        if magic != BLOCK_MAGIC:
+            raise IOError("Truncated block compressed trace: {f}".format(
+                          f=file_path))
+
+        self._file.seek(index_offset)
+        self._index = [BLOCK_INDEX.unpack(self._file.read(BLOCK_INDEX.size))
+                       for x in range(count)]
+        self._block_lines = [entry[2] for entry in self._index]
+        self._blocks_end = index_offset
+        self.block_count = count
+
+        # The line count needs the last block's lines
+        self.line_count = 0
+        if count:
+            self.line_count = (self._index[-1][2] +
+                               len(self.read_block(count - 1)))
+        self._start_block = 0
+        self._skip_lines = 0
+
+    def read_block(self, block):
+        """Returns the lines of one block"""
+        self._file.seek(self._index[block][0])
+        packed_size, size = BLOCK_FRAME.unpack(
+            self._file.read(BLOCK_FRAME.size))
+        data = zlib.decompress(self._file.read(packed_size))
+        return data.splitlines(True)
+
+    def seek_line(self, line_number):
+        """Moves to the given line (0 based), only its block is read"""
+        block = bisect.bisect_right(self._block_lines, line_number) - 1
+        self._start_block = max(block, 0)
+        self._skip_lines = line_number - self._index[self._start_block][2]
+
+    def __iter__(self):
+        skip = self._skip_lines
+        for block in range(self._start_block, self.block_count):
+            lines = self.read_block(block)
+            for line in lines[skip:]:
+                yield line
+            skip = 0
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def compress_trace(source, destination, block_size=BLOCK_SIZE):
+    """Converts a (possibly compressed) trace to the block format"""
+    with open_trace(source) as trace:
+        with BlockWriter(destination, block_size) as writer:
+            writer.writelines(trace)
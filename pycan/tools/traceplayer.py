@@ -7,9 +7,27 @@
 
 Module used to play back a given CAN file logged using various
 off the shelf tools or pycan's logging module
+
+Compressed files (gzip, bz2, xz, zstd or block compressed, see
+pycan.tools.trace_io) are decompressed while playing.
+
+Playback is a pipeline: the file is read (and decompressed) ahead on one
+thread, parsed into a bounded buffer of up to `lookahead` frames on a
+second and sent on time by the player thread once the buffer was filled,
+so slow disks or parsing only affect the timing when the buffer runs dry
+(counted as underruns).  This needs parsers providing `parse_timed(line)`
+-> (message, delay), which are timed by the sender.  Parsers with only
+`parse_line` do their own timing (e.g. sleep between frames), so each of
+their frames is sent as soon as it is parsed, without buffering.
 """
-import time
+import Queue
 import threading
+from pycan.clock import SYSTEM_CLOCK
+from pycan.tools.trace_io import open_trace
+
+LOOKAHEAD = 1000  # frames
+QUEUE_DELAY = 0.1  # seconds
+STOP_TIMEOUT = 1.0  # seconds
 
 
 class TracePlayer(object):
@@ -17,10 +35,18 @@ class TracePlayer(object):
     STOPPED = "Stopped"
     PAUSED = "Paused"
 
-    def __init__(self, driver, parser, files=[]):
+    def __init__(self, driver, parser, files=[], clock=None, prefetch=True,
+                 lookahead=LOOKAHEAD):
         self.driver = driver
         self.parser = parser
-        self.next_message = None
+        if clock is None:
+            clock = getattr(driver, 'clock', SYSTEM_CLOCK)
+        self.clock = clock
+        self.prefetch = prefetch
+        self.lookahead = lookahead
+        self.frames_sent = 0
+        self.underruns = 0
+        self.max_late = 0.0
         self.files = files
         self.playing = threading.Event()
         self.paused = threading.Event()
@@ -50,6 +76,9 @@ class TracePlayer(object):
         pass
 
     def play(self):
+        self.frames_sent = 0
+        self.underruns = 0
+        self.max_late = 0.0
         self.playing.set()
         self.paused.clear()
         self.state = self.PLAYING
@@ -68,10 +97,22 @@ class TracePlayer(object):
                 self.paused.set()
                 self.state = self.PAUSED
 
+    def stats(self):
+        """Returns the playback statistics
+
+        "underruns" counts the frames the sender had to wait for because
+        the parsed frame buffer was empty, "max_late" is the largest delay
+        (seconds) of a frame behind its schedule.
+        """
+        return {"frames_sent": self.frames_sent,
+                "underruns": self.underruns,
+                "max_late": self.max_late,
+                "lookahead": self.lookahead}
+
     def __file_player(self):
         while not self.shutdown.is_set():
             # Protect CPU against missing files / stopped state
-            time.sleep(.5)
+            self.clock.sleep(.5)
 
             # Do not even try to load the files if we are stopped
             if not self.playing.is_set():
@@ -84,36 +125,152 @@ class TracePlayer(object):
                     if not self.playing.is_set():
                         break
 
-                    # Load the file using buffered IO to protect against
-                    # large files
-                    try:
-                        with open(f, 'r') as fid:
-                            for line in fid:
-                                # Support real time pausing
-                                while self.paused.is_set():
-                                    time.sleep(.5)
-
-                                # Check to see if we should still be running
-                                if self.playing.is_set():
-                                    # Do something special with the line
-                                    self.__process_line(line)
-                                else:
-                                    # Bail out
-                                    break
-                    except IOError:
-                        # TODO: Useing logging
-                        print "Error running file: {f}".format(f=f)
-
-    def __process_line(self, line):
-        # Note the order of the calls (send then parse) allows the
-        # parser to throttle the messages being sent.  This is needed to
-        # support real time message delays
-
-        # Send the next available message
-        if self.next_message:
+                    self.__play_file(f)
+
+    def __play_file(self, f):
+        # Load the file using buffered IO to protect against large files,
+        # decompressing ahead on another thread
+        try:
+            trace = open_trace(f, self.prefetch)
+        except IOError:
+            # TODO: Useing logging
+            print "Error running file: {f}".format(f=f)
+            return
+
+        try:
+            if getattr(self.parser, 'parse_timed', None) is None:
+                self.__play_lines(f, trace)
+            else:
+                self.__play_frames(f, trace)
+        finally:
+            trace.close()
+
+    def __play_lines(self, f, trace):
+        # parse_line keeps the time, send every frame right away
+        try:
+            for line in trace:
+                # Support real time pausing
+                while self.paused.is_set() and self.playing.is_set():
+                    self.clock.sleep(.5)
+
+                # Check to see if we should still be running
+                if not self.playing.is_set():
+                    return
+
+                msg = self.parser.parse_line(line)
+                if msg is not None:
+                    while(not self.driver.send(msg)):
+                        self.clock.sleep(.001)
+                    self.frames_sent += 1
+        except IOError:
+            # TODO: Useing logging
+            print "Error running file: {f}".format(f=f)
+
+    def __play_frames(self, f, trace):
+        frames = Queue.Queue(self.lookahead)
+        done = threading.Event()
+        primed = threading.Event()
+        parse_thread = threading.Thread(target=self.__parse_file,
+                                        args=(f, trace, frames, done,
+                                              primed))
+        parse_thread.daemon = True
+        parse_thread.start()
+
+        try:
+            # Fill the buffer before the first frame goes out
+            self.clock.idle()
+            while self.playing.is_set() and not primed.wait(QUEUE_DELAY):
+                pass
+            self.__send_frames(frames)
+        finally:
+            # Unblock and wait for the parser
+            done.set()
+            try:
+                while True:
+                    frames.get_nowait()
+            except Queue.Empty:
+                pass
+            parse_thread.join(STOP_TIMEOUT)
+
+    def __parse_file(self, f, trace, frames, done, primed):
+        parse_timed = self.parser.parse_timed
+        delay = 0.0
+        try:
+            for line in trace:
+                if done.is_set():
+                    return
+
+                msg, wait = parse_timed(line)
+
+                # Delays of skipped lines add up to the next frame
+                delay += wait or 0.0
+                if msg is not None:
+                    if not self.__put(frames, (delay, msg), done):
+                        return
+                    delay = 0.0
+                    if frames.full():
+                        primed.set()
+        except IOError:
+            # TODO: Useing logging
+            print "Error running file: {f}".format(f=f)
+        primed.set()
+        self.__put(frames, None, done)
+
+    def __put(self, frames, item, done):
+        while not done.is_set():
+            try:
+                frames.put(item, timeout=QUEUE_DELAY)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def __send_frames(self, frames):
+        clock = self.clock
+        deadline = None
+        while True:
+            try:
+                item = frames.get_nowait()
+            except Queue.Empty:
+                if deadline is not None:
+                    self.underruns += 1
+                item = self.__get(frames)
+
+            if item is None:
+                return
+            delay, msg = item
+
+            # Support real time pausing, the schedule restarts on resume
+            if self.paused.is_set():
+                while self.paused.is_set() and self.playing.is_set():
+                    clock.sleep(.5)
+                deadline = None
+
+            # Check to see if we should still be running
+            if not self.playing.is_set():
+                return
+
+            now = clock.time()
+            if deadline is None:
+                deadline = now
+            else:
+                deadline += delay
+                if now < deadline:
+                    clock.sleep_until(deadline)
+                else:
+                    self.max_late = max(self.max_late, now - deadline)
+
             # Keep trying to send the message (do not throw any away)
-            while(not self.driver.send(self.next_message)):
-                time.sleep(.001)
+            while(not self.driver.send(msg)):
+                clock.sleep(.001)
+            self.frames_sent += 1
 
-        # Parse the line and wait
-        self.next_message = self.parser.parse_line(line)
+    def __get(self, frames):
+        # Blocks for the next frame as long as we are playing
+        self.clock.idle()
+        while self.playing.is_set():
+            try:
+                return frames.get(timeout=QUEUE_DELAY)
+            except Queue.Empty:
+                pass
+        return None
@@ -5,12 +5,225 @@
 # can be found in the LICENSE.txt file for the project.
 """Generic CAN Traffic Generator Built on pycan
 
-These base classes provide the common/base CAN functionality that is shared
-among a
+Load generator that can be layered on top of any pycan driver.  The
+frames to send are drawn from configurable ID / DLC / payload
+distributions and built up front into a pool which is cycled through
+while running, so generation speed is not limited by allocation.
+
+The rate is given either in frames per second or as a target bus load
+(fraction of the bit rate), optionally in bursts of several back to back
+frames.  Frames are paced against an absolute schedule using the clock's
+precise `sleep_until` and the achieved rate / bus load is reported by
+`stats`.
 """
+import random
+import threading
+from pycan.common import CANMessage, frame_bits
+from pycan.clock import SYSTEM_CLOCK
+
+DEFAULT_BIT_RATE = 250000  # bits / second
+DEFAULT_POOL_SIZE = 1024
+DEFAULT_RATE = 100.0  # frames / second
+MAX_LAG = 0.1  # seconds
+STOP_TIMEOUT = 1.0  # seconds
+
+
+def _chooser(spec, rng):
+    """Builds a function returning one value drawn from `spec`
+
+    The spec may be a single value, a list (uniform choice), a dictionary
+    of {value: weight} or a callable taking the random generator.
+    """
+    if callable(spec):
+        return lambda: spec(rng)
+
+    if isinstance(spec, dict):
+        values = list(spec.keys())
+        cumulative = []
+        total = 0.0
+        for v in values:
+            total += spec[v]
+            cumulative.append(total)
+
+        def weighted():
+            pick = rng.random() * total
+            for v, c in zip(values, cumulative):
+                if pick < c:
+                    return v
+            return values[-1]
+
+        return weighted
+
+    if isinstance(spec, (list, tuple)):
+        return lambda: rng.choice(spec)
+
+    return lambda: spec
 
 
 class TrafficGenerator(object):
-    def __init__(self, driver):
-        pass
+    """Generates CAN traffic at a target rate
+
+    Attributes:
+        driver: The pycan driver used to send the frames
+        rate: Target frames per second
+        bit_rate: Bus bit rate used for the bus load computations
+        burst: Number of frames sent back to back per scheduled slot
+        pool: The precomputed frames cycled through while running
+    """
+    def __init__(self, driver, ids=range(0x100), dlc=8, payload="random",
+                 extended=False, rate=None, bus_load=None,
+                 bit_rate=DEFAULT_BIT_RATE, burst=1,
+                 pool_size=DEFAULT_POOL_SIZE, seed=None, clock=None):
+        """Inits TrafficGenerator.
+
+        Args:
+            ids: CAN id spec (value, list, {id: weight} or callable)
+            dlc: DLC spec (same forms as ids)
+            payload: "random", "counter", "zeros", a fixed payload list or
+                     a callable taking (random generator, dlc)
+            extended: A boolean indicating if the ids are 29 bit
+            rate: Target frames per second (default 100)
+            bus_load: Target bus load (0.0 - 1.0), overrides rate
+            burst: Frames sent back to back per scheduled slot
+            pool_size: Number of frames to precompute
+            seed: Random seed making the generated traffic repeatable
+        """
+        self.driver = driver
+        self.bit_rate = bit_rate
+        self.burst = max(1, int(burst))
+        if clock is None:
+            clock = getattr(driver, 'clock', SYSTEM_CLOCK)
+        self.clock = clock
+
+        self.pool = self.__build_pool(ids, dlc, payload, extended,
+                                      pool_size, random.Random(seed))
+        self._pool_bits = [frame_bits(m) for m in self.pool]
+        self.mean_frame_bits = (sum(self._pool_bits) /
+                                float(len(self._pool_bits)))
+
+        if bus_load is not None:
+            rate = bus_load * bit_rate / self.mean_frame_bits
+        elif rate is None:
+            rate = DEFAULT_RATE
+        self.rate = float(rate)
+
+        self._running = threading.Event()
+        self._thread = None
+        self.__reset_stats()
+
+    def start(self, duration=None):
+        """Starts generating in a background thread"""
+        self._running.set()
+        self._thread = threading.Thread(target=self.run, args=(duration,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(STOP_TIMEOUT)
+            self._thread = None
+
+    def run(self, duration=None):
+        """Generates traffic in the calling thread until stopped or
+        `duration` seconds have elapsed
+        """
+        self._running.set()
+        self.__reset_stats()
+
+        clock = self.clock
+        send = self.driver.send
+        pool = self.pool
+        pool_bits = self._pool_bits
+        pool_len = len(pool)
+        idx = 0
+        slot = self.burst / self.rate
+
+        start = clock.time()
+        self._start = start
+        next_slot = start
+        while self._running.is_set():
+            if duration is not None and next_slot - start >= duration:
+                clock.sleep_until(start + duration)
+                break
+
+            # Wait for the slot, never try to catch up more than MAX_LAG
+            lag = clock.time() - next_slot
+            if lag > MAX_LAG:
+                self.late_slots += 1
+                self.max_lag = max(self.max_lag, lag)
+                next_slot = clock.time()
+            elif lag > 0:
+                self.max_lag = max(self.max_lag, lag)
+            else:
+                clock.sleep_until(next_slot)
+
+            for x in range(self.burst):
+                send(pool[idx])
+                self.frames_sent += 1
+                self.bits_sent += pool_bits[idx]
+                idx += 1
+                if idx == pool_len:
+                    idx = 0
+
+            next_slot += slot
+
+        self._stop = clock.time()
+        self._running.clear()
+        return self.stats()
+
+    def stats(self):
+        """Returns the target and achieved rate / bus load"""
+        if self._start is None:
+            elapsed = 0.0
+        elif self._stop is None:
+            elapsed = self.clock.time() - self._start
+        else:
+            elapsed = self._stop - self._start
+
+        achieved_rate = 0.0
+        achieved_load = 0.0
+        if elapsed > 0:
+            achieved_rate = self.frames_sent / elapsed
+            achieved_load = self.bits_sent / elapsed / self.bit_rate
+
+        return {"target_rate": self.rate,
+                "achieved_rate": achieved_rate,
+                "target_bus_load": (self.rate * self.mean_frame_bits /
+                                    self.bit_rate),
+                "achieved_bus_load": achieved_load,
+                "frames_sent": self.frames_sent,
+                "elapsed": elapsed,
+                "late_slots": self.late_slots,
+                "max_lag": self.max_lag}
+
+    def __reset_stats(self):
+        self.frames_sent = 0
+        self.bits_sent = 0
+        self.late_slots = 0
+        self.max_lag = 0.0
+        self._start = None
+        self._stop = None
+
+    def __build_pool(self, ids, dlc, payload, extended, size, rng):
+        next_id = _chooser(ids, rng)
+        next_dlc = _chooser(dlc, rng)
+
+        pool = []
+        for x in range(size):
+            length = next_dlc()
+            if callable(payload):
+                data = list(payload(rng, length))
+            elif payload == "random":
+                data = [rng.randint(0, 0xFF) for b in range(length)]
+            elif payload == "counter":
+                data = [(x + b) & 0xFF for b in range(length)]
+            elif payload == "zeros":
+                data = [0] * length
+            else:
+                data = list(payload[:length])
+
+            pool.append(CANMessage(next_id(), data, extended))
 
+        return pool
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import tempfile
+import unittest
+import numpy
+import pycan.tools.analytics as analytics
+from pycan.common import CANMessage, IDMaskFilter, frame_bits
+from pycan.tools.parsers import asc
+from pycan.tools.analytics import ColumnarTrace
+
+
+def build_trace(seconds=10):
+    # 0x100 every 10 ms, 0x18FF0001x every 100 ms with +-1 ms jitter
+    messages = []
+    for x in range(seconds * 100):
+        messages.append(CANMessage(0x100, [x & 0xFF, 0, 7], False,
+                                   x * 0.01))
+        if x % 10 == 0:
+            jitter = 0.001 if (x // 10) % 2 else -0.001
+            messages.append(CANMessage(0x18FF0001, range(8), True,
+                                       x * 0.01 + 0.005 + jitter))
+    messages.sort(key=lambda m: m.time_stamp)
+    return messages
+
+
+class AnalyticsTests(unittest.TestCase):
+    def setUp(self):
+        self.messages = build_trace()
+        self.trace = ColumnarTrace.from_messages(self.messages)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the analytics module
+        an_path = os.path.dirname(analytics.__file__)
+        an_file = os.path.abspath(os.path.join(an_path, 'analytics.py'))
+        pep8_checker = pep8.Checker(an_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testCountsAndRates(self):
+        self.assertEqual(len(self.trace), 1100)
+        self.assertEqual(self.trace.keys(), [(0x100, False),
+                                             (0x18FF0001, True)])
+        self.assertEqual(self.trace.counts(), {(0x100, False): 1000,
+                                               (0x18FF0001, True): 100})
+        rates = self.trace.rates()
+        self.assertAlmostEqual(rates[(0x100, False)], 100.0, delta=0.2)
+        self.assertAlmostEqual(rates[(0x18FF0001, True)], 10.0, delta=0.1)
+
+    def testPeriodStats(self):
+        stats = self.trace.period_stats()
+        fast = stats[(0x100, False)]
+        self.assertEqual(fast["count"], 999)
+        self.assertAlmostEqual(fast["mean"], 0.01)
+        self.assertAlmostEqual(fast["std"], 0.0)
+
+        slow = stats[(0x18FF0001, True)]
+        self.assertEqual(slow["count"], 99)
+        self.assertAlmostEqual(slow["min"], 0.098)
+        self.assertAlmostEqual(slow["max"], 0.102)
+        self.assertAlmostEqual(slow["std"], 0.002, places=4)
+
+        # Same answers as a plain loop over one id
+        times = [m.time_stamp for m in self.messages if m.extended]
+        intervals = numpy.diff(times)
+        numpy.testing.assert_allclose(
+            self.trace.intervals(0x18FF0001, True), intervals)
+        self.assertEqual(len(self.trace.intervals()), 999 + 99)
+        self.assertEqual(len(self.trace.intervals(0x555)), 0)
+
+        counts, edges = self.trace.interarrival_histogram(
+            0x18FF0001, True, bins=2, range=(0.09, 0.11))
+        self.assertEqual(counts.tolist(), [49, 50])
+
+    def testBusLoad(self):
+        starts, load = self.trace.bus_load(250000, window=1.0)
+        self.assertEqual(len(starts), 10)
+        bits = (100 * frame_bits(self.messages[0]) +
+                10 * frame_bits(CANMessage(0x18FF0001, range(8))))
+        self.assertAlmostEqual(load[0], bits / 250000.0)
+
+        self.assertTrue((self.trace.frame_bits(True) >
+                         self.trace.frame_bits()).all())
+
+    def testByteStats(self):
+        stats = self.trace.byte_stats()
+        fast = stats[(0x100, False)]
+        self.assertEqual(fast["count"].tolist(), [1000] * 3 + [0] * 5)
+        self.assertEqual(fast["min"][0], 0)
+        self.assertEqual(fast["max"][0], 255)
+        self.assertEqual(fast["mean"][2], 7)
+        self.assertTrue(numpy.isnan(fast["mean"][3]))
+        self.assertEqual(fast["changes"].tolist(), [999] + [0] * 7)
+
+        slow = stats[(0x18FF0001, True)]
+        self.assertEqual(slow["mean"].tolist(), range(8))
+
+    def testSelectAndMessages(self):
+        slow = self.trace.select(0x18FF0001, True)
+        self.assertEqual(len(slow), 100)
+        msg = slow.message(1)
+        self.assertEqual(msg.id, 0x18FF0001)
+        self.assertEqual(msg.payload, range(8))
+        self.assertAlmostEqual(msg.time_stamp, 0.106)
+        self.assertEqual(len(list(slow.messages())), 100)
+
+    def testReadASC(self):
+        fd, path = tempfile.mkstemp(suffix=".asc")
+        with os.fdopen(fd, "w") as trace:
+            trace.write("date Mon Jan 1 00:00:00 2013\n"
+                        "base hex  timestamps absolute\n"
+                        "Begin Triggerblock\n"
+                        "   0.010 1  100             Rx   d 2 0A 0B\n"
+                        "   0.020 2  CF004FEx        Rx   d 8 00 01 02 03 "
+                        "04 05 06 07\n"
+                        "   0.025 1  200             Rx   r\n"
+                        "   0.030 1  7FF             Tx   d 0\n"
+                        "End TriggerBlock\n")
+        try:
+            columns = asc.read_columns(path)
+            trace = ColumnarTrace.from_asc(path)
+            filtered = ColumnarTrace.from_asc(
+                path, [IDMaskFilter(0x7FF, 0x7FF, False)])
+        finally:
+            os.remove(path)
+
+        self.assertEqual(list(columns["id"]), [0x100, 0xCF004FE, 0x7FF])
+        self.assertEqual(len(columns["data"]), 3 * 8)
+        self.assertEqual(trace.time.tolist(), [0.010, 0.020, 0.030])
+        self.assertEqual(trace.extended.tolist(), [False, True, False])
+        self.assertEqual(trace.channel.tolist(), [0, 1, 0])
+        self.assertEqual(trace.dlc.tolist(), [2, 8, 0])
+        self.assertEqual(trace.data[0].tolist(), [10, 11, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(len(filtered), 2)
+
+    def testDeltaTimestamps(self):
+        parser = asc.ASCParser(use_wall=False)
+        columns = parser.parse_columns(["base hex timestamps relative",
+                                        "0.5 1 10 Rx d 1 01",
+                                        "0.25 1 10 Rx d 1 02"])
+        self.assertEqual(list(columns["time"]), [0.5, 0.75])
+
+    def testDriverChannels(self):
+        # ASC channels count from 1, driver channels from 0
+        parser = asc.ASCParser(use_wall=False)
+        msg, delay = parser.parse_timed("0.5 2 10 Rx d 1 01")
+        self.assertEqual(msg.channel, 1)
+        columns = parser.parse_columns(["0.5 1 10 Rx d 1 01",
+                                        "0.75 3 10 Rx d 1 02"])
+        self.assertEqual(list(columns["channel"]), [0, 2])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(AnalyticsTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
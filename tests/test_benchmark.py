@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import json
+import unittest
+import pycan.tools.benchmark as benchmark
+
+
+class BenchmarkTests(unittest.TestCase):
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the benchmark suite
+        tool_path = os.path.dirname(benchmark.__file__)
+        tool_file = os.path.abspath(os.path.join(tool_path, 'benchmark.py'))
+        pep8_checker = pep8.Checker(tool_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testPercentiles(self):
+        samples = [x / 1e6 for x in range(1, 101)]
+        result = benchmark.percentiles(samples)
+        self.assertAlmostEqual(result["p50"], 51.0)
+        self.assertAlmostEqual(result["p99_9"], 100.0)
+
+    def testRunAndCompare(self):
+        results = benchmark.run(["asc_parse", "memory", "dispatch"],
+                                scale=0.01)
+        self.assertEqual(sorted(results["results"].keys()),
+                         ["asc_parse", "dispatch", "memory"])
+        self.assertTrue(results["results"]["asc_parse"]["lines_per_sec"] > 0)
+
+        # The output must be machine readable
+        baseline = json.loads(json.dumps(results))
+        self.assertEqual(benchmark.compare(baseline, results), [])
+
+        # Half the parsing speed is flagged as a regression
+        slower = json.loads(json.dumps(results))
+        slower["results"]["asc_parse"]["lines_per_sec"] /= 2.0
+        regressions = benchmark.compare(baseline, slower)
+        self.assertEqual([r[0] for r in regressions],
+                         ["asc_parse.lines_per_sec"])
+
+    def testLostFrame(self):
+        class LossyComm(benchmark.CyclicComm):
+            # Loses every frame of the last handler
+            def add_receive_handler(self, handler, can_id=None, **kwargs):
+                if can_id is not None:
+                    benchmark.CyclicComm.add_receive_handler(
+                        self, handler, can_id, **kwargs)
+
+        saved = benchmark.CyclicComm, benchmark.FRAME_TIMEOUT
+        benchmark.CyclicComm, benchmark.FRAME_TIMEOUT = LossyComm, 0.1
+        try:
+            results = benchmark.run(["dispatch"], scale=0.0001)
+        finally:
+            benchmark.CyclicComm, benchmark.FRAME_TIMEOUT = saved
+        self.assertTrue("RuntimeError" in results["results"]["dispatch"]
+                        ["error"])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(BenchmarkTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
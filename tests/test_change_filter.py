@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import threading
+import unittest
+import pycan.drivers.sim_can as sim_can
+from pycan.clock import VirtualClock
+from pycan.common import CANMessage
+from pycan.drivers.virtual_bus import VirtualBus
+from pycan.tools.cyclic_comm import ChangeFilter, CyclicComm
+
+
+class ChangeFilterTests(unittest.TestCase):
+    def testOnChange(self):
+        change = ChangeFilter(clock=VirtualClock())
+
+        self.assertTrue(change.accept(CANMessage(0x100, [1, 2])))
+        self.assertFalse(change.accept(CANMessage(0x100, [1, 2])))
+        self.assertTrue(change.accept(CANMessage(0x100, [1, 3])))
+        self.assertTrue(change.accept(CANMessage(0x100, [1, 3, 0])))
+
+        # The ids (and 11 / 29 bit) are tracked separately
+        self.assertTrue(change.accept(CANMessage(0x101, [1, 3, 0])))
+        self.assertTrue(change.accept(CANMessage(0x100, [1, 3, 0], False)))
+        self.assertEqual(len(change.last_values), 3)
+
+    def testMask(self):
+        # Only the low nibble of the first byte matters
+        change = ChangeFilter(mask=[0x0F, 0x00], clock=VirtualClock())
+
+        self.assertTrue(change.accept(CANMessage(1, [0x01, 0x00, 7])))
+        self.assertFalse(change.accept(CANMessage(1, [0xF1, 0x55, 7])))
+        self.assertTrue(change.accept(CANMessage(1, [0xF2, 0x55, 7])))
+        self.assertTrue(change.accept(CANMessage(1, [0xF2, 0x55, 8])))
+
+    def testMinInterval(self):
+        clk = VirtualClock()
+        refresh = ChangeFilter(min_interval=1.0, clock=clk)
+        throttle = ChangeFilter(on_change=False, min_interval=1.0, clock=clk)
+
+        refreshed = []
+        throttled = []
+        for x in range(50):
+            msg = CANMessage(1, [x // 20])
+            if refresh.accept(msg):
+                refreshed.append(x)
+            if throttle.accept(msg):
+                throttled.append(x)
+            clk.advance(0.125)
+
+        # Changes are delivered at once, unchanged payloads every second
+        self.assertEqual(refreshed, [0, 8, 16, 20, 28, 36, 40, 48])
+        self.assertEqual(throttled, [0, 8, 16, 24, 32, 40, 48])
+
+    def testCyclicCommOnChange(self):
+        bus = VirtualBus()
+        sender = sim_can.SimCAN(bus=bus)
+        receiver = sim_can.SimCAN(bus=bus)
+        comm = CyclicComm(receiver)
+
+        every = []
+        changed = []
+        done = threading.Event()
+
+        def last_handler(msg):
+            if msg.payload == [0xFF]:
+                done.set()
+
+        comm.add_receive_handler(every.append, 0x100, False)
+        comm.add_receive_handler(changed.append, 0x100, False,
+                                 on_change=True)
+        comm.add_receive_handler(last_handler, 0x100, False)
+
+        for x in range(30):
+            sender.send(CANMessage(0x100, [x // 10], False))
+        sender.send(CANMessage(0x100, [0xFF], False))
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(len(every), 31)
+        self.assertEqual([m.payload[0] for m in changed], [0, 1, 2, 0xFF])
+
+        comm.shutdown()
+        sender.shutdown()
+        receiver.shutdown()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(ChangeFilterTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
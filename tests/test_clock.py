@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import threading
+import unittest
+import pycan.clock as clock
+import pycan.drivers.sim_can as sim_can
+import pycan.drivers.virtual_bus as virtual_bus
+from pycan.tools.cyclic_comm import CyclicComm
+from pycan.common import CANMessage
+
+
+class ClockTests(unittest.TestCase):
+    def setUp(self):
+        self.driver = None
+        self.comm = None
+
+    def tearDown(self):
+        try:
+            self.comm.shutdown()
+            self.driver.shutdown()
+        except:
+            pass
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the clock module
+        clock_path = os.path.dirname(clock.__file__)
+        clock_file = os.path.abspath(os.path.join(clock_path, 'clock.py'))
+        pep8_checker = pep8.Checker(clock_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testVirtualSleepOrdering(self):
+        clk = clock.VirtualClock()
+        wakes = []
+
+        def sleeper(name, delay):
+            clk.sleep(delay)
+            wakes.append((name, clk.time()))
+
+        threads = [threading.Thread(target=sleeper, args=(n, d))
+                   for n, d in [("b", 2.0), ("a", 1.0), ("c", 3.0)]]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # Allow the threads to park on the clock
+        while len(clk._sleepers) < 3:
+            time.sleep(.001)
+
+        self.assertEqual(clk.next_event(), 1.0)
+        self.assertEqual(clk.run_until(2.5), 2.5)
+        self.assertEqual(wakes, [("a", 1.0), ("b", 2.0)])
+
+        self.assertEqual(clk.step(), 3.0)
+        self.assertEqual(wakes[-1], ("c", 3.0))
+        self.assertEqual(clk.step(), None)
+
+    def testVirtualEventWait(self):
+        clk = clock.VirtualClock()
+        evt = clk.event()
+        result = []
+
+        def waiter():
+            result.append(clk.wait(evt, 10.0))
+
+        t = threading.Thread(target=waiter)
+        t.daemon = True
+        t.start()
+        while clk.next_event() is None:
+            time.sleep(.001)
+
+        evt.set()
+        t.join(1.0)
+        self.assertEqual(result, [True])
+
+        # The cancelled wake up must not hold the clock back
+        self.assertEqual(clk.next_event(), None)
+        self.assertEqual(clk.time(), 0.0)
+
+    def testSimulatedCyclicTraffic(self):
+        clk = clock.VirtualClock()
+        self.driver = sim_can.SimCAN(inbound_time=0.5, clock=clk)
+        self.comm = CyclicComm(self.driver)
+        self.assertTrue(self.comm.clock is clk)
+
+        self.assertTrue(self.comm.add_cyclic_message(CANMessage(1, [1]),
+                                                     0.125))
+
+        # Simulated minutes should only take a fraction of a second each
+        tic = time.time()
+        clk.run_until(60.0)
+        self.assertEqual(self.driver.life_time_sent(), 480)
+        clk.run_until(600.0)
+        elapsed = time.time() - tic
+        self.assertTrue(elapsed < 5.0, msg=str(elapsed))
+
+        self.assertEqual(self.driver.life_time_sent(), 4800)
+
+    def testQueueHandOff(self):
+        clk = clock.VirtualClock()
+        bus = virtual_bus.VirtualBus()
+        self.driver = sim_can.SimCAN(bus=bus, tx_delay=0.25, clock=clk)
+        receiver = sim_can.SimCAN(bus=bus, clock=clk)
+        try:
+            # The transmission delay starts when the frame is sent, even
+            # if the clock is advanced right away
+            for x in range(20):
+                self.driver.send(CANMessage(0x100, [x]))
+                clk.run_until(clk.time() + 0.125)
+                self.assertEqual(receiver.inbound.qsize(), 0)
+                clk.run_until(clk.time() + 0.125)
+                self.assertEqual(receiver.next_message(1).payload, [x])
+        finally:
+            receiver.shutdown()
+
+    def testWallSleepUntil(self):
+        clk = clock.WallClock()
+        deadline = time.time() + 0.1
+        cpu = time.clock()
+        clk.sleep_until(deadline)
+        self.assertTrue(time.time() >= deadline)
+
+        # Only the last SPIN_THRESHOLD seconds are spent spinning
+        self.assertTrue(time.clock() - cpu < 0.05)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(ClockTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
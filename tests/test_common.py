@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import unittest
+import pycan.common as common
+import pycan.drivers.canusb as canusb
+from pycan.common import CANMessage, CANMessagePool, release_message
+from pycan.tools.benchmark import FakeSerial
+
+
+class CommonTests(unittest.TestCase):
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the common module
+        common_path = os.path.dirname(common.__file__)
+        common_file = os.path.abspath(os.path.join(common_path, 'common.py'))
+        pep8_checker = pep8.Checker(common_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testPoolReuse(self):
+        pool = CANMessagePool(2)
+        self.assertEqual(pool.available(), 2)
+
+        msg = pool.acquire(0x123, [1, 2, 3], False, 10, 1)
+        payload = msg.payload
+        self.assertEqual(msg.id, 0x123)
+        self.assertEqual(msg.payload, [1, 2, 3])
+        self.assertEqual(msg.dlc, 3)
+        self.assertFalse(msg.extended)
+        self.assertEqual(msg.time_stamp, 10)
+        self.assertEqual(msg.channel, 1)
+        self.assertEqual(pool.available(), 1)
+
+        msg.release()
+        self.assertEqual(pool.available(), 2)
+
+        # The same objects are handed out again
+        again = pool.acquire(0x18FF0001, range(8))
+        self.assertTrue(again is msg)
+        self.assertTrue(again.payload is payload)
+        self.assertEqual(again.payload, range(8))
+        self.assertEqual(again.dlc, 8)
+        self.assertTrue(again.extended)
+        self.assertEqual(pool.misses, 0)
+
+    def testPoolRefCounting(self):
+        pool = CANMessagePool(1)
+        msg = pool.acquire(0x100, [])
+        msg.retain()
+        msg.release()
+        self.assertEqual(pool.available(), 0)
+        msg.release()
+        self.assertEqual(pool.available(), 1)
+
+    def testPoolDoubleRelease(self):
+        pool = CANMessagePool(2)
+        msg = pool.acquire(0x100, [])
+        msg.release()
+        msg.release()
+        self.assertEqual(pool.available(), 2)
+        self.assertEqual(pool.double_releases, 1)
+
+        # The message is handed out once only
+        first = pool.acquire(1, [1])
+        second = pool.acquire(2, [2])
+        self.assertFalse(first is second)
+
+    def testPoolExhausted(self):
+        pool = CANMessagePool(1)
+        first = pool.acquire(1, [1])
+        second = pool.acquire(2, [2])
+        self.assertFalse(first is second)
+        self.assertEqual(pool.misses, 1)
+
+        # Both join the pool once released
+        release_message(first)
+        release_message(second)
+        self.assertEqual(pool.available(), 2)
+
+        # Plain messages are left alone
+        release_message(CANMessage(1, [1]))
+
+    def testPooledDriver(self):
+        count = 50
+        pool = CANMessagePool(8)
+        rx_data = "".join("t%03X2%02X%02X\r" % (x, x, x + 1)
+                          for x in range(count))
+        driver = canusb.CANUSB(serial_port=FakeSerial(rx_data), pool=pool)
+
+        for x in range(count):
+            msg = driver.next_message(timeout=1)
+            self.assertEqual(msg.id, x)
+            self.assertEqual(msg.payload, [x, x + 1])
+            self.assertFalse(msg.extended)
+            msg.release()
+
+        self.assertTrue(pool.misses < count)
+        self.assertEqual(pool.available(), pool.size + pool.misses)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(CommonTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import tempfile
+import unittest
+import pycan.config as config
+from pycan.config import (Setting, integer, integer_list, boolean, number,
+                          bit_rate)
+
+
+class ConfigTests(unittest.TestCase):
+    def setUp(self):
+        config.clear_cache()
+        fd, self.config_file = tempfile.mkstemp(suffix='.cfg')
+        os.close(fd)
+        self.write("[defaults]\nselection = SIM_CAN\nverbose = 1\n\n"
+                   "[SIM_CAN]\ninbound_time = 0.5\nverbose = 0\n")
+
+    def tearDown(self):
+        os.remove(self.config_file)
+
+    def write(self, text):
+        with open(self.config_file, 'w') as fid:
+            fid.write(text)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the config module
+        config_path = os.path.dirname(config.__file__)
+        config_file = os.path.abspath(os.path.join(config_path, 'config.py'))
+        pep8_checker = pep8.Checker(config_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testConverters(self):
+        self.assertEqual(integer("0x7FF"), 0x7FF)
+        self.assertEqual(integer(" 12 "), 12)
+        self.assertEqual(integer_list("0, 1,0x2"), [0, 1, 2])
+        self.assertEqual(integer_list(3), [3])
+        self.assertEqual(boolean("Yes"), True)
+        self.assertEqual(boolean("off"), False)
+        self.assertRaises(ValueError, boolean, "maybe")
+        self.assertEqual(bit_rate("250kbps"), 250000)
+        self.assertEqual(bit_rate("500K"), 500000)
+        self.assertEqual(bit_rate(" 1 Mbit/s"), 1000000)
+        self.assertEqual(bit_rate("83.3k"), 83300)
+        self.assertRaises(ValueError, bit_rate, "fast")
+
+    def testSettings(self):
+        schema = config.schema({"a": Setting(number, 1.0)},
+                               b=Setting(integer, minimum=0, maximum=10),
+                               c=Setting(choices=("x", "y")),
+                               d=Setting(boolean, required=True))
+        self.assertEqual(config.parse_settings(schema, {"b": "3", "c": "x",
+                                                        "d": "true"}),
+                         {"a": 1.0, "b": 3, "c": "x", "d": True})
+        for values in ({"b": "11", "d": "1"}, {"c": "z", "d": "1"},
+                       {"e": "1", "d": "1"}, {}):
+            self.assertRaises(ValueError, config.parse_settings, schema,
+                              values)
+
+    def testLoadAndCache(self):
+        loaded = config.load_config(self.config_file)
+        self.assertEqual(loaded.selection, "SIM_CAN")
+        # The driver section overrides the defaults
+        self.assertEqual(loaded.values, {"verbose": "0",
+                                         "inbound_time": "0.5"})
+        self.assertTrue(config.load_config(self.config_file) is loaded)
+
+        class Driver(object):
+            config_schema = {"verbose": Setting(boolean),
+                             "inbound_time": Setting(number)}
+
+        self.assertEqual(loaded.settings(Driver),
+                         {"verbose": False, "inbound_time": 0.5})
+        self.assertEqual(loaded.settings(object), loaded.values)
+
+        # Modified files are parsed again
+        time.sleep(0.01)
+        self.write("[defaults]\nselection = Kvaser\n")
+        self.assertEqual(config.load_config(self.config_file).selection,
+                         "Kvaser")
+
+    def testMissingSelection(self):
+        self.write("[defaults]\nverbose = 1\n")
+        self.assertRaises(ValueError, config.load_config, self.config_file)
+        self.assertRaises(IOError, config.load_config,
+                          self.config_file + ".missing")
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(ConfigTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import math
+import tempfile
+import unittest
+import pycan.tools.dbc as dbc
+from pycan.common import CANMessage
+
+TEST_DBC = """VERSION ""
+
+BU_: ECU Gateway Dash
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (0.01,0) [0|655.35] "km/h" Dash
+ SG_ Temp : 16|8@1+ (1,-40) [-40|215] "C" Dash
+ SG_ Rpm : 31|16@0+ (0.25,0) [0|16383.75] "rpm" Dash,Gateway
+ SG_ Torque : 55|12@0- (0.5,0) [-1024|1023.5] "Nm" Dash
+
+BO_ 2364540158 Status: 8 Gateway
+ SG_ Page M : 0|8@1+ (1,0) [0|255] "" Dash
+ SG_ Counter m0 : 8|16@1+ (1,0) [0|65535] "" Dash
+ SG_ Offset m1 : 8|32@1- (1,0) [0|0] "" Dash
+ SG_ Level m2 : 8|32@1- (1,0) [0|0] "" Dash
+
+SIG_VALTYPE_ 2364540158 Level : 1;
+"""
+
+ENGINE_PAYLOAD = [0x39, 0x30, 0x1E, 0x0F, 0xA0, 0x00, 0xFD, 0x80]
+
+
+class DBCTests(unittest.TestCase):
+    def setUp(self):
+        self.db = dbc.parse_dbc(TEST_DBC)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the DBC module
+        dbc_path = os.path.dirname(dbc.__file__)
+        dbc_file = os.path.abspath(os.path.join(dbc_path, 'dbc.py'))
+        pep8_checker = pep8.Checker(dbc_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testParse(self):
+        self.assertEqual(len(self.db), 2)
+        engine = self.db.get_message("Engine")
+        self.assertEqual(engine.id, 0x100)
+        self.assertFalse(engine.extended)
+        self.assertEqual(engine.sender, "ECU")
+        self.assertEqual([s.name for s in engine.signals],
+                         ["Speed", "Temp", "Rpm", "Torque"])
+        rpm = engine.signals[2]
+        self.assertFalse(rpm.little_endian)
+        self.assertEqual(rpm.receivers, ["Dash", "Gateway"])
+        self.assertEqual(rpm.scale, 0.25)
+
+        status = self.db.get_message(0x0CF004FE)
+        self.assertTrue(status is self.db.get_message("Status"))
+        self.assertTrue(status.extended)
+        self.assertEqual(status.multiplexer.name, "Page")
+        self.assertEqual(status.signals[3].float_size, 32)
+        self.assertRaises(KeyError, self.db.get_message, 0x200)
+
+    def testDecode(self):
+        signals = self.db.decode(CANMessage(0x100, ENGINE_PAYLOAD, False))
+        self.assertAlmostEqual(signals["Speed"], 123.45)
+        self.assertEqual(signals["Temp"], -10)
+        self.assertEqual(signals["Rpm"], 1000)
+        self.assertEqual(signals["Torque"], -20)
+
+        # Short payloads read as zero padded
+        signals = self.db.get_message("Engine").decode([0x39, 0x30])
+        self.assertAlmostEqual(signals["Speed"], 123.45)
+        self.assertEqual(signals["Rpm"], 0)
+
+        # 29 bit 0x100 is not in the database
+        self.assertTrue(self.db.decode(CANMessage(0x100, [0] * 8)) is None)
+
+    def testMultiplexing(self):
+        status = self.db.get_message("Status")
+        self.assertEqual(status.decode([0, 0x34, 0x12, 0, 0, 0, 0, 0]),
+                         {"Page": 0, "Counter": 0x1234})
+        self.assertEqual(status.decode([1, 0xFE, 0xFF, 0xFF, 0xFF]),
+                         {"Page": 1, "Offset": -2})
+        self.assertEqual(status.decode([2, 0, 0, 0xC0, 0x3F]),
+                         {"Page": 2, "Level": 1.5})
+        self.assertEqual(status.decode([7]), {"Page": 7})
+
+    def testEncode(self):
+        engine = self.db.get_message("Engine")
+        values = {"Speed": 123.45, "Temp": -10, "Rpm": 1000, "Torque": -20}
+        self.assertEqual(engine.encode(values), ENGINE_PAYLOAD)
+
+        msg = self.db.encode_message("Status", {"Page": 2, "Level": -0.25,
+                                                "Counter": 7})
+        self.assertEqual(msg.id, 0x0CF004FE)
+        self.assertTrue(msg.extended)
+        self.assertEqual(self.db.decode(msg), {"Page": 2, "Level": -0.25})
+
+        self.assertRaises(KeyError, engine.encode, {"Bogus": 1}, True)
+
+    def testRoundTrip(self):
+        engine = self.db.get_message("Engine")
+        for speed, temp, rpm, torque in ((0, -40, 0, -1024),
+                                         (655.35, 215, 16383.75, 1023.5),
+                                         (42.0, 0, 812.5, 0.5)):
+            values = {"Speed": speed, "Temp": temp, "Rpm": rpm,
+                      "Torque": torque}
+            decoded = engine.decode(engine.encode(values))
+            for name in values:
+                self.assertAlmostEqual(decoded[name], values[name])
+
+    def testColumns(self):
+        messages = []
+        for x in range(20):
+            messages.append(CANMessage(0x100, [x, 0, 40 + x], False, x))
+            messages.append(CANMessage(0x0CF004FE, [x % 2, x], True, x))
+            messages.append(CANMessage(0x555, [x], False, x))
+
+        columns = self.db.decode_batch(messages)
+        self.assertEqual(sorted(columns), ["Engine", "Status"])
+        engine = columns["Engine"]
+        self.assertEqual(list(engine["time"]), range(20))
+        self.assertEqual(list(engine["Temp"]), range(20))
+        for x, speed in enumerate(engine["Speed"]):
+            self.assertAlmostEqual(speed, x * 0.01)
+
+        status = columns["Status"]
+        self.assertEqual(list(status["Page"]), [x % 2 for x in range(20)])
+        for x in range(20):
+            counter = status["Counter"][x]
+            offset = status["Offset"][x]
+            if x % 2:
+                self.assertEqual(offset, x)
+                self.assertTrue(counter is None or math.isnan(counter))
+            else:
+                self.assertEqual(counter, x)
+                self.assertTrue(offset is None or math.isnan(offset))
+
+    def testColumnsWithoutNumPy(self):
+        saved = dbc.numpy
+        dbc.numpy = None
+        try:
+            columns = self.db.decode_batch([CANMessage(0x100, ENGINE_PAYLOAD,
+                                                       False, 1.5)])
+        finally:
+            dbc.numpy = saved
+        self.assertEqual(columns["Engine"]["Rpm"], [1000])
+        self.assertEqual(columns["Engine"]["time"], [1.5])
+
+    def testReceiveHandler(self):
+        received = []
+        handler = self.db.receive_handler(lambda m, s: received.append(s))
+        handler(CANMessage(0x100, ENGINE_PAYLOAD, False))
+        handler(CANMessage(0x101, ENGINE_PAYLOAD, False))
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["Rpm"], 1000)
+
+    def testDecodeASC(self):
+        fd, path = tempfile.mkstemp(suffix=".asc")
+        with os.fdopen(fd, "w") as trace:
+            trace.write("date Mon Jan 1 00:00:00 2013\n"
+                        "base hex  timestamps absolute\n"
+                        "   0.010 1  100             Rx   d 8 39 30 1E 0F "
+                        "A0 00 FD 80\n"
+                        "   0.020 1  CF004FEx        Rx   d 3 00 02 00\n"
+                        "   0.030 1  100             Rx   d 8 00 00 28 00 "
+                        "00 00 00 00\n")
+        try:
+            columns = self.db.decode_asc(path)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(list(columns["Engine"]["Rpm"]), [1000, 0])
+        self.assertEqual(list(columns["Engine"]["Temp"]), [-10, 0])
+        self.assertEqual(list(columns["Engine"]["time"]), [0.010, 0.030])
+        self.assertEqual(list(columns["Status"]["Counter"]), [2])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(DBCTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import logging
+import threading
+import unittest
+import pycan.tools.dispatcher as dispatcher
+import pycan.drivers.sim_can as sim_can
+from pycan.common import CANMessage, CANMessagePool
+from pycan.drivers.virtual_bus import VirtualBus
+from pycan.tools.cyclic_comm import CyclicComm
+
+
+class DispatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the dispatcher
+        disp_path = os.path.dirname(dispatcher.__file__)
+        disp_file = os.path.abspath(os.path.join(disp_path, 'dispatcher.py'))
+        pep8_checker = pep8.Checker(disp_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testPerIdOrdering(self):
+        self.pool = dispatcher.HandlerPool(workers=3)
+        received = {}
+
+        def handler(msg):
+            received.setdefault(msg.id, []).append(msg.payload[0])
+
+        for x in range(200):
+            self.pool.dispatch(CANMessage(x % 5, [x]), [handler])
+        self.pool.flush()
+
+        for can_id in range(5):
+            self.assertEqual(received[can_id], range(can_id, 200, 5))
+
+        stats = self.pool.handler_stats(handler)
+        self.assertEqual(stats.calls, 200)
+        self.assertEqual(stats.errors, 0)
+        self.assertTrue(stats.max_time >= stats.mean_time())
+
+    def testHandlerErrors(self):
+        self.pool = dispatcher.HandlerPool(workers=1)
+        calls = []
+
+        def bad_handler(msg):
+            raise ValueError(msg.id)
+
+        class Recorder(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.records = []
+
+            def emit(self, record):
+                self.records.append(record)
+
+        recorder = Recorder()
+        dispatcher.log.addHandler(recorder)
+        try:
+            self.pool.dispatch(CANMessage(1, []),
+                               [bad_handler, calls.append])
+            self.pool.flush()
+        finally:
+            dispatcher.log.removeHandler(recorder)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.pool.handler_stats(bad_handler).errors, 1)
+        self.assertEqual(len(self.pool.stats()), 2)
+
+        # The failure is logged with its traceback
+        self.assertEqual(len(recorder.records), 1)
+        self.assertEqual(recorder.records[0].exc_info[0], ValueError)
+
+    def testBoundMethodStats(self):
+        self.pool = dispatcher.HandlerPool(workers=2)
+
+        class Counter(object):
+            def __init__(self):
+                self.count = 0
+
+            def on_message(self, msg):
+                self.count += 1
+
+        counter = Counter()
+        for x in range(10):
+            # Every access builds a new bound method object
+            self.pool.dispatch(CANMessage(x, []), [counter.on_message])
+        self.pool.flush()
+
+        self.assertEqual(counter.count, 10)
+        self.assertEqual(self.pool.handler_stats(counter.on_message).calls,
+                         10)
+        self.assertEqual(len(self.pool.stats()), 1)
+
+    def testDropPolicies(self):
+        release = threading.Event()
+
+        def blocked_handler(msg):
+            release.wait(1)
+
+        for policy, kept in (("drop_newest", [0, 1, 2]),
+                             ("drop_oldest", [0, 3, 4])):
+            release.clear()
+            received = []
+            handlers = [blocked_handler, lambda m: received.append(m.id)]
+            self.pool = dispatcher.HandlerPool(workers=1, queue_size=2,
+                                               policy=policy)
+
+            # The first message keeps the worker busy, two fit the queue
+            self.pool.dispatch(CANMessage(0, []), handlers)
+            while self.pool.pending():
+                time.sleep(0.001)
+            for x in range(1, 5):
+                self.pool.dispatch(CANMessage(x, []), handlers)
+
+            self.assertEqual(self.pool.dropped(), 2)
+            release.set()
+            self.pool.flush()
+            self.assertEqual(received, kept)
+            self.pool.shutdown()
+
+        self.assertRaises(ValueError, dispatcher.HandlerPool, 1, 1, "bogus")
+
+    def testPooledMessages(self):
+        self.pool = dispatcher.HandlerPool(workers=2)
+        messages = CANMessagePool(4)
+        for x in range(20):
+            msg = messages.acquire(x, [x])
+            self.pool.dispatch(msg, [lambda m: None])
+            msg.release()
+        self.pool.flush()
+        self.assertEqual(messages.available(),
+                         messages.size + messages.misses)
+
+    def testShutdownReleases(self):
+        self.pool = dispatcher.HandlerPool(workers=1)
+        messages = CANMessagePool(4)
+        started = threading.Event()
+
+        def slow_handler(msg):
+            started.set()
+            time.sleep(0.2)
+
+        for x in range(4):
+            msg = messages.acquire(x, [x])
+            self.pool.dispatch(msg, [slow_handler])
+            msg.release()
+        started.wait(1)
+
+        # The messages still queued go back to their pool
+        self.pool.shutdown()
+        self.assertEqual(messages.available(), 4)
+
+    def testCyclicCommDispatch(self):
+        bus = VirtualBus()
+        sender = sim_can.SimCAN(bus=bus)
+        receiver = sim_can.SimCAN(bus=bus)
+        self.pool = dispatcher.HandlerPool(workers=2)
+        comm = CyclicComm(receiver, dispatcher=self.pool)
+
+        slow = []
+        fast = []
+        done = threading.Event()
+
+        def slow_handler(msg):
+            time.sleep(0.05)
+            slow.append(msg.payload[0])
+
+        def fast_handler(msg):
+            fast.append(msg.payload[0])
+            if len(fast) == 20:
+                done.set()
+
+        comm.add_receive_handler(slow_handler, 0x100, False)
+        comm.add_receive_handler(fast_handler, 0x201, False)
+
+        for x in range(20):
+            sender.send(CANMessage(0x100, [x], False))
+            sender.send(CANMessage(0x201, [x], False))
+
+        # The slow handler does not hold up the other id
+        self.assertTrue(done.wait(5))
+        self.assertTrue(len(slow) < 20)
+        self.pool.flush()
+        self.assertEqual(fast, range(20))
+        self.assertEqual(slow, range(20))
+
+        comm.shutdown()
+        sender.shutdown()
+        receiver.shutdown()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(DispatcherTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
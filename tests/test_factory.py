@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+import ConfigParser
+import pycan.config as config
+import pycan.drivers.factory as factory
+import pycan.drivers.pool as pool
+from pycan.drivers.sim_can import SimCAN
+
+
+class FactoryTests(unittest.TestCase):
+    def setUp(self):
+        self.driver = None
+        self.registry = dict(factory.drivers)
+        fd, self.config_file = tempfile.mkstemp(suffix='.cfg')
+        os.close(fd)
+
+    def tearDown(self):
+        factory.drivers.clear()
+        factory.drivers.update(self.registry)
+        os.remove(self.config_file)
+        try:
+            self.driver.shutdown()
+        except:
+            pass
+
+    def __write_config(self, selection, section=""):
+        with open(self.config_file, 'w') as fid:
+            fid.write("[defaults]\nselection = %s\n\n[%s]\n%s\n" %
+                      (selection, selection, section))
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the factory
+        factory_path = os.path.dirname(factory.__file__)
+        factory_file = os.path.abspath(os.path.join(factory_path,
+                                                    'factory.py'))
+        pep8_checker = pep8.Checker(factory_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testLazyImports(self):
+        # Importing the factory must not import any of the backends
+        code = ("import sys, pycan.drivers.factory; "
+                "print(sorted(m for m, mod in sys.modules.items() "
+                "if m.startswith('pycan.drivers.') and mod))")
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.strip(), "['pycan.drivers.factory']")
+
+    def testGetDriver(self):
+        self.__write_config("SIM_CAN")
+        self.driver = factory.get_driver(self.config_file)
+        self.assertTrue(isinstance(self.driver, SimCAN))
+        self.assertTrue(factory.drivers["SIM_CAN"] is SimCAN)
+
+    def __write_shipped_config(self, selection):
+        # The shipped setup file with another driver selected
+        shipped = ConfigParser.RawConfigParser()
+        shipped.read(os.path.join(os.path.dirname(factory.__file__),
+                                  'setup.cfg'))
+        shipped.set("defaults", "selection", selection)
+        with open(self.config_file, 'w') as fid:
+            shipped.write(fid)
+
+    def testShippedSetup(self):
+        # Every section of the shipped setup file fits its driver's schema
+        for selection in ("Kvaser", "CANUSB", "SIM_CAN", "SHM_CAN",
+                          "SocketCAN"):
+            self.__write_shipped_config(selection)
+            try:
+                driver = factory.load_driver(selection)
+            except (ImportError, OSError):
+                # The driver's library is not installed here
+                continue
+            settings = config.read_config(self.config_file).settings(driver)
+            self.assertEqual(settings["baud"], 250000)
+            if selection == "Kvaser":
+                self.assertEqual(settings["channel"], 0)
+                self.assertEqual(settings["rx_timeout"], 100)
+
+        self.__write_shipped_config("SIM_CAN")
+        self.driver = factory.get_driver(self.config_file)
+        self.assertTrue(isinstance(self.driver, SimCAN))
+        self.assertEqual(self.driver.sim_delay, 0.01)
+
+        # The pool opens its drivers the same way
+        driver_pool = pool.DriverPool()
+        try:
+            session = driver_pool.session(self.config_file)
+            self.assertTrue(isinstance(session.driver, SimCAN))
+        finally:
+            driver_pool.shutdown()
+
+    def testUnknownDriver(self):
+        self.__write_config("NoSuchDriver")
+        self.assertRaises(KeyError, factory.get_driver, self.config_file)
+
+    def testTypedSettings(self):
+        self.__write_config("SIM_CAN", "inbound_time = 0.5\n"
+                            "max_buffer_size = 0x10\nqueue_delay = .25\n"
+                            "tx_priority = id\nverbose = no")
+        self.driver = factory.get_driver(self.config_file)
+        self.assertEqual(self.driver.sim_delay, 0.5)
+        self.assertEqual(self.driver.queue_delay, 0.25)
+        self.assertEqual(self.driver.inbound.maxsize, 16)
+        self.assertEqual(self.driver.outbound.maxsize, 16)
+        self.assertEqual(self.driver.verbose, False)
+
+    def testInvalidSettings(self):
+        for section in ("inbound_time = fast", "queue_delay = 0",
+                        "no_such_setting = 1", "tx_priority = random"):
+            self.__write_config("SIM_CAN", section)
+            self.assertRaises(ValueError, factory.get_driver,
+                              self.config_file)
+
+        self.assertRaises(IOError, factory.get_driver,
+                          self.config_file + ".missing")
+
+    def testRegisterDriver(self):
+        factory.register_driver("MY_SIM", "pycan.drivers.sim_can:SimCAN")
+        self.assertTrue("MY_SIM" in factory.available_drivers())
+
+        self.__write_config("MY_SIM")
+        self.driver = factory.get_driver(self.config_file)
+        self.assertTrue(isinstance(self.driver, SimCAN))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(FactoryTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
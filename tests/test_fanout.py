@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import threading
+import unittest
+import pycan.drivers.fanout as fanout
+import pycan.drivers.virtual_bus as virtual_bus
+from pycan.common import CANMessage, CANMessagePool, IDMaskFilter
+from pycan.drivers.sim_can import SimCAN
+
+
+class FanoutTests(unittest.TestCase):
+    def setUp(self):
+        bus = virtual_bus.VirtualBus()
+        self.sender = SimCAN(bus=bus)
+        self.receiver = SimCAN(bus=bus)
+
+    def tearDown(self):
+        self.sender.shutdown()
+        self.receiver.shutdown()
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the fan-out module
+        fanout_path = os.path.dirname(fanout.__file__)
+        fanout_file = os.path.abspath(os.path.join(fanout_path, 'fanout.py'))
+        pep8_checker = pep8.Checker(fanout_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testIndependentConsumers(self):
+        log = self.receiver.subscribe()
+        ui = self.receiver.subscribe([IDMaskFilter(0x7FF, 0x100, False)])
+
+        messages = [CANMessage(0x100 + x % 2, [x], False) for x in range(10)]
+        for msg in messages:
+            self.sender.send(msg)
+
+        # Every consumer sees its frames, the very same objects
+        logged = [log.next_message(1) for x in range(10)]
+        self.assertEqual([m.payload for m in logged],
+                         [m.payload for m in messages])
+        self.assertTrue(logged[0] is messages[0])
+        shown = [ui.next_message(1) for x in range(5)]
+        self.assertEqual([m.payload[0] for m in shown], range(0, 10, 2))
+        self.assertEqual(ui.next_message(0.1), None)
+
+        # next_message still gets every frame too
+        self.assertEqual(self.receiver.next_message(1).payload, [0])
+        self.assertEqual(log.received, 10)
+        self.assertEqual(ui.received, 5)
+
+    def testDropOldest(self):
+        slow = self.receiver.subscribe(maxsize=3)
+        for x in range(10):
+            self.sender.send(CANMessage(0x100, [x], False))
+        time.sleep(0.2)
+
+        self.assertEqual(slow.pending(), 3)
+        self.assertEqual([slow.next_message(1).payload[0] for x in range(3)],
+                         [7, 8, 9])
+        self.assertEqual(slow.dropped, 7)
+
+        slow.close()
+        self.assertEqual(self.receiver.subscription_ring, None)
+        self.assertEqual(slow.next_message(0.1), None)
+
+    def testBlock(self):
+        ring = fanout.FrameRing(8)
+        sub = fanout.Subscription(self.receiver, ring, maxsize=2,
+                                  overflow=fanout.BLOCK, block_timeout=5)
+        ring.add(sub)
+        ring.publish(CANMessage(1, [1]))
+        ring.publish(CANMessage(2, [2]))
+
+        # The third frame waits for the subscription to read one
+        writer = threading.Thread(target=ring.publish,
+                                  args=(CANMessage(3, [3]),))
+        writer.start()
+        time.sleep(0.1)
+        self.assertEqual(ring.written, 2)
+        self.assertEqual(sub.next_message(1).id, 1)
+        writer.join(1)
+        self.assertEqual(ring.written, 3)
+        self.assertEqual([sub.next_message(1).id for x in range(2)], [2, 3])
+        self.assertEqual(sub.dropped, 0)
+
+        # Without a reader the writer gives up after block_timeout
+        sub.block_timeout = 0.05
+        for x in range(4):
+            ring.publish(CANMessage(4 + x, [x]))
+        self.assertEqual(sub.dropped, 2)
+        self.assertEqual(sub.next_message(1).id, 6)
+
+        self.assertRaises(ValueError, fanout.Subscription, self.receiver,
+                          ring, overflow="random")
+
+    def testPooledMessages(self):
+        pool = CANMessagePool(4)
+        ring = fanout.FrameRing(2)
+        sub = fanout.Subscription(self.receiver, ring)
+        ring.add(sub)
+
+        msg = pool.acquire(0x123, [1])
+        ring.publish(msg)
+        msg.release()
+        self.assertEqual(pool.available(), 3)
+
+        # The ring and the reader hold references
+        self.assertTrue(sub.next_message(1) is msg)
+        ring.publish(pool.acquire(0x124, [2]))
+        ring.publish(pool.acquire(0x125, [3]))
+        self.assertEqual(pool.available(), 1)
+        msg.release()
+        self.assertEqual(pool.available(), 2)
+
+        ring.clear()
+        self.assertEqual(pool.available(), 2)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(FanoutTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
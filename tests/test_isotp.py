@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import threading
+import unittest
+import pycan.tools.isotp as isotp
+import pycan.drivers.virtual_bus as virtual_bus
+from pycan.common import CANMessage
+from pycan.drivers.sim_can import SimCAN
+from pycan.tools.isotp import IsoTpTransport, encode_stmin, decode_stmin
+
+
+class IsoTpTests(unittest.TestCase):
+    def setUp(self):
+        bus = virtual_bus.VirtualBus()
+        self.tester_driver = SimCAN(bus=bus)
+        self.ecu_driver = SimCAN(bus=bus)
+        self.tester = IsoTpTransport(self.tester_driver)
+        self.ecu = IsoTpTransport(self.ecu_driver)
+
+    def tearDown(self):
+        self.tester.shutdown()
+        self.ecu.shutdown()
+        self.tester_driver.shutdown()
+        self.ecu_driver.shutdown()
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the isotp module
+        tp_path = os.path.dirname(isotp.__file__)
+        tp_file = os.path.abspath(os.path.join(tp_path, 'isotp.py'))
+        pep8_checker = pep8.Checker(tp_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testSTmin(self):
+        self.assertEqual(encode_stmin(0), 0)
+        self.assertEqual(encode_stmin(0.020), 20)
+        self.assertEqual(encode_stmin(0.0003), 0xF3)
+        self.assertEqual(encode_stmin(1.0), 0x7F)
+        self.assertEqual(decode_stmin(20), 0.020)
+        self.assertEqual(decode_stmin(0xF3), 0.0003)
+        self.assertEqual(decode_stmin(0xA0), 0.127)
+
+    def testSingleFrame(self):
+        tester = self.tester.open(0x7E0, 0x7E8)
+        ecu = self.ecu.open(0x7E8, 0x7E0)
+        tester.send([0x22, 0xF1, 0x90])
+        self.assertEqual(ecu.recv(1), bytearray([0x22, 0xF1, 0x90]))
+
+        # Padded to 8 bytes, unpadded without
+        frames = []
+        self.ecu_driver.add_receive_tap(frames.append)
+        tester.send([0x3E, 0x00])
+        self.ecu.padding = None
+        ecu.send([0x7E, 0x00])
+        self.assertEqual(tester.recv(1), bytearray([0x7E, 0x00]))
+        self.assertEqual(frames[0].payload, [0x02, 0x3E, 0x00] + [0xCC] * 5)
+
+    def transfer(self, size, **kwargs):
+        tester = self.tester.open(0x18DA10F1, 0x18DAF110, True)
+        ecu = self.ecu.open(0x18DAF110, 0x18DA10F1, True, **kwargs)
+        data = bytearray(x & 0xFF for x in range(size))
+        tester.send(data)
+        self.assertEqual(ecu.recv(5), data)
+        self.assertEqual(ecu.errors, 0)
+        return tester, ecu, data
+
+    def testSegmented(self):
+        tester, ecu, data = self.transfer(100)
+
+        # Both directions, several flow control blocks
+        ecu.block_size = 4
+        tester.block_size = 3
+        reply = threading.Thread(target=ecu.send, args=(data * 10,))
+        reply.start()
+        self.assertEqual(tester.recv(5), data * 10)
+        reply.join()
+
+    def testLongTransfer(self):
+        # Beyond 4095 bytes the first frame uses the 32 bit length
+        self.transfer(5000, block_size=16)
+
+    def testSeparationTime(self):
+        # Time the frames handed to the driver
+        times = []
+        send = self.tester_driver.send
+
+        def timed_send(msg):
+            times.append(time.time())
+            return send(msg)
+
+        self.tester_driver.send = timed_send
+        self.transfer(7 * 10, stmin=0.005)
+        gaps = [b - a for a, b in zip(times[1:], times[2:])]
+        self.assertEqual(len(gaps), 9)
+        self.assertTrue(min(gaps) > 0.004, msg=str(gaps))
+
+    def testSeparationTimeBlocks(self):
+        # STmin also holds for the first frame after each flow control
+        times = []
+        send = self.tester_driver.send
+
+        def timed_send(msg):
+            times.append(time.time())
+            return send(msg)
+
+        self.tester_driver.send = timed_send
+        self.transfer(7 * 10, stmin=0.005, block_size=2)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        self.assertEqual(len(gaps), 10)
+        self.assertTrue(min(gaps) > 0.004, msg=str(gaps))
+
+    def testOverflowAndTimeout(self):
+        tester = self.tester.open(0x7E0, 0x7E8, timeout=0.2)
+        self.ecu.open(0x7E8, 0x7E0, max_length=10)
+        self.assertRaises(IOError, tester.send, range(20))
+
+        # Nobody answers on 0x7E1
+        lonely = self.tester.open(0x7E1, 0x7E9, timeout=0.2)
+        tic = time.time()
+        self.assertRaises(IOError, lonely.send, range(20))
+        self.assertTrue(time.time() - tic >= 0.2)
+
+    def testConcurrentSessions(self):
+        channels = []
+        for x in range(3):
+            tester = self.tester.open(0x700 + x, 0x780 + x)
+            ecu = self.ecu.open(0x780 + x, 0x700 + x)
+            channels.append((tester, ecu))
+
+        threads = [threading.Thread(target=tester.send, args=([x] * 50,))
+                   for x, (tester, ecu) in enumerate(channels)]
+        for t in threads:
+            t.start()
+        for x, (tester, ecu) in enumerate(channels):
+            self.assertEqual(ecu.recv(5), bytearray([x] * 50))
+        for t in threads:
+            t.join()
+
+    def testSequenceError(self):
+        ecu = self.ecu.open(0x7E8, 0x7E0)
+        ecu.handle_frame(CANMessage(0x7E0, [0x10, 20] + range(6), False))
+        ecu.handle_frame(CANMessage(0x7E0, [0x22] + range(7), False))
+        self.assertEqual(ecu.errors, 1)
+        self.assertEqual(ecu.recv(0.05), None)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(IsoTpTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
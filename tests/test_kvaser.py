@@ -27,6 +27,7 @@ class KvaserTests(unittest.TestCase):
         config.read(os.path.join(test_path, 'test.cfg'))
 
         self.known_can_id = int(config.get('COMMON', 'Known_ID_On_Bus'), 16)
+        self.channels = config.get('Kvaser', 'Channels')
 
     def testPEP8Compliance(self):
         # Ensure PEP8 is installed
@@ -55,6 +56,29 @@ class KvaserTests(unittest.TestCase):
         self.Receive()
         self.SpecificReceive()
 
+    def testMultiChannelDriver(self):
+        # Load the real time test configuration
+        self.__load_test_config()
+
+        # One driver for all of the channels
+        self.driver = driver.Kvaser(channels=self.channels)
+        self.assertEqual(len(self.driver.channels),
+                         len(self.channels.split(',')))
+
+        # Send from the 1st channel, the others are on the same bus
+        msg1 = CANMessage(0x123456, [1,2,3], channel=0)
+        self.assertTrue(self.driver.send(msg1))
+
+        seen = set()
+        for x in range(1000):
+            msg = self.driver.next_message(timeout=1)
+            if msg and msg.id == msg1.id:
+                seen.add(msg.channel)
+                if len(seen) == len(self.driver.channels) - 1:
+                    break
+
+        self.assertEqual(seen, set(range(1, len(self.driver.channels))))
+
     def Transmit(self):
         # Note you must also check that the CAN message is being placed
         # on the wire at 100ms intervals
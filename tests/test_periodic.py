@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import unittest
+import pycan.clock as clock
+import pycan.drivers.periodic as periodic
+from pycan.drivers.sim_can import SimCAN
+from pycan.tools.cyclic_comm import CyclicComm
+from pycan.common import CANMessage
+
+
+class PeriodicTests(unittest.TestCase):
+    def setUp(self):
+        self.clk = clock.VirtualClock()
+        self.sent = []
+        self.scheduler = None
+        self.driver = None
+
+    def tearDown(self):
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        if self.driver is not None:
+            self.driver.shutdown()
+
+    def __send(self, message):
+        self.sent.append((self.clk.time(), message.payload[0]))
+        return True
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the periodic module
+        periodic_path = os.path.dirname(periodic.__file__)
+        periodic_file = os.path.abspath(os.path.join(periodic_path,
+                                                     'periodic.py'))
+        pep8_checker = pep8.Checker(periodic_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testExactPeriods(self):
+        self.scheduler = periodic.PeriodicScheduler(self.__send, self.clk)
+        self.scheduler.start(1, CANMessage(1, [1]), 0.1)
+        self.scheduler.start(2, CANMessage(2, [2]), 0.25)
+        self.clk.run_until(1.0)
+
+        times = [t for t, payload in self.sent if payload == 1]
+        self.assertEqual(len(times), 10)
+        for x, t in enumerate(times):
+            self.assertAlmostEqual(t, 0.1 * (x + 1))
+        self.assertEqual([t for t, payload in self.sent if payload == 2],
+                         [0.25, 0.5, 0.75, 1.0])
+        self.assertEqual(self.scheduler.messages[1].skipped, 0)
+        self.assertTrue(self.scheduler.messages[1].max_late < 1e-9)
+
+    def testUpdateAndStop(self):
+        self.scheduler = periodic.PeriodicScheduler(self.__send, self.clk)
+        self.scheduler.start("a", CANMessage(1, [1]), 0.5, delay=0)
+        self.clk.run_until(0.75)
+        self.assertTrue(self.scheduler.update("a", CANMessage(1, [5])))
+        self.clk.run_until(1.25)
+        self.assertTrue(self.scheduler.stop("a"))
+        self.clk.run_until(3.0)
+
+        self.assertEqual(self.sent, [(0.0, 1), (0.5, 1), (1.0, 5)])
+        self.assertFalse(self.scheduler.update("a", CANMessage(1, [6])))
+        self.assertFalse(self.scheduler.stop("a"))
+        self.assertRaises(ValueError, self.scheduler.start, "b",
+                          CANMessage(2, [2]), 0)
+
+    def testLateSkips(self):
+        blocked = [True]
+
+        def slow_send(message):
+            # The first send holds the timer up for 0.35 seconds
+            self.__send(message)
+            if blocked[0]:
+                blocked[0] = False
+                self.clk.sleep(0.35)
+
+        self.scheduler = periodic.PeriodicScheduler(slow_send, self.clk)
+        self.scheduler.start(1, CANMessage(1, [1]), 0.1)
+        self.clk.run_until(1.0)
+
+        # 0.2 goes out late, 0.3 and 0.4 are skipped and the schedule keeps
+        # its phase
+        times = [round(t, 6) for t, payload in self.sent]
+        self.assertEqual(times, [0.1, 0.45, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+        entry = self.scheduler.messages[1]
+        self.assertEqual(entry.skipped, 2)
+        self.assertAlmostEqual(entry.max_late, 0.25)
+
+    def testDriverPeriodic(self):
+        self.driver = SimCAN(clock=self.clk)
+        key = self.driver.start_periodic(CANMessage(0x123, [1]), 0.01)
+        self.assertEqual(key, 0x123)
+        self.clk.run_until(1.005)
+        self.assertEqual(self.driver.life_time_sent(), 100)
+
+        self.driver.stop_periodic(key)
+        self.clk.run_until(2.0)
+        self.assertEqual(self.driver.life_time_sent(), 100)
+
+    def testCyclicCommUsesDriver(self):
+        self.driver = SimCAN(clock=self.clk)
+        comm = CyclicComm(self.driver, driver_periodic=True)
+        try:
+            self.assertTrue(comm.driver_periodic)
+            comm.add_cyclic_message(CANMessage(0x123, [1]), 0.1, "status")
+            scheduler = self.driver.periodic_scheduler
+            self.assertTrue("status" in scheduler.messages)
+            self.clk.run_until(1.05)
+            self.assertEqual(self.driver.life_time_sent(), 10)
+
+            comm.stop_cyclic_message("status")
+            self.assertEqual(self.driver.periodic_scheduler.messages, {})
+        finally:
+            comm.shutdown()
+
+    def testCyclicCommOwnThread(self):
+        # Drivers without native periodic transmit keep the CyclicComm's
+        # own scheduler thread
+        self.driver = SimCAN(clock=self.clk)
+        comm = CyclicComm(self.driver)
+        try:
+            self.assertFalse(comm.driver_periodic)
+            comm.add_cyclic_message(CANMessage(0x123, [1]), 0.1, "status")
+            self.clk.run_until(1.05)
+            self.assertEqual(self.driver.life_time_sent(), 10)
+            self.assertEqual(self.driver.periodic_scheduler, None)
+        finally:
+            comm.shutdown()
+
+    def testCyclicCommNativeDriver(self):
+        self.driver = SimCAN(clock=self.clk)
+        self.driver.native_periodic = True
+        native = CyclicComm(self.driver)
+        own = CyclicComm(self.driver, driver_periodic=False)
+        try:
+            self.assertTrue(native.driver_periodic)
+            self.assertFalse(own.driver_periodic)
+        finally:
+            native.shutdown()
+            own.shutdown()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(PeriodicTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import tempfile
+import unittest
+import pycan.config as config
+import pycan.drivers.pool as pool
+import pycan.drivers.virtual_bus as virtual_bus
+from pycan.common import CANMessage, IDMaskFilter
+from pycan.drivers.sim_can import SimCAN
+
+
+class DriverPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = virtual_bus.VirtualBus()
+        self.remote = SimCAN(bus=self.bus, queue_delay=0.05)
+        self.pool = pool.DriverPool()
+        self.config_file = None
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.remote.shutdown()
+        if self.config_file is not None:
+            os.remove(self.config_file)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the pool module
+        pool_path = os.path.dirname(pool.__file__)
+        pool_file = os.path.abspath(os.path.join(pool_path, 'pool.py'))
+        pep8_checker = pep8.Checker(pool_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def __add_local(self):
+        driver = SimCAN(bus=self.bus, queue_delay=0.05)
+        self.pool.add("local", driver)
+        return driver
+
+    def testSessionFilters(self):
+        driver = self.__add_local()
+        self.assertRaises(ValueError, self.pool.session, "local",
+                          queue_delay=1)
+        everything = self.pool.session("local")
+        filtered = self.pool.session("local",
+                                     [IDMaskFilter(0x7FF, 0x123, False)])
+        self.assertTrue(everything.driver is filtered.driver is driver)
+
+        self.remote.send(CANMessage(0x123, [1], False))
+        self.remote.send(CANMessage(0x456, [2], False))
+
+        self.assertEqual(everything.next_message(1).id, 0x123)
+        self.assertEqual(everything.next_message(1).id, 0x456)
+        self.assertEqual(filtered.next_message(1).id, 0x123)
+        self.assertEqual(filtered.next_message(0.2), None)
+        self.assertEqual(everything.life_time_received(), 2)
+
+        # Sessions send through the shared driver
+        self.assertTrue(filtered.send(CANMessage(0x321, [3], False)))
+        self.assertEqual(self.remote.next_message(1).id, 0x321)
+        self.assertEqual(filtered.life_time_sent(), 1)
+
+    def testReuseAndReset(self):
+        driver = self.__add_local()
+        session = self.pool.session("local")
+        self.remote.send(CANMessage(0x100, [1], False))
+        self.remote.send(CANMessage(0x101, [2], False))
+        time.sleep(0.2)
+
+        # Reset drops the pending frames without touching the driver
+        session.reset()
+        self.assertEqual(session.next_message(0.1), None)
+        self.remote.send(CANMessage(0x102, [3], False))
+        self.assertEqual(session.next_message(1).id, 0x102)
+
+        # Frames received without a session are discarded
+        session.close()
+        self.assertEqual(self.pool.sessions("local"), ())
+        self.remote.send(CANMessage(0x103, [4], False))
+        time.sleep(0.2)
+
+        with self.pool.session("local") as session:
+            self.assertTrue(session.driver is driver)
+            self.assertEqual(session.next_message(0.1), None)
+        self.assertTrue(driver._running.is_set())
+
+    def testSetupFile(self):
+        fd, self.config_file = tempfile.mkstemp(suffix='.cfg')
+        os.close(fd)
+        with open(self.config_file, 'w') as fid:
+            fid.write("[defaults]\nselection = SIM_CAN\nqueue_delay = 0.05\n")
+
+        first = self.pool.session(self.config_file)
+        second = self.pool.session(self.config_file)
+        self.assertTrue(first.driver is second.driver)
+        self.assertTrue(first.next_message(1) is not None)
+        first.close()
+        second.close()
+
+        # A modified setup file reopens the driver
+        time.sleep(0.01)
+        with open(self.config_file, 'a') as fid:
+            fid.write("inbound_time = 0.05\n")
+        third = self.pool.session(self.config_file)
+        self.assertFalse(third.driver is first.driver)
+        self.assertEqual(third.driver.sim_delay, 0.05)
+        self.assertFalse(first.driver._running.is_set())
+
+        # Other driver arguments are refused while the driver is in use
+        self.assertRaises(ValueError, self.pool.session, self.config_file,
+                          queue_delay=0.1)
+        third.close()
+        fourth = self.pool.session(self.config_file, queue_delay=0.1)
+        self.assertFalse(fourth.driver is third.driver)
+        self.assertEqual(fourth.driver.queue_delay, 0.1)
+        fifth = self.pool.session(self.config_file, queue_delay=0.1)
+        self.assertTrue(fifth.driver is fourth.driver)
+
+    def testImmediateShutdown(self):
+        driver = self.__add_local()
+        self.pool.session("local")
+        tic = time.time()
+        self.pool.shutdown()
+        self.assertTrue(time.time() - tic < 0.5)
+        self.assertFalse(driver._running.is_set())
+        self.assertFalse(driver.ob_t.is_alive())
+        self.assertEqual(self.pool.keys(), [])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(DriverPoolTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -9,16 +9,17 @@ from pycan.basedriver import *
 from pycan.common import CANMessage
 
 def measure_performance(driver, rate, run_time=3.0):
+    # See pycan.tools.benchmark for the full (offline) benchmark suite
     expected_counts = run_time / rate
     tic = time.time()
     t_stats = []
     obc = 0
-    while driver.total_outbound_count < expected_counts:
-        if obc != driver.total_outbound_count:
+    while driver.life_time_sent() < expected_counts:
+        if obc != driver.life_time_sent():
             toc = time.time()
             t_stats.append(toc - tic)
             tic = toc
-            obc = driver.total_outbound_count
+            obc = driver.life_time_sent()
 
     ret = (max(t_stats)*1000.0, min(t_stats)*1000.0, (sum(t_stats) / float(len(t_stats))) * 1000.0)
     print "\nTarget:%1.1f (ms)\nMax %1.1f\nMin %1.1f\nAvg %1.1f" % (rate*1000.0, ret[0], ret[1], ret[2])
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import unittest
+import pycan.tools.router as router
+from pycan.common import CANMessage, CANMessagePool, IDMaskFilter
+from pycan.drivers.basedriver import BaseDriverAPI
+from pycan.drivers.sim_can import SimCAN
+from pycan.drivers.virtual_bus import VirtualBus
+from pycan.tools.router import Router, Route
+
+
+class ListDriver(BaseDriverAPI):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+        return True
+
+
+class RouterTests(unittest.TestCase):
+    def setUp(self):
+        self.a = ListDriver()
+        self.b = ListDriver()
+        self.c = ListDriver()
+        self.router = Router({"a": self.a, "b": self.b, "c": self.c})
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the router module
+        rt_path = os.path.dirname(router.__file__)
+        rt_file = os.path.abspath(os.path.join(rt_path, 'router.py'))
+        pep8_checker = pep8.Checker(rt_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testRules(self):
+        diag = IDMaskFilter(0x7FF, 0x7DF, False)
+        self.router.add_route("a", None, [diag], drop=True, name="no diag")
+        self.router.add_route("a", "b", [IDMaskFilter(0x700, 0x100, False)])
+        self.router.add_route("a", "c", rewrite={0x123: 0x321},
+                              transform=lambda p: p[::-1])
+
+        msg = CANMessage(0x123, [1, 2, 3], False)
+        self.router.route("a", msg)
+        self.router.route("a", CANMessage(0x7DF, [2, 0x3E, 0], False))
+        self.router.route("a", CANMessage(0x18FF0000, [9]))
+
+        # Unchanged frames are forwarded as is
+        self.assertTrue(self.b.sent == [msg])
+        self.assertEqual([(m.id, m.payload) for m in self.c.sent],
+                         [(0x321, [3, 2, 1]), (0x18FF0000, [9])])
+        self.assertEqual(msg.payload, [1, 2, 3])
+
+        stats = self.router.stats()
+        self.assertEqual(stats["no diag"]["frames"], 1)
+        self.assertEqual(stats["a->b"]["frames"], 1)
+        self.assertEqual(stats["a->c"]["frames"], 2)
+        self.assertTrue(stats["a->c"]["max_latency"] >= 0)
+        self.assertEqual(self.router.received["a"], 3)
+
+        # Nothing routes from b
+        self.router.route("b", msg)
+        self.assertEqual(self.router.unrouted, 1)
+
+    def testCompiledTable(self):
+        calls = []
+
+        def rewrite(can_id):
+            calls.append(can_id)
+            return can_id | 0x1000
+
+        self.router.add_route("a", "b", rewrite=rewrite)
+        for x in range(100):
+            self.router.route("a", CANMessage(0x10 + x % 2, [x]))
+        self.assertEqual(calls, [0x10, 0x11])
+        self.assertEqual(self.b.sent[-1].id, 0x1011)
+
+        # Adding a route recompiles
+        self.router.add_route("a", "c")
+        self.router.route("a", CANMessage(0x10, [1]))
+        self.assertEqual(len(self.c.sent), 1)
+        self.assertEqual(len(calls), 3)
+
+    def testUnknownBus(self):
+        self.assertRaises(KeyError, self.router.add_route, "x", "a")
+        self.assertRaises(KeyError, self.router.add, Route("a", "x"))
+
+    def testPooledMessagesAreCopied(self):
+        pool = CANMessagePool(1)
+        self.router.add_route("a", "b")
+        msg = pool.acquire(0x100, [1, 2], False)
+        self.router.route("a", msg)
+        msg.release()
+        self.assertFalse(self.b.sent[0] is msg)
+        self.assertEqual(self.b.sent[0].payload, [1, 2])
+
+    def testChannels(self):
+        # The destination's default channel unless the route maps it
+        self.router.add_route("a", "b")
+        self.router.add_route("a", "c", channel={1: 0})
+        msg = CANMessage(0x100, [1], False, channel=1)
+        self.router.route("a", msg)
+        self.assertEqual(self.b.sent[0].channel, None)
+        self.assertEqual(msg.channel, 1)
+        self.assertEqual(self.c.sent[0].channel, 0)
+
+        self.router.add(Route("a", "b", channel=router.KEEP_CHANNEL))
+        self.router.route("a", msg)
+        self.assertEqual([m.channel for m in self.b.sent], [None, None, 1])
+        self.assertTrue(self.b.sent[2] is msg)
+
+    def testThroughput(self):
+        # Two fully loaded 500 kbit/s buses carry < 10000 frames / second
+        self.router.add_route("a", "b", [IDMaskFilter(0x700, 0x100, False)])
+        self.router.add_route("a", "c", rewrite=lambda i: i + 1)
+        frames = [CANMessage(0x100 + x % 512, [x & 0xFF] * 8, False)
+                  for x in range(20000)]
+        tic = time.time()
+        self.router.forward("a", frames)
+        self.assertTrue(time.time() - tic < 1.0)
+        self.assertEqual(len(self.c.sent), 20000)
+
+    def testDrivers(self):
+        for use_tap in (True, False):
+            bus_a = VirtualBus()
+            bus_b = VirtualBus()
+            peer_a = SimCAN(bus=bus_a)
+            gateway_a = SimCAN(bus=bus_a)
+            gateway_b = SimCAN(bus=bus_b)
+            received = []
+            bus_b.attach(received.append)
+
+            gateway = Router({"a": gateway_a, "b": gateway_b},
+                             [Route("a", "b", rewrite=0x555)],
+                             use_tap=use_tap)
+            gateway.start()
+            for x in range(10):
+                peer_a.send(CANMessage(0x100, [x], False))
+
+            tic = time.time()
+            while len(received) < 10 and time.time() - tic < 5:
+                time.sleep(0.01)
+            gateway.stop()
+            for driver in (peer_a, gateway_a, gateway_b):
+                driver.shutdown()
+
+            self.assertEqual([(m.id, m.payload) for m in received],
+                             [(0x555, [x]) for x in range(10)])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(RouterTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
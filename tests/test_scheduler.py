@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import Queue
+import unittest
+import pycan.drivers.scheduler as scheduler
+from pycan.common import CANMessage, frame_bits
+from pycan.drivers.sim_can import SimCAN
+from pycan.drivers.scheduler import OutboundScheduler, TokenBucket
+
+
+class StepClock(object):
+    """Clock whose sleeps just move the time forward"""
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep_until(self, deadline):
+        self.now = max(self.now, deadline)
+
+
+class SchedulerTests(unittest.TestCase):
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the scheduler module
+        sched_path = os.path.dirname(scheduler.__file__)
+        sched_file = os.path.abspath(os.path.join(sched_path,
+                                                  'scheduler.py'))
+        pep8_checker = pep8.Checker(sched_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def drain(self, queue):
+        out = []
+        while not queue.empty():
+            out.append(queue.get())
+        return out
+
+    def testArbitrationOrder(self):
+        queue = OutboundScheduler(10)
+        frames = [CANMessage(0x700, [1], False),
+                  CANMessage(0x100 << 18, [], True),
+                  CANMessage(0x100, [], False),
+                  CANMessage(0x7DF, [1], False),
+                  CANMessage(0x7DF, [2], False),
+                  CANMessage(0x10, [], True)]
+        for msg in frames:
+            queue.put(msg)
+        out = self.drain(queue)
+        self.assertEqual([(m.id, m.extended) for m in out],
+                         [(0x10, True), (0x100, False),
+                          (0x100 << 18, True), (0x700, False),
+                          (0x7DF, False), (0x7DF, False)])
+        # Equal priority keeps the order
+        self.assertEqual(out[-2].payload, [1])
+
+    def testExplicitPriority(self):
+        queue = OutboundScheduler(priority={0x7DF: 0, 0x7E0: 1})
+        for can_id in (0x100, 0x7E0, 0x050, 0x7DF):
+            queue.put(CANMessage(can_id, [], False))
+        self.assertEqual([m.id for m in self.drain(queue)],
+                         [0x7DF, 0x7E0, 0x050, 0x100])
+
+        queue = OutboundScheduler(priority=lambda m: -m.id)
+        for can_id in (1, 3, 2):
+            queue.put(CANMessage(can_id, []))
+        self.assertEqual([m.id for m in self.drain(queue)], [3, 2, 1])
+
+    def testBounded(self):
+        queue = OutboundScheduler(2)
+        queue.put(CANMessage(1, []))
+        queue.put(CANMessage(2, []))
+        self.assertRaises(Queue.Full, queue.put_nowait, CANMessage(0, []))
+
+    def testBusLoadCap(self):
+        clock = StepClock()
+        queue = OutboundScheduler(bus_load=0.5, bit_rate=100000, burst=200,
+                                  stuffing=False, clock=clock)
+        msg = CANMessage(0x100, range(8), False)
+        bits = frame_bits(msg)
+        for x in range(100):
+            queue.put(msg)
+        self.drain(queue)
+
+        # 50 kbit/s after the initial burst
+        self.assertAlmostEqual(clock.now, (100 * bits - 200) / 50000.0)
+        self.assertAlmostEqual(queue.bucket.waited, clock.now)
+
+    def testCriticalFrameWhileWaiting(self):
+        class ArrivalClock(StepClock):
+            # A critical frame is queued while waiting for bus time
+            def sleep_until(self, deadline):
+                StepClock.sleep_until(self, deadline)
+                if self.arrival is not None:
+                    queue.put(self.arrival)
+                    self.arrival = None
+
+        clock = ArrivalClock()
+        clock.arrival = None
+        queue = OutboundScheduler(bus_load=1.0, bit_rate=1000, burst=200,
+                                  stuffing=False, clock=clock)
+        low = CANMessage(0x700, range(8), False)
+        for x in range(2):
+            queue.put(low)
+        self.assertTrue(queue.get() is low)
+
+        clock.arrival = CANMessage(0x001, range(8), False)
+        self.assertEqual(queue.get().id, 0x001)
+        self.assertTrue(queue.get() is low)
+
+    def testNoWaitForBusTime(self):
+        queue = OutboundScheduler(bus_load=1.0, bit_rate=100, burst=200,
+                                  stuffing=False)
+        msg = CANMessage(0x100, range(8), False)
+        for x in range(3):
+            queue.put(msg)
+        self.assertTrue(queue.get_nowait() is msg)
+
+        # The next frame needs about half a second of bus time
+        tic = time.time()
+        self.assertRaises(Queue.Empty, queue.get_nowait)
+        self.assertRaises(Queue.Empty, queue.get, True, 0.05)
+        self.assertTrue(time.time() - tic < 0.3)
+        self.assertEqual(queue.qsize(), 2)
+
+    def testTokenBucket(self):
+        clock = StepClock()
+        bucket = TokenBucket(1000, 100, clock)
+        bucket.consume(100)
+        self.assertEqual(clock.now, 0.0)
+        bucket.consume(50)
+        self.assertAlmostEqual(clock.now, 0.05)
+
+        # Idle time refills up to the capacity only
+        clock.now = 10.0
+        bucket.consume(100)
+        self.assertEqual(clock.now, 10.0)
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+    def testDriverOption(self):
+        driver = SimCAN(tx_priority="id")
+        self.assertTrue(isinstance(driver.outbound, OutboundScheduler))
+        self.assertEqual(driver.outbound.maxsize, 1000)
+        driver.shutdown()
+
+        driver = SimCAN(tx_bus_load=0.3, tx_bit_rate=500000)
+        self.assertEqual(driver.outbound.bucket.rate, 150000)
+        driver.shutdown()
+
+        driver = SimCAN()
+        self.assertFalse(isinstance(driver.outbound, OutboundScheduler))
+        driver.shutdown()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(SchedulerTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
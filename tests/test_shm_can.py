@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import unittest
+import multiprocessing
+import pycan.drivers.shm_can as driver
+from pycan.common import CANMessage
+
+
+def remote_writer(path, count):
+    remote = driver.ShmCAN(path=path)
+    for x in range(count):
+        remote.send(CANMessage(x, [x & 0xFF, 1, 2]))
+    remote.shutdown()
+
+
+class ShmCANTests(unittest.TestCase):
+    def setUp(self):
+        self.path = driver.bus_path("unittest_%d" % os.getpid())
+        self.drivers = []
+
+    def tearDown(self):
+        for d in self.drivers:
+            d.shutdown()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the CAN driver
+        driver_path = os.path.dirname(driver.__file__)
+        driver_file = os.path.abspath(os.path.join(driver_path, 'shm_can.py'))
+        pep8_checker = pep8.Checker(driver_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def __open(self, **kwargs):
+        d = driver.ShmCAN(path=self.path, **kwargs)
+        self.drivers.append(d)
+        return d
+
+    def testSharedBus(self):
+        node1 = self.__open()
+        node2 = self.__open()
+        node3 = self.__open()
+
+        msg = CANMessage(0x18FF0001, [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertTrue(node1.send(msg))
+        self.assertEqual(node1.life_time_sent(), 1)
+
+        # Every other reader gets its own copy of the frame
+        for node in (node2, node3):
+            rx = node.next_message(timeout=2)
+            self.assertEqual(rx.id, msg.id)
+            self.assertEqual(rx.payload, msg.payload)
+            self.assertTrue(rx.extended)
+
+        # The sender does not see its own frame
+        self.assertEqual(node1.next_message(timeout=.1), None)
+
+    def testCrossProcess(self):
+        reader = self.__open(slots=64)
+        count = 50
+
+        p = multiprocessing.Process(target=remote_writer,
+                                    args=(self.path, count))
+        p.start()
+        p.join(10)
+
+        ids = [reader.next_message(timeout=2).id for x in range(count)]
+        self.assertEqual(ids, range(count))
+
+    def testOverrun(self):
+        reader = self.__open(slots=8)
+        reader._running.clear()
+        reader.ib_t.join()
+
+        writer = self.__open()
+        for x in range(20):
+            writer.send(CANMessage(x, [x]))
+
+        # Restart the reader after it fell behind
+        reader._running.set()
+        reader.ib_t = reader.start_daemon(
+            reader._ShmCAN__process_inbound_ring)
+        ids = [reader.next_message(timeout=2).id for x in range(8)]
+        self.assertEqual(ids, range(12, 20))
+        self.assertEqual(reader.overrun_count, 12)
+
+    def testSourceId(self):
+        node1 = self.__open()
+        node2 = self.__open()
+
+        # The full pid and the instance tell the senders apart
+        self.assertEqual(node1.source >> 32, os.getpid())
+        self.assertEqual(node2.source >> 32, os.getpid())
+        self.assertNotEqual(node1.source, node2.source)
+
+    def testFullInbound(self):
+        reader = self.__open(max_buffer_size=4)
+        writer = self.__open()
+        for x in range(20):
+            writer.send(CANMessage(x, [x]))
+
+        # The frames wait in the ring until there is room for them
+        ids = [reader.next_message(timeout=2).id for x in range(20)]
+        self.assertEqual(ids, range(20))
+        self.assertEqual(reader.inbound_dropped, 0)
+        self.assertEqual(reader.overrun_count, 0)
+
+    def testRemoveOnShutdown(self):
+        node1 = self.__open()
+        node2 = self.__open()
+        self.drivers = []
+
+        node1.shutdown()
+        self.assertTrue(os.path.exists(self.path))
+        node2.shutdown()
+        self.assertFalse(os.path.exists(self.path))
+
+        # A new instance starts a new bus
+        node3 = self.__open()
+        self.assertEqual(node3.next_message(timeout=.1), None)
+        self.assertTrue(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(ShmCANTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -4,16 +4,26 @@
 # Use of this source code is governed by a MIT-style license that
 # can be found in the LICENSE.txt file for the project.
 import os
+import time
 import random
+import shutil
+import tempfile
 import unittest
 import pycan.drivers.sim_can as driver
 from pycan.common import CANMessage
+from pycan.clock import VirtualClock
+
+TRACE = """date Mon Jan 1 00:00:00 2013
+base hex  timestamps absolute
+   10.000000 1  123             Rx   d 3 01 02 03
+   10.500000 1  18FF0001x       Rx   d 8 00 01 02 03 04 05 06 07
+   11.000000 1  456             Rx   d 2 AA BB
+"""
 
 class SimCANTests(unittest.TestCase):
     def tearDown(self):
         try:
             self.driver.shutdown()
-            time.sleep(2)
         except:
             pass
 
@@ -63,6 +73,82 @@ class SimCANTests(unittest.TestCase):
             if self.driver.next_message():
                 self.assertEqual((x+1), self.driver.life_time_received())
 
+    def __write_trace(self):
+        self.trace_dir = tempfile.mkdtemp()
+        path = os.path.join(self.trace_dir, "trace.asc")
+        with open(path, "w") as fid:
+            fid.write(TRACE)
+        self.addCleanup(shutil.rmtree, self.trace_dir)
+        return path
+
+    def __read(self, count):
+        return [self.driver.inbound.get(timeout=1) for x in range(count)]
+
+    def testTraceFastReplay(self):
+        self.driver = driver.SimCAN(trace=self.__write_trace(),
+                                    trace_speed=0)
+        self.assertTrue(self.driver.trace_done.wait(1))
+        frames = self.__read(3)
+        self.assertEqual([m.id for m in frames], [0x123, 0x18FF0001, 0x456])
+        self.assertEqual([m.extended for m in frames], [False, True, False])
+        self.assertEqual(frames[0].payload, [1, 2, 3])
+        self.assertEqual(frames[2].payload, [0xAA, 0xBB])
+        self.assertEqual(frames[1].time_stamp, 10.5)
+        self.assertEqual([m.channel for m in frames], [0, 0, 0])
+        self.assertTrue(self.driver.inbound.empty())
+
+        # Columns and looping
+        self.driver.shutdown()
+        frames = driver.load_trace(self.__write_trace())
+        columns = {"time": [m.time_stamp for o, m in frames],
+                   "id": [m.id for o, m in frames],
+                   "extended": [m.extended for o, m in frames],
+                   "dlc": [m.dlc for o, m in frames],
+                   "channel": [1, 1, 1],
+                   "data": [m.payload + [0] * (8 - m.dlc)
+                            for o, m in frames]}
+        self.driver = driver.SimCAN(trace=columns, trace_speed=0,
+                                    trace_loop=True)
+        self.assertEqual([m.id for m in self.__read(7)],
+                         [0x123, 0x18FF0001, 0x456] * 2 + [0x123])
+
+    def testTraceLossless(self):
+        # The replay waits for room instead of dropping frames
+        self.driver = driver.SimCAN(trace=self.__write_trace(),
+                                    trace_speed=0, trace_loop=True,
+                                    max_buffer_size=2, queue_delay=0.01)
+        subscription = self.driver.subscribe()
+        time.sleep(0.1)
+        frames = self.__read(30)
+        self.assertEqual(self.driver.inbound_dropped, 0)
+        self.assertEqual([m.id for m in frames],
+                         [0x123, 0x18FF0001, 0x456] * 10)
+        self.assertEqual(subscription.next_message(1).id, 0x123)
+
+        # Each pass is a new set of frames, one trace period later
+        self.assertEqual([m.time_stamp for m in frames[:7]],
+                         [10.0, 10.5, 11.0, 11.5, 12.0, 12.5, 13.0])
+        self.assertFalse(frames[0] is frames[3])
+
+    def testTraceTiming(self):
+        clock = VirtualClock()
+        self.driver = driver.SimCAN(trace=self.__write_trace(), clock=clock)
+        clock.run_until(0.6)
+        self.assertEqual([m.id for m in self.__read(2)], [0x123, 0x18FF0001])
+        time.sleep(0.1)
+        self.assertTrue(self.driver.inbound.empty())
+        clock.run_until(1.0)
+        self.assertEqual(self.__read(1)[0].id, 0x456)
+        self.assertTrue(self.driver.trace_done.wait(1))
+
+        # Twice as fast
+        self.driver.shutdown()
+        clock = VirtualClock()
+        self.driver = driver.SimCAN(trace=self.__write_trace(), clock=clock,
+                                    trace_speed=2)
+        clock.run_until(0.5)
+        self.assertEqual(len(self.__read(3)), 3)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(SimCANTests)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import unittest
+import pycan.tools.snapshot as snapshot
+import pycan.drivers.sim_can as sim_can
+from pycan.clock import VirtualClock
+from pycan.common import CANMessage
+from pycan.drivers.virtual_bus import VirtualBus
+
+
+class SnapshotTests(unittest.TestCase):
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the snapshot store
+        snap_path = os.path.dirname(snapshot.__file__)
+        snap_file = os.path.abspath(os.path.join(snap_path, 'snapshot.py'))
+        pep8_checker = pep8.Checker(snap_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testLatestValue(self):
+        clk = VirtualClock()
+        store = snapshot.SnapshotStore(clock=clk)
+        self.assertTrue(store.get(0x100) is None)
+        self.assertTrue(store.age(0x100) is None)
+
+        store.update(CANMessage(0x100, [1, 2]))
+        store.update(CANMessage(0x100, [3, 4, 5]))
+        store.update(CANMessage(0x100, [6], False))
+
+        record = store.get(0x100)
+        self.assertEqual(record.payload, [3, 4, 5])
+        self.assertEqual(record.dlc, 3)
+        self.assertEqual(record.count, 2)
+        self.assertEqual(store.get(0x100, False).payload, [6])
+        self.assertEqual(len(store), 2)
+        self.assertTrue((0x100, False) in store)
+
+        # Reads are copies
+        record.payload[0] = 0xFF
+        self.assertEqual(store.get(0x100).payload, [3, 4, 5])
+
+    def testAgeAndRate(self):
+        clk = VirtualClock()
+        store = snapshot.SnapshotStore(clock=clk)
+
+        for x in range(20):
+            store.update(CANMessage(0x100, [x]))
+            if x % 2 == 0:
+                store.update(CANMessage(0x200, [x]))
+            clk.advance(0.1)
+
+        self.assertAlmostEqual(store.rate(0x100), 10.0)
+        self.assertAlmostEqual(store.rate(0x200), 5.0)
+        self.assertEqual(store.rate(0x300), 0.0)
+
+        clk.advance(0.5)
+        self.assertAlmostEqual(store.age(0x100), 0.6)
+        self.assertAlmostEqual(store.age(0x200), 0.7)
+        self.assertEqual(store.stale(0.65), [(0x200, True)])
+        self.assertEqual(store.stale(1.0), [])
+
+        snap = store.snapshot()
+        self.assertEqual(sorted(snap), [(0x100, True), (0x200, True)])
+        self.assertEqual(snap[(0x100, True)].payload, [19])
+
+    def testDriverFeed(self):
+        bus = VirtualBus()
+        sender = sim_can.SimCAN(bus=bus)
+        receiver = sim_can.SimCAN(bus=bus)
+        store = snapshot.SnapshotStore(receiver)
+
+        for x in range(10):
+            sender.send(CANMessage(0x123, [x], False))
+
+        tic = time.time()
+        while store.get(0x123, False) is None or \
+                store.get(0x123, False).count < 10:
+            self.assertTrue(time.time() - tic < 5)
+            time.sleep(0.01)
+        self.assertEqual(store.get(0x123, False).payload, [9])
+
+        # Nobody has read the messages from the driver
+        self.assertEqual(receiver.life_time_received(), 0)
+
+        store.detach()
+        self.assertEqual(receiver.receive_taps, ())
+        sender.shutdown()
+        receiver.shutdown()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(SnapshotTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
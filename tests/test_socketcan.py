@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import threading
+import unittest
+import ConfigParser
+from ctypes import sizeof, set_errno
+import pycan.drivers.socketcan as driver
+from pycan.common import CANMessage, IDMaskFilter
+
+
+class SocketCANTests(unittest.TestCase):
+    def setUp(self):
+        self.drivers = []
+
+    def tearDown(self):
+        for d in self.drivers:
+            try:
+                d.shutdown()
+            except:
+                pass
+
+    def __load_test_config(self):
+        test_path = os.path.dirname(os.path.abspath(__file__))
+        config = ConfigParser.ConfigParser()
+        config.read(os.path.join(test_path, 'test.cfg'))
+
+        self.interface = config.get('SocketCAN', 'Interface')
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the CAN driver
+        driver_path = os.path.dirname(driver.__file__)
+        driver_file = os.path.abspath(os.path.join(driver_path,
+                                                   'socketcan.py'))
+        pep8_checker = pep8.Checker(driver_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testStructures(self):
+        # Must match the kernel's struct can_frame / struct can_filter
+        self.assertEqual(sizeof(driver.can_frame), 16)
+        self.assertEqual(sizeof(driver.can_filter), 8)
+
+        filters = driver.build_filters([IDMaskFilter(0x7F0, 0x120, False),
+                                        IDMaskFilter(0xFFFF, 0x1234)])
+        self.assertEqual(filters[0].can_id, 0x120)
+        self.assertEqual(filters[0].can_mask, 0xC00007F0)
+        self.assertEqual(filters[1].can_id, 0x80001234)
+        self.assertEqual(filters[1].can_mask, 0xC000FFFF)
+
+    def testDriver(self):
+        # Requires a configured (v)can interface, see socketcan.py
+        self.__load_test_config()
+
+        try:
+            self.driver = driver.SocketCAN(channel=self.interface)
+        except OSError as e:
+            self.skipTest("No SocketCAN interface {i}: {e}".format(
+                          i=self.interface, e=e))
+        self.drivers = [self.driver]
+        self.listener = driver.SocketCAN(
+            channel=self.interface,
+            filters=[IDMaskFilter(0x1FFFFFFF, 0x123456)])
+        self.drivers.append(self.listener)
+
+        self.Transmit()
+        self.FilteredReceive()
+
+    def Transmit(self):
+        for x in range(100):
+            self.assertTrue(self.driver.send(CANMessage(x, [x, 1, 2], False)))
+        self.driver.send(CANMessage(0x123456, [1, 2, 3]))
+
+        self.assertEqual(self.driver.life_time_sent(), 101)
+
+    def FilteredReceive(self):
+        # The standard frames never make it past the kernel filter
+        msg = self.listener.next_message(timeout=2)
+        self.assertEqual(msg.id, 0x123456)
+        self.assertEqual(msg.payload, [1, 2, 3])
+        self.assertTrue(msg.extended)
+        self.assertTrue(msg.time_stamp > 0)
+        self.assertEqual(self.listener.life_time_received(), 1)
+
+    def testSendBackOff(self):
+        # A driver without a socket, sendmmsg is played by FakeLibc
+        class FakeLibc(object):
+            def __init__(self, results):
+                self.results = list(results)
+                self.calls = []
+
+            def sendmmsg(self, fd, msgs, length, flags):
+                self.calls.append(length)
+                result = self.results.pop(0)
+                if result < 0:
+                    set_errno(-result)
+                    return -1
+                return min(result, length)
+
+        can = driver.SocketCAN.__new__(driver.SocketCAN)
+        can._fd = -1
+        can.queue_delay = 1
+        can.verbose = False
+        can._running = threading.Event()
+        can._running.set()
+        can.outbound_dropped = 0
+        can.tx_errors = 0
+        can.last_error = None
+        send_batch = can._SocketCAN__send_batch
+        batch = driver._FrameBatch(4)
+
+        saved = driver._libc
+        try:
+            # A full transmit queue is waited out
+            driver._libc = FakeLibc([2, -driver.ENOBUFS, -driver.EAGAIN,
+                                     -driver.EINTR, 2])
+            self.assertEqual(send_batch(batch, 4), 4)
+            self.assertEqual(driver._libc.calls, [4, 2, 2, 2, 2])
+            self.assertEqual(can.outbound_dropped, 0)
+            self.assertEqual(can.tx_errors, 0)
+
+            # Other errors drop the rest of the batch and are reported
+            driver._libc = FakeLibc([1, -9])
+            self.assertEqual(send_batch(batch, 4), 1)
+            self.assertEqual(can.outbound_dropped, 3)
+            self.assertEqual(can.tx_errors, 1)
+            self.assertEqual(can.last_error.errno, 9)
+
+            # So is a queue that stays full
+            can.queue_delay = 0.01
+            driver._libc = FakeLibc([-driver.ENOBUFS] * 1000)
+            self.assertEqual(send_batch(batch, 4), 0)
+            self.assertEqual(can.outbound_dropped, 7)
+            self.assertEqual(can.last_error.errno, driver.ENOBUFS)
+        finally:
+            driver._libc = saved
+
+    def testPeriodicCount(self):
+        # Broadcast manager frames are counted from their periods
+        class FakeLibc(object):
+            def close(self, fd):
+                return 0
+
+        can = driver.SocketCAN.__new__(driver.SocketCAN)
+        can.outbound_count = 5
+        can._bcm_sent = 0
+        can._bcm = {"status": (-1, 0x123, False, 0.1, time.time() - 1.05)}
+        self.assertEqual(can.life_time_sent(), 15)
+
+        saved = driver._libc
+        try:
+            driver._libc = FakeLibc()
+            self.assertTrue(can.stop_periodic("status"))
+        finally:
+            driver._libc = saved
+        self.assertEqual(can.periodic_count(), 10)
+        self.assertEqual(can.life_time_sent(), 15)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(SocketCANTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import pycan.tools.tail as tail
+from pycan.tools.benchmark import RecordingDriver
+
+HEADER = "date Mon Jan 1 00:00:00 2013\nbase hex  timestamps absolute\n"
+
+
+def frame_line(x):
+    line = "   %d.000 1  %X             Rx   d 1 %02X\n"
+    return line % (x, 0x100 + x, x & 0xFF)
+
+
+class TailTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "live.asc")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def append(self, data):
+        with open(self.path, "a") as trace:
+            trace.write(data)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the tail module
+        tail_path = os.path.dirname(tail.__file__)
+        tail_file = os.path.abspath(os.path.join(tail_path, 'tail.py'))
+        pep8_checker = pep8.Checker(tail_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testPartialLines(self):
+        for use_inotify in (True, False):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            follow = tail.FileTail(self.path, use_inotify=use_inotify)
+
+            # The file does not exist yet
+            self.assertEqual(follow.read_lines(), [])
+
+            self.append("one\ntw")
+            self.assertEqual(follow.read_lines(), ["one\n"])
+            self.assertEqual(follow.offset, 4)
+            self.assertEqual(follow.read_lines(), [])
+
+            self.append("o\nthree\n")
+            self.assertEqual(follow.read_lines(), ["two\n", "three\n"])
+            self.assertEqual(follow.offset, 14)
+            follow.close()
+
+            # Resume from a saved offset
+            follow = tail.FileTail(self.path, offset=4,
+                                   use_inotify=use_inotify)
+            self.assertEqual(follow.read_lines(), ["two\n", "three\n"])
+            follow.close()
+
+    def testTruncateAndReplace(self):
+        self.append("a\nb\n")
+        follow = tail.FileTail(self.path)
+        self.assertEqual(follow.read_lines(), ["a\n", "b\n"])
+
+        # Truncated in place
+        with open(self.path, "w") as trace:
+            trace.write("c\n")
+        self.assertEqual(follow.read_lines(), ["c\n"])
+
+        # Rotated: a new file under the same name
+        os.rename(self.path, self.path + ".1")
+        self.append("d\n")
+        self.assertEqual(follow.read_lines(), ["d\n"])
+        self.assertEqual(follow.offset, 2)
+        follow.close()
+
+    def testWaitWakesUp(self):
+        self.append("a\n")
+        follow = tail.FileTail(self.path, poll_interval=5)
+        follow.read_lines()
+
+        timer = threading.Timer(0.1, self.append, ["b\n"])
+        timer.start()
+        tic = time.time()
+        follow.wait()
+        if follow.use_inotify:
+            self.assertTrue(time.time() - tic < 2)
+        self.assertEqual(follow.read_lines(), ["b\n"])
+        timer.join()
+        follow.close()
+
+    def testTraceFollower(self):
+        self.append(HEADER + frame_line(1))
+        driver = RecordingDriver()
+        received = []
+        follower = tail.TraceFollower(self.path, driver=driver,
+                                      handler=received.append,
+                                      poll_interval=0.01)
+        follower.start()
+
+        # Written in pieces, including half a line
+        text = "".join(frame_line(x) for x in range(2, 20))
+        for x in range(0, len(text), 37):
+            self.append(text[x:x + 37])
+            time.sleep(0.005)
+
+        tic = time.time()
+        while follower.message_count < 19 and time.time() - tic < 5:
+            time.sleep(0.01)
+        follower.stop()
+
+        self.assertEqual([m.id for m in received],
+                         [0x100 + x for x in range(1, 20)])
+        self.assertEqual(received[-1].payload, [19])
+        self.assertEqual(len(driver.sent_times), 19)
+
+    def testPoll(self):
+        self.append(HEADER)
+        follower = tail.TraceFollower(self.path)
+        self.assertEqual(follower.poll(), [])
+        self.append(frame_line(1) + frame_line(2)[:10])
+        self.assertEqual([m.id for m in follower.poll()], [0x101])
+        self.append(frame_line(2)[10:])
+        self.assertEqual([m.id for m in follower.poll()], [0x102])
+        follower.stop()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TailTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
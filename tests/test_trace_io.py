@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import bz2
+import gzip
+import shutil
+import tempfile
+import unittest
+import pycan.tools.trace_io as trace_io
+from pycan.tools.parsers import asc
+
+HEADER = "date Mon Jan 1 00:00:00 2013\nbase hex  timestamps absolute\n"
+
+
+def frame_line(x):
+    line = "   %d.000 1  %X             Rx   d 1 %02X\n"
+    return line % (x, 0x100 + x, x & 0xFF)
+
+
+class TraceIOTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lines = HEADER.splitlines(True)
+        self.lines += [frame_line(x) for x in range(1000)]
+        self.plain = os.path.join(self.dir, "trace.asc")
+        with open(self.plain, "w") as trace:
+            trace.writelines(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the trace_io module
+        io_path = os.path.dirname(trace_io.__file__)
+        io_file = os.path.abspath(os.path.join(io_path, 'trace_io.py'))
+        pep8_checker = pep8.Checker(io_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testFormats(self):
+        gz_path = os.path.join(self.dir, "trace.asc.gz")
+        bz_path = os.path.join(self.dir, "trace.asc.bz2")
+        blk_path = os.path.join(self.dir, "trace.asc.blk")
+        with gzip.GzipFile(gz_path, "wb") as trace:
+            trace.writelines(self.lines)
+        with open(bz_path, "wb") as trace:
+            trace.write(bz2.compress("".join(self.lines)))
+        trace_io.compress_trace(self.plain, blk_path, block_size=4096)
+
+        expected = [("plain", self.plain), ("gzip", gz_path),
+                    ("bz2", bz_path), ("block", blk_path)]
+        for compression, path in expected:
+            self.assertEqual(trace_io.trace_format(path), compression)
+            for prefetch in (False, True):
+                with trace_io.open_trace(path, prefetch) as trace:
+                    self.assertEqual(list(trace), self.lines)
+
+    def testOptionalFormats(self):
+        xz_path = os.path.join(self.dir, "trace.asc.xz")
+        with open(xz_path, "wb") as trace:
+            trace.write(trace_io.XZ_MAGIC + "\x00" * 32)
+        self.assertEqual(trace_io.trace_format(xz_path), "xz")
+        if trace_io.lzma is None:
+            self.assertRaises(IOError, trace_io.open_trace, xz_path)
+
+        if trace_io.lzma is not None:
+            with open(xz_path, "wb") as trace:
+                trace.write(trace_io.lzma.compress("".join(self.lines)))
+            with trace_io.open_trace(xz_path) as trace:
+                self.assertEqual(list(trace), self.lines)
+
+        if trace_io.zstandard is not None:
+            zst_path = os.path.join(self.dir, "trace.asc.zst")
+            compressor = trace_io.zstandard.ZstdCompressor()
+            with open(zst_path, "wb") as trace:
+                trace.write(compressor.compress("".join(self.lines)))
+            with trace_io.open_trace(zst_path) as trace:
+                self.assertEqual(list(trace), self.lines)
+
+    def testBlockSeek(self):
+        blk_path = os.path.join(self.dir, "trace.asc.blk")
+        with trace_io.BlockWriter(blk_path, block_size=1000) as writer:
+            writer.writelines(self.lines)
+
+        with trace_io.BlockReader(blk_path) as reader:
+            self.assertEqual(reader.line_count, len(self.lines))
+            self.assertTrue(reader.block_count > 10)
+            for line_number in (0, 1, 37, 500, len(self.lines) - 1):
+                reader.seek_line(line_number)
+                self.assertEqual(list(reader), self.lines[line_number:])
+
+    def testPrefetchClose(self):
+        # Closing before the end stops the reader thread
+        trace = trace_io.PrefetchReader(trace_io.open_trace(self.plain),
+                                        chunk_lines=10, chunks=2)
+        lines = iter(trace)
+        self.assertEqual(next(lines), self.lines[0])
+        trace.close()
+        self.assertFalse(trace._thread.is_alive())
+
+    def testPrefetchError(self):
+        class FailingTrace(object):
+            # Any exception, not only the I/O ones
+            def __iter__(self):
+                for x in range(5):
+                    yield "line %d\n" % x
+                raise KeyError("decoder")
+
+            def close(self):
+                pass
+
+        with trace_io.PrefetchReader(FailingTrace(), chunk_lines=2) as trace:
+            lines = []
+            try:
+                for line in trace:
+                    lines.append(line)
+            except KeyError:
+                pass
+            else:
+                self.fail("The reader thread's error was not raised")
+        self.assertEqual(len(lines), 5)
+
+    def testReadColumns(self):
+        gz_path = os.path.join(self.dir, "trace.asc.gz")
+        with gzip.GzipFile(gz_path, "wb") as trace:
+            trace.writelines(self.lines)
+        columns = asc.read_columns(gz_path)
+        self.assertEqual(list(columns["id"]),
+                         [0x100 + x for x in range(1000)])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TraceIOTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
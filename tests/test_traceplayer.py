@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import pycan.tools.traceplayer as traceplayer
+from pycan.drivers.basedriver import BaseDriverAPI
+from pycan.tools.parsers.asc import ASCParser
+from pycan.tools.traceplayer import TracePlayer
+
+HEADER = "date Mon Jan 1 00:00:00 2013\nbase hex  timestamps absolute\n"
+
+
+def frame_line(ts, x):
+    line = "   %.3f 1  %X             Rx   d 1 %02X\n"
+    return line % (ts, 0x100 + x, x & 0xFF)
+
+
+class TimedDriver(BaseDriverAPI):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append((time.time(), message))
+        return True
+
+
+class SlowParser(ASCParser):
+    """Parser stalling every few lines like a slow disk"""
+    def parse_timed(self, line):
+        if " d " in line and int(line.split()[2], 16) % 10 == 0:
+            time.sleep(0.05)
+        return ASCParser.parse_timed(self, line)
+
+
+class TracePlayerTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "trace.asc")
+        with open(self.path, "w") as trace:
+            trace.write(HEADER)
+            for x in range(50):
+                trace.write(frame_line(x * 0.01, x))
+                # Remote frames only add to the delay
+                trace.write("   %.3f 1  7FF             Rx   r\n" %
+                            (x * 0.01 + 0.005))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the traceplayer module
+        tp_path = os.path.dirname(traceplayer.__file__)
+        tp_file = os.path.abspath(os.path.join(tp_path, 'traceplayer.py'))
+        pep8_checker = pep8.Checker(tp_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def play(self, parser, lookahead):
+        driver = TimedDriver()
+        player = TracePlayer(driver, parser, [self.path],
+                             lookahead=lookahead)
+        player.play()
+        tic = time.time()
+        while len(driver.sent) < 50 and time.time() - tic < 5:
+            time.sleep(0.01)
+        player.stop()
+        return driver, player
+
+    def testTiming(self):
+        driver, player = self.play(SlowParser(), 100)
+        self.assertEqual([m.id for t, m in driver.sent[:50]],
+                         [0x100 + x for x in range(50)])
+
+        # Sent on the trace's schedule, parsing stalls are absorbed by the
+        # buffer
+        start = driver.sent[0][0]
+        for x, (sent, msg) in enumerate(driver.sent[:50]):
+            self.assertAlmostEqual(sent - start, x * 0.01, delta=0.005)
+        self.assertEqual(player.stats()["underruns"], 0)
+        self.assertEqual(player.stats()["frames_sent"], 50)
+
+    def testUnderruns(self):
+        # Without lookahead the stalls starve the sender
+        driver, player = self.play(SlowParser(), 1)
+        self.assertTrue(player.stats()["underruns"] > 0)
+        self.assertTrue(player.stats()["max_late"] > 0.005)
+
+    def testParseLineOnly(self):
+        class LineParser(object):
+            def __init__(self, use_wall):
+                self.parser = ASCParser(use_wall=use_wall)
+
+            def parse_line(self, line):
+                return self.parser.parse_line(line)
+
+        driver, player = self.play(LineParser(False), 10)
+        self.assertEqual(len(driver.sent), 50)
+
+        # The parser's own timing reaches the bus unbuffered
+        driver, player = self.play(LineParser(True), 1000)
+        self.assertEqual([m.id for t, m in driver.sent],
+                         [0x100 + x for x in range(50)])
+        times = [t for t, m in driver.sent]
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        self.assertTrue(min(gaps) > 0.009, msg=min(gaps))
+        self.assertTrue(times[-1] - times[0] < 0.49 * 1.5)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TracePlayerTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import time
+import unittest
+import pycan.tools.traffic_generator as generator
+from pycan.clock import VirtualClock
+from pycan.common import frame_bits
+from pycan.drivers.basedriver import BaseDriverAPI
+
+
+class RecordingDriver(BaseDriverAPI):
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append((self.clock.time(), message))
+        return True
+
+
+class TrafficGeneratorTests(unittest.TestCase):
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the generator
+        tool_path = os.path.dirname(generator.__file__)
+        tool_file = os.path.abspath(os.path.join(tool_path,
+                                                 'traffic_generator.py'))
+        pep8_checker = pep8.Checker(tool_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testDistributions(self):
+        driver = RecordingDriver(VirtualClock())
+        gen = generator.TrafficGenerator(driver, ids={0x10: 1, 0x20: 3},
+                                         dlc=[2, 4], payload="zeros",
+                                         pool_size=400, seed=1)
+
+        ids = [m.id for m in gen.pool]
+        self.assertEqual(set(ids), set([0x10, 0x20]))
+        self.assertTrue(ids.count(0x20) > 2 * ids.count(0x10))
+        self.assertEqual(set(m.dlc for m in gen.pool), set([2, 4]))
+        self.assertEqual(gen.pool[0].payload, [0] * gen.pool[0].dlc)
+
+        # Same seed, same traffic
+        again = generator.TrafficGenerator(driver, ids={0x10: 1, 0x20: 3},
+                                           dlc=[2, 4], payload="zeros",
+                                           pool_size=400, seed=1)
+        self.assertEqual(ids, [m.id for m in again.pool])
+
+    def testPacing(self):
+        clk = VirtualClock()
+        driver = RecordingDriver(clk)
+        gen = generator.TrafficGenerator(driver, rate=1000)
+
+        gen.start(duration=1.0)
+        while clk.next_event() is None:
+            time.sleep(.001)
+        clk.run_until(2.0)
+        gen.stop()
+
+        stats = gen.stats()
+        self.assertEqual(stats["frames_sent"], 1000)
+        self.assertAlmostEqual(stats["achieved_rate"], 1000.0)
+        self.assertEqual(stats["late_slots"], 0)
+
+        times = [t for t, m in driver.sent]
+        self.assertAlmostEqual(times[1] - times[0], 0.001)
+
+    def testBusLoadBursts(self):
+        clk = VirtualClock()
+        driver = RecordingDriver(clk)
+        gen = generator.TrafficGenerator(driver, dlc=8, bus_load=0.5,
+                                         bit_rate=500000, burst=10)
+
+        # 8 byte standard frames are 111 bits long
+        self.assertEqual(gen.mean_frame_bits, frame_bits(gen.pool[0]))
+        self.assertAlmostEqual(gen.rate, 250000 / 111.0)
+
+        gen.start(duration=1.0)
+        while clk.next_event() is None:
+            time.sleep(.001)
+        clk.run_until(2.0)
+        gen.stop()
+
+        stats = gen.stats()
+        self.assertAlmostEqual(stats["achieved_bus_load"], 0.5, places=2)
+
+        # Frames leave in back to back groups of 10
+        times = [t for t, m in driver.sent]
+        self.assertEqual(times[0], times[9])
+        self.assertTrue(times[10] > times[9])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TrafficGeneratorTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)
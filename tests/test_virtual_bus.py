@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 The pycan developers. All rights reserved.
+# Project site: https://github.com/questrail/pycan
+# Use of this source code is governed by a MIT-style license that
+# can be found in the LICENSE.txt file for the project.
+import os
+import unittest
+import pycan.drivers.virtual_bus as virtual_bus
+import pycan.drivers.sim_can as sim_can
+from pycan.common import CANMessage, CANMessagePool, IDMaskFilter
+
+
+class VirtualBusTests(unittest.TestCase):
+    def testPEP8Compliance(self):
+        # Ensure PEP8 is installed
+        try:
+            import pep8
+        except ImportError:
+            self.fail(msg="PEP8 not installed.")
+
+        # Check the virtual bus
+        bus_path = os.path.dirname(virtual_bus.__file__)
+        bus_file = os.path.abspath(os.path.join(bus_path, 'virtual_bus.py'))
+        pep8_checker = pep8.Checker(bus_file)
+        violation_count = pep8_checker.check_all()
+        error_message = "PEP8 violations found: %d" % (violation_count)
+        self.assertTrue(violation_count == 0, msg=error_message)
+
+    def testBroadcastFilters(self):
+        bus = virtual_bus.VirtualBus()
+        rx_all = []
+        rx_filtered = []
+        rx_sender = []
+
+        sender = bus.attach(rx_sender.append)
+        bus.attach(rx_all.append)
+        bus.attach(rx_filtered.append, [IDMaskFilter(0x7FF, 0x123, False)])
+
+        msg1 = CANMessage(0x123, [1, 2], False)
+        msg2 = CANMessage(0x456, [3, 4], False)
+        self.assertEqual(sender.send(msg1), 2)
+        self.assertEqual(sender.send(msg2), 1)
+
+        self.assertEqual(rx_all, [msg1, msg2])
+        self.assertEqual(rx_filtered, [msg1])
+        self.assertEqual(rx_sender, [])
+
+        # Every node receives the very same object (no copies)
+        self.assertTrue(rx_all[0] is rx_filtered[0] is msg1)
+
+    def testPooledMessages(self):
+        # Every node gets (and releases) its own reference
+        bus = virtual_bus.VirtualBus()
+        received = []
+        sender = bus.attach(received.append)
+        bus.attach(received.append)
+        bus.attach(received.append)
+        pool = CANMessagePool(1)
+        msg = pool.acquire(0x123, [1], False)
+
+        self.assertEqual(sender.send(msg), 2)
+        for node_msg in received:
+            node_msg.release()
+        self.assertEqual(pool.available(), 0)
+        msg.release()
+        self.assertEqual(pool.available(), 1)
+        self.assertEqual(pool.double_releases, 0)
+
+    def testLoopbackAndDetach(self):
+        bus = virtual_bus.VirtualBus()
+        rx_echo = []
+        rx_other = []
+
+        echo = bus.attach(rx_echo.append, loopback=True)
+        other = bus.attach(rx_other.append)
+
+        msg = CANMessage(0x1234, [1])
+        echo.send(msg)
+        self.assertEqual(rx_echo, [msg])
+
+        other.detach()
+        echo.send(msg)
+        self.assertEqual(rx_other, [msg])
+        self.assertEqual(bus.frame_count, 2)
+
+    def testSimCANNodes(self):
+        bus_name = "test_sim_can_nodes"
+        node1 = sim_can.SimCAN(bus=bus_name)
+        node2 = sim_can.SimCAN(bus=bus_name)
+        self.assertTrue(node1.bus is node2.bus)
+
+        msg = CANMessage(0x18FF0001, [1, 2, 3])
+        node1.send(msg)
+
+        self.assertTrue(node2.next_message(timeout=2) is msg)
+        self.assertEqual(node1.next_message(timeout=.1), None)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(VirtualBusTests)
+    unittest.TextTestRunner(verbosity=2).run(suite)